@@ -1,92 +1,428 @@
 # app.py
 import os
-from flask import Flask, render_template, Response, jsonify, request
-import pickle
-import app_camera  # Solo se usa la lógica de cámara
+import threading
+import time
+from datetime import datetime
+from flask import Flask, Blueprint, render_template, Response, jsonify, request
+import camera_pool  # Registro de cámaras (cada una con su VideoProcessor y sus ROI)
+import history
+import live_feed
+import metrics
+import reservations
+import spatial_index
+from auth import auth_bp, login_required
+from reservations import json_with_etag
+from database import db, ExpiryScheduler
 
-app = Flask(__name__)
-app.secret_key = os.environ.get('FLASK_SECRET', 'replace-in-prod')
+# 'threaded': servidor de Flask (un hilo por conexión); 'async': asgi.py con uvicorn
+SERVER_MODE = os.environ.get('SERVER_MODE', 'threaded').lower()
+SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('SERVER_PORT', 5000))
 
-video_processor = None  # Instancia global de app_camera.VideoProcessor
+# Rutas de cámaras, estado e historial; create_app() la registra junto a auth y reservas
+camera_bp = Blueprint('camera', __name__)
 
-def start_video_processor_if_needed():
-    global video_processor
-    if video_processor is None:
-        CAMERA_SOURCE = os.environ.get('CAMERA_SOURCE', '0')
-        video_processor = app_camera.VideoProcessor(CAMERA_SOURCE)
-    return video_processor
+# Registro global de cámaras; cada endpoint acepta ?camera=<id> (por defecto la primera)
+registry = camera_pool.CameraRegistry(camera_pool.load_camera_configs())
 
-def stop_video_processor():
-    global video_processor
-    if video_processor is not None:
-        try:
-            video_processor.stop()
-        except Exception:
-            pass
-        video_processor = None
+def camera_id_from_request():
+    """Id de cámara pedido por query string o JSON (None -> cámara por defecto)"""
+    cam_id = request.args.get('camera')
+    if cam_id is None and request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            cam_id = body.get('camera')
+    return cam_id
+
+def start_video_processor_if_needed(cam_id=None):
+    return registry.get(cam_id)
+
+def stop_video_processor(cam_id=None):
+    registry.stop(cam_id)
+
+def unknown_camera(cam_id):
+    return jsonify({'error': 'unknown camera', 'camera': cam_id, 'cameras': registry.ids()}), 404
+
+# Feeds SSE por cámara (o 'lote' para todas); se crean al conectarse el primer cliente
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+def reserved_indices(offset, count):
+    """Índices (base 0, relativos a la cámara) de los espacios con reserva activa"""
+    for space_number in db.get_active_reservations():
+        idx = int(space_number) - 1 - offset
+        if 0 <= idx < count:
+            yield idx
+
+def get_feed(cam_id=None):
+    """OccupancyFeed de una cámara (cam_id) o del lote completo (cam_id='lote')"""
+    key = cam_id or registry.default_id
+    with _feeds_lock:
+        feed = _feeds.get(key)
+        if feed is None:
+            if key == 'lote':
+                get_estado = registry.lot_estado
+                window = lambda: (0, sum(c for _, _, c in registry.lot_offsets()))
+            else:
+                cfg = registry.config(key)
+                get_estado = lambda: registry.get(cfg.id).get_estado_espacios()
+                window = lambda: next((o, c) for cid, o, c in registry.lot_offsets() if cid == cfg.id)
+            feed = live_feed.OccupancyFeed(get_estado, lambda: reserved_indices(*window()))
+            _feeds[key] = feed
+        return feed
+
+def kick_feeds(event=None):
+    with _feeds_lock:
+        feeds = list(_feeds.values())
+    for feed in feeds:
+        feed.kick()
+
+# Cualquier cambio en las reservas se empuja a los clientes SSE sin esperar al siguiente muestreo
+db.add_listener(kick_feeds)
+
+# Expira las reservas al llegar su end_time (con una puesta al día al arrancar)
+expiry_scheduler = ExpiryScheduler(db)
+
+# Historial de ocupación: solo transiciones, escritas por lotes en segundo plano
+occupancy_history = history.OccupancyHistory(db)
+registry.add_listener(lambda cam_id, estado, ts: occupancy_history.record(cam_id, registry.offset(cam_id), estado, ts))
+
+def start_services():
+    """Arrancar los hilos de fondo (idempotente: create_app() puede llamarse varias veces)"""
+    expiry_scheduler.start()
+    occupancy_history.start()
+    registry.watch_layouts()
+
+def stop_services():
+    """Parar las cámaras que quedaron vivas y escribir el historial pendiente"""
+    registry.stop_watching()
+    stop_video_processor()
+    expiry_scheduler.stop()
+    occupancy_history.stop()
+
+def history_window():
+    """(inicio, fin) en segundos Unix desde ?inicio=&fin= (ISO 8601); por defecto las últimas 24 h"""
+    end = reservations.parse_time(request.args.get('fin'))
+    end = end.timestamp() if end else time.time()
+    start = reservations.parse_time(request.args.get('inicio'))
+    start = start.timestamp() if start else end - 86400
+    if end <= start:
+        raise ValueError('fin debe ser posterior a inicio')
+    return start, end
 
-# ----------------- Rutas web -----------------
-@app.route('/')
+def history_resolution(start, end):
+    value = request.args.get('resolucion', 'hour' if end - start > 6 * 3600 else 'minute')
+    return {'minuto': 'minute', 'hora': 'hour'}.get(value, value)
+
+# ----------------- Páginas -----------------
+# Se registran en la aplicación (no en el blueprint): las plantillas usan url_for('index'),
+# url_for('mapa') y url_for('reservas')
 def index():
+    return render_template('index.html')
+
+def mapa():
     return render_template('mapa.html')
 
+@login_required
+def reservas():
+    return render_template('reservas.html')
 
-def mjpeg_generator():
-    start_video_processor_if_needed()
-    while True:
-        frame = video_processor.get_frame_bytes()
-        if frame is None:
-            import time; time.sleep(0.05)
-            continue
+# ----------------- Rutas de cámaras -----------------
+def unknown_tier(processor, tier):
+    return jsonify({'error': 'unknown tier', 'tier': tier, 'tiers': processor.broadcaster.get_tiers_info()}), 400
+
+def mjpeg_generator(processor, tier=None):
+    # El broadcaster codifica cada frame una sola vez por nivel y lo comparte entre todos los
+    # clientes; un cliente lento simplemente recibe el frame más reciente y se salta los intermedios.
+    for frame in processor.broadcaster.stream(tier=tier):
         yield (b'--frame\r\n'
                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
-@app.route('/video_feed')
+@camera_bp.route('/video_feed')
 def video_feed():
-    start_video_processor_if_needed()
-    return Response(mjpeg_generator(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    cam_id = camera_id_from_request()
+    try:
+        processor = start_video_processor_if_needed(cam_id)
+    except KeyError:
+        return unknown_camera(cam_id)
+    # ?tier=<nivel> (full, 640p, thumb... ver STREAM_TIERS); sin él, el primero
+    tier = request.args.get('tier') or None
+    if not processor.broadcaster.has_tier(tier):
+        return unknown_tier(processor, tier)
+    return Response(mjpeg_generator(processor, tier), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 # Endpoint devuelve estado de ocupación (array de booleanos)
-@app.route('/api/estado')
+@camera_bp.route('/api/estado')
 def api_estado():
-    start_video_processor_if_needed()
-    return jsonify(video_processor.get_estado_espacios())
+    cam_id = camera_id_from_request()
+    try:
+        processor = start_video_processor_if_needed(cam_id)
+    except KeyError:
+        return unknown_camera(cam_id)
+    # ETag por versión del estado: si no cambió, 304 sin construir la lista
+    return json_with_etag(processor.estado_etag(), processor.get_estado_espacios)
+
+# Transiciones confirmadas (libre <-> ocupado) de una cámara: ?since=<seq> para pedir solo las nuevas
+@camera_bp.route('/api/eventos')
+def api_eventos():
+    cam_id = camera_id_from_request()
+    try:
+        processor = start_video_processor_if_needed(cam_id)
+        since = int(request.args.get('since', 0))
+    except KeyError:
+        return unknown_camera(cam_id)
+    except ValueError:
+        return jsonify({'error': 'since must be an integer'}), 400
+    return jsonify([
+        {'seq': seq, 'timestamp': ts, 'indice': idx, 'ocupado': ocupado}
+        for seq, ts, idx, ocupado in processor.get_eventos(since)
+    ])
 
 # Endpoint devuelve coordenadas de espacios (x,y,w,h)
-@app.route('/api/espacios')
+@camera_bp.route('/api/espacios')
 def api_espacios():
-    # devolvemos la variable actual de app_camera (aseguramos que se lea la variable del módulo)
-    return jsonify(app_camera.espacios)
+    cam_id = camera_id_from_request()
+    try:
+        return jsonify(registry.config(cam_id).espacios)
+    except KeyError:
+        return unknown_camera(cam_id)
+
+# Lista de cámaras configuradas y su rango en la numeración global del lote
+@camera_bp.route('/api/camaras')
+def api_camaras():
+    running = registry.running()
+    return jsonify([
+        {'id': cam_id, 'offset': offset, 'count': count, 'running': cam_id in running}
+        for cam_id, offset, count in registry.lot_offsets()
+    ])
+
+# Estado de todo el lote (todas las cámaras en una sola numeración)
+@camera_bp.route('/api/lote/estado')
+def api_lote_estado():
+    return json_with_etag(registry.lot_etag(), registry.lot_estado)
+
+# Stream SSE de ocupación: snapshot inicial y luego solo deltas (space_index, ocupado, reservado).
+# ?camera=<id> para una cámara, ?camera=lote para todo el lote; reanuda con Last-Event-ID o ?since=
+@camera_bp.route('/api/stream/estado')
+def api_stream_estado():
+    cam_id = camera_id_from_request()
+    try:
+        feed = get_feed(cam_id)
+    except KeyError:
+        return unknown_camera(cam_id)
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    return Response(live_feed.sse_stream(feed, since), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Espacios del lote sin reservas activas en una ventana: ?inicio=<ISO>&fin=<ISO>
+@camera_bp.route('/api/lote/libres')
+def api_lote_libres():
+    try:
+        start_time = reservations.parse_time(request.args.get('inicio')) or datetime.now()
+        end_time = reservations.parse_time(request.args.get('fin'))
+    except ValueError:
+        return jsonify({'error': 'inicio/fin deben ser fechas ISO 8601'}), 400
+    if end_time is None or end_time <= start_time:
+        return jsonify({'error': 'fin debe ser posterior a inicio'}), 400
+    total = sum(count for _, _, count in registry.lot_offsets())
+    return jsonify(db.get_free_spaces(start_time, end_time, range(1, total + 1)))
+
+@camera_bp.route('/api/lote/espacios')
+def api_lote_espacios():
+    return jsonify(registry.lot_espacios())
+
+# Búsqueda de espacios libres y sin reserva cercanos (índice espacial por versión de layout)
+nearest_spaces = spatial_index.NearestFreeSpaces(registry, db.get_active_snapshot)
+
+# Los k espacios libres y sin reserva más cercanos a uno o varios puntos de entrada:
+# ?punto=x,y (repetible) en coordenadas del lote, o en píxeles de una cámara con ?camera=<id>; ?k=5
+@camera_bp.route('/api/lote/cercanos')
+def api_lote_cercanos():
+    cam_id = request.args.get('camera')
+    try:
+        points = [[float(v) for v in p.split(',')] for p in request.args.getlist('punto')]
+        k = int(request.args.get('k', 5))
+    except ValueError:
+        points = None
+    if not points or any(len(p) != 2 for p in points):
+        return jsonify({'error': 'se esperaba ?punto=x,y (uno o más) y ?k=<entero>'}), 400
+    try:
+        return jsonify(nearest_spaces.query(points, k, cam_id))
+    except KeyError:
+        return unknown_camera(cam_id)
 
 # Endpoint para iniciar cámara explícitamente (útil para botón "Conectar")
-@app.route('/api/start_camera', methods=['POST'])
+@camera_bp.route('/api/start_camera', methods=['POST'])
 def api_start_camera():
-    start_video_processor_if_needed()
+    cam_id = camera_id_from_request()
+    try:
+        start_video_processor_if_needed(cam_id)
+    except KeyError:
+        return unknown_camera(cam_id)
     return jsonify({'ok': True})
 
-# Endpoint para detener la cámara (útil para botón "Desconectar")
-@app.route('/api/stop_camera', methods=['POST'])
+# Endpoint para detener la cámara (útil para botón "Desconectar"); sin ?camera detiene todas
+@camera_bp.route('/api/stop_camera', methods=['POST'])
 def api_stop_camera():
-    stop_video_processor()
+    cam_id = camera_id_from_request()
+    try:
+        stop_video_processor(cam_id)
+    except KeyError:
+        return unknown_camera(cam_id)
     return jsonify({'ok': True})
 
+# Métricas del pipeline de vídeo (profundidad de colas, drops y latencias por etapa)
+@camera_bp.route('/api/pipeline_stats')
+def api_pipeline_stats():
+    cam_id = camera_id_from_request()
+    try:
+        processor = registry.get(cam_id, start=False)
+    except KeyError:
+        return unknown_camera(cam_id)
+    if processor is None:
+        return jsonify({'running': False})
+    return jsonify(dict(processor.get_pipeline_stats(), running=True))
+
+# Motor de detección de una cámara: GET devuelve nombre, umbrales y coste por frame;
+# POST {"detector": "mog2"|"adaptive"|"reference", "options": {...}} lo cambia en caliente
+@camera_bp.route('/api/detector', methods=['GET', 'POST'])
+def api_detector():
+    cam_id = camera_id_from_request()
+    try:
+        cfg = registry.config(cam_id)
+    except KeyError:
+        return unknown_camera(cam_id)
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        try:
+            registry.set_detector(cfg.id, body.get('detector'), body.get('options'))
+        except (ValueError, TypeError, FileNotFoundError) as e:
+            return jsonify({'error': str(e)}), 400
+    processor = registry.get(cfg.id, start=False)
+    if processor is None:
+        return jsonify({'name': cfg.detector, 'options': cfg.detector_options, 'running': False})
+    return jsonify(dict(processor.get_detector_info(), options=cfg.detector_options, running=True))
+
+# Utilización (segundos ocupados por cubo) del lote o de un espacio: ?inicio=&fin=&resolucion=minuto|hora&espacio=N
+@camera_bp.route('/api/historial/utilizacion')
+def api_historial_utilizacion():
+    try:
+        start, end = history_window()
+        resolution = history_resolution(start, end)
+        space = request.args.get('espacio', type=int)
+        spaces = sum(count for _, _, count in registry.lot_offsets())
+        series = occupancy_history.utilization(start, end, resolution, space, spaces)
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'inicio': start, 'fin': end, 'resolucion': resolution, 'espacio': space, 'serie': series})
+
+# Utilización total por espacio en la ventana (para mapas de calor / planificación de capacidad)
+@camera_bp.route('/api/historial/espacios')
+def api_historial_espacios():
+    try:
+        start, end = history_window()
+        result = occupancy_history.space_summary(start, end, history_resolution(start, end))
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+# Transiciones crudas de un espacio: ?espacio=N&inicio=&fin=
+@camera_bp.route('/api/historial/eventos')
+def api_historial_eventos():
+    space = request.args.get('espacio', type=int)
+    if space is None:
+        return jsonify({'error': 'espacio requerido'}), 400
+    try:
+        start, end = history_window()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(occupancy_history.events(space, start, end))
+
+# Tiempos por consulta de SQLite (número, media, máximo, reintentos por base ocupada)
+# y estado del planificador de expiración
+@camera_bp.route('/api/db_stats')
+def api_db_stats():
+    return jsonify({'queries': db.get_query_stats(), 'expiry': expiry_scheduler.get_status(),
+                    'history': occupancy_history.get_status()})
+
+# Métricas en formato de texto de Prometheus: etapas del pipeline, FPS, drops, reconexiones,
+# locks, clientes de streaming y latencias de SQLite (no arranca cámaras paradas)
+@camera_bp.route('/metrics')
+def prometheus_metrics():
+    with _feeds_lock:
+        feeds = list(_feeds.items())
+    text = metrics.render_metrics(registry, db, feeds, occupancy_history)
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+# Perfilado bajo demanda (solo con PROFILER_ENABLED=1): ?camera=<id>&seconds=3 devuelve
+# las pilas muestreadas de los hilos de la cámara en formato collapsed (flamegraph)
+@camera_bp.route('/api/profile', methods=['POST'])
+def api_profile():
+    if not metrics.PROFILER_ENABLED:
+        return jsonify({'error': 'profiler disabled (PROFILER_ENABLED=1)'}), 403
+    cam_id = camera_id_from_request()
+    try:
+        processor = registry.get(cam_id, start=False)
+        seconds = float(request.args.get('seconds', 3.0))
+    except KeyError:
+        return unknown_camera(cam_id)
+    except ValueError:
+        return jsonify({'error': 'seconds must be a number'}), 400
+    if processor is None:
+        return jsonify({'error': 'camera not running'}), 409
+    try:
+        return Response(processor.profile(seconds), mimetype='text/plain')
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 504
+
+# Modo y ritmo del planificador adaptativo de cada cámara en marcha (no despierta cámaras)
+@camera_bp.route('/api/camera_status')
+def api_camera_status():
+    cam_id = request.args.get('camera')
+    running = registry.running()
+    if cam_id is not None:
+        if cam_id not in registry.configs:
+            return unknown_camera(cam_id)
+        running = {cam_id: running[cam_id]} if cam_id in running else {}
+    return jsonify({
+        cid: (dict(running[cid].get_status(), running=True) if cid in running else {'running': False})
+        for cid in (registry.ids() if cam_id is None else [cam_id])
+    })
+
 # Snapshot (imagen JPEG única, útil para calibración)
-@app.route('/snapshot')
+@camera_bp.route('/snapshot')
 def snapshot():
-    start_video_processor_if_needed()
-    # Tomar snapshot seguro del frame actual (no anotado)
-    with video_processor.lock:
-        frame = video_processor.frame.copy() if video_processor.frame is not None else None
-    if frame is None:
+    cam_id = camera_id_from_request()
+    try:
+        processor = start_video_processor_if_needed(cam_id)
+    except KeyError:
+        return unknown_camera(cam_id)
+    # Frame actual (no anotado) a resolución completa, o en el tamaño de un nivel con ?tier=
+    tier = request.args.get('tier') or None
+    if not processor.broadcaster.has_tier(tier):
+        return unknown_tier(processor, tier)
+    jpeg = processor.get_snapshot_bytes(tier)
+    if jpeg is None:
         return ("No frame", 503)
-    import cv2
-    ret, jpeg = cv2.imencode('.jpg', frame)
-    if not ret:
-        return ("Encode error", 500)
-    return Response(jpeg.tobytes(), mimetype='image/jpeg')
+    return Response(jpeg, mimetype='image/jpeg')
+
+# Miniatura del frame actual (nivel STREAM_THUMBNAIL_TIER), para listados y conexiones lentas
+@camera_bp.route('/thumbnail')
+def thumbnail():
+    cam_id = camera_id_from_request()
+    try:
+        processor = start_video_processor_if_needed(cam_id)
+    except KeyError:
+        return unknown_camera(cam_id)
+    jpeg = processor.get_snapshot_bytes(processor.broadcaster.thumbnail_tier)
+    if jpeg is None:
+        return ("No frame", 503)
+    response = Response(jpeg, mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 # Guardar nuevas coordenadas de espacios (POST JSON: array de [x,y,w,h])
-@app.route('/api/save_espacios', methods=['POST'])
+@camera_bp.route('/api/save_espacios', methods=['POST'])
 def api_save_espacios():
     data = request.get_json()
     if not isinstance(data, list):
@@ -108,47 +444,66 @@ def api_save_espacios():
     except Exception as e:
         return jsonify({'error': 'invalid ROI format', 'detail': str(e)}), 400
 
-    # Guardar en espacios.pkl
+    # Guardar (atómicamente, nueva versión) el layout de la cámara y aplicarlo si está corriendo
+    cam_id = request.args.get('camera')
     try:
-        with open('espacios.pkl', 'wb') as f:
-            pickle.dump(new_rois, f)
+        registry.save_espacios(cam_id, new_rois)
+    except KeyError:
+        return unknown_camera(cam_id)
     except Exception as e:
-        return jsonify({'error': 'failed to save pkl', 'detail': str(e)}), 500
-
-    # Actualizar la variable en el módulo app_camera (para que VideoProcessor la use en el siguiente loop)
-    app_camera.espacios = new_rois
-
-    # Si el video_processor está corriendo, ajustar su estado_espacios a la nueva longitud
-    if video_processor is not None:
-        with video_processor.lock:
-            video_processor.estado_espacios = [False] * len(new_rois)
+        return jsonify({'error': 'failed to save layout', 'detail': str(e)}), 500
 
     return jsonify({'ok': True, 'count': len(new_rois)})
 
-# Endpoint para recargar espacios.pkl desde disco (por si editas fuera)
-@app.route('/api/reload_espacios', methods=['POST'])
+# Endpoint para recargar el archivo de ROI desde disco; las ediciones externas ya se detectan
+# solas por mtime (CameraRegistry.watch_layouts), esto fuerza la relectura inmediata
+@camera_bp.route('/api/reload_espacios', methods=['POST'])
 def api_reload_espacios():
-    if not os.path.exists('espacios.pkl'):
-        return jsonify({'error': 'espacios.pkl not found'}), 404
+    cam_id = camera_id_from_request()
     try:
-        with open('espacios.pkl', 'rb') as f:
-            new_rois = pickle.load(f)
+        new_rois = registry.reload_espacios(cam_id)
+    except KeyError:
+        return unknown_camera(cam_id)
+    except FileNotFoundError as e:
+        return jsonify({'error': f'{e} not found'}), 404
     except Exception as e:
-        return jsonify({'error': 'failed to load pkl', 'detail': str(e)}), 500
-
-    app_camera.espacios = new_rois
-    if video_processor is not None:
-        with video_processor.lock:
-            video_processor.estado_espacios = [False] * len(new_rois)
+        return jsonify({'error': 'failed to load layout', 'detail': str(e)}), 500
 
     return jsonify({'ok': True, 'count': len(new_rois)})
 
+# ----------------- Aplicación -----------------
+def create_app():
+    """Aplicación Flask con las páginas y los blueprints de cámaras, autenticación y reservas"""
+    flask_app = Flask(__name__)
+    flask_app.secret_key = os.environ.get('FLASK_SECRET', 'replace-in-prod')
+    # /api/reservar solo acepta números de espacio del lote (1..LOT_SIZE())
+    flask_app.config['LOT_SIZE'] = lambda: sum(count for _, _, count in registry.lot_offsets())
+    flask_app.add_url_rule('/', 'index', index)
+    flask_app.add_url_rule('/mapa', 'mapa', mapa)
+    flask_app.add_url_rule('/reservas', 'reservas', reservas)
+    flask_app.register_blueprint(camera_bp)
+    flask_app.register_blueprint(auth_bp)
+    flask_app.register_blueprint(reservations.reservations_bp)
+    start_services()
+    return flask_app
+
+def create_asgi_app(flask_app=None):
+    """Aplicación ASGI (asgi.py): streaming y /api/estado como corrutinas, el resto con Flask"""
+    import asgi
+    return asgi.AsyncStreamingApp(flask_app or create_app(), registry, get_feed)
+
 # ----------------- Arranque -----------------
+# Importar este módulo no arranca nada: la aplicación (y los hilos de fondo) la crea el
+# punto de entrada, aquí abajo o en el servidor (p. ej. gunicorn 'app:create_app()' o
+# uvicorn --factory app:create_asgi_app)
 if __name__ == '__main__':
-    # arrancar el servidor (no arrancamos el video_processor automáticamente aquí si no queremos)
-    # pero dejo comportamiento para arrancar el video_processor cuando la primera petición lo requiera.
+    # Las cámaras no se arrancan aquí: lo hace la primera petición que las necesita
     try:
-        app.run(host='0.0.0.0', port=5000, debug=True)
+        app = create_app()
+        if SERVER_MODE == 'async':
+            import asgi
+            asgi.serve(create_asgi_app(app), SERVER_HOST, SERVER_PORT)
+        else:
+            app.run(host=SERVER_HOST, port=SERVER_PORT, debug=True, threaded=True)
     finally:
-        # parar la cámara si quedó viva
-        stop_video_processor()
+        stop_services()
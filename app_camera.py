@@ -7,15 +7,45 @@ Cómo usar:
   - Ejecutar: python app_camera.py
 
 Este archivo reemplaza la parte de vídeo de la aplicación original. Mantiene:
-  - Carga de 'espacios.pkl' con la lista de rectángulos (x,y,w,h)
-  - Ruta /video_feed para streaming MJPEG
+  - Layout de ROI (x,y,w,h) desde layout_store (espacios.npz, o espacios.pkl heredado),
+    cargado al crear el primer procesador: sin archivo la app arranca con 0 espacios
+  - Ruta /video_feed para streaming MJPEG (?tier=<nivel> elige uno de STREAM_TIERS)
   - Ruta /api/estado para devolver el estado actual de los espacios (ocupado/libre)
 
 Mejoras implementadas:
   - Reconexion automática a la cámara si se pierde la señal
-  - Procesamiento en un hilo (no bloqueante) y variables protegidas por Lock
+  - Procesamiento en un hilo (no bloqueante). Cada resultado se publica como un objeto
+    inmutable (ProcessorState: frame, ocupación, layout, secuencia y hora) con una sola
+    asignación: las rutas HTTP lo leen sin lock y el análisis nunca espera a un lector
   - Algoritmo robusto: background subtraction (MOG2) por cada ROI + umbral adaptativo
+  - Motores de detección intercambiables (detectors.py, variable DETECTOR): 'mog2',
+    'adaptive' (lógica de main.py) y 'reference' (diferencia con el lote vacío)
+  - Análisis recortado a las ROI (ROI_CROP, RoiCrop): el detector solo procesa las bandas
+    con espacios; ANALYSIS_SCALE < 1 analiza a menor resolución sin cambiar la anotación
   - Manejo seguro cuando no hay frame (evita crash si read() falla)
+  - Modo pipeline opcional (PIPELINE_MODE=1): captura, análisis y anotación en hilos
+    separados; la frecuencia de análisis se controla con ANALYSIS_FPS
+  - Estado estable por espacio (occupancy.OccupancyTracker): histéresis entre
+    OCCUPANCY_ENTER_RATIO / OCCUPANCY_EXIT_RATIO y permanencia mínima antes de confirmar
+  - Planificador adaptativo: sin clientes de vídeo ni cambios durante IDLE_AFTER_SECONDS
+    baja a IDLE_FPS sin anotar; vuelve a ANALYSIS_FPS con un cliente o un pico de
+    movimiento. Con IDLE_SHUTDOWN_SECONDS > 0 libera la cámara si nadie consulta.
+  - Captura con grab()/retrieve() (CAPTURE_MODE=grab, para cámaras en vivo): se vacía la
+    cola de la cámara con grab() y solo se hace retrieve() (conversión y copia del frame)
+    de los frames que se van a analizar, así el análisis trabaja siempre con el frame más
+    reciente. La edad de cada frame analizado se publica como etapa 'frame_age'.
+  - Anotación con una capa pre-renderizada por layout (AnnotationOverlay): solo se
+    recompone la zona de los espacios que cambian y cada frame se anota con una copia
+    con máscara. Solo se anota (y codifica) si hay clientes en /video_feed.
+  - Niveles de stream (STREAM_TIERS, p. ej. full / 640p / thumb) con su ancho, calidad
+    JPEG y tope de fps: cada nivel se codifica una vez por frame y solo mientras tiene
+    clientes. /snapshot y /thumbnail sirven el JPEG guardado del frame actual (uno por
+    frame y nivel) en lugar de codificar en cada petición.
+  - Sin asignaciones por frame en régimen estable: la captura, el resize y la anotación
+    escriben en anillos de buffers preasignados (FrameRing) y el gris, el detector y el
+    conteo por ROI en buffers propios (dst=). Los frames publicados (el del estado, el del
+    broadcaster) no se copian: cada sitio que guarda o codifica un buffer del anillo lo
+    retiene y lo suelta explícitamente, y el anillo no lo reutiliza mientras tenga dueño.
 
 Notas:
   - Ajusta los parámetros: AREA_OCCUPIED_RATIO y MOG_HISTORY/MOG_THRESH según tu escena
@@ -25,31 +55,972 @@ Notas:
 
 from flask import Flask, render_template, Response, jsonify
 import cv2
-import pickle
 import numpy as np
+import asyncio
 import threading
 import time
 import os
+import uuid
+
+from frame_sources import open_source
+from layout_store import LayoutStore
+from metrics import Histogram, StageTimer, TimedLock, sample_stacks
+from occupancy import OccupancyTracker
+from detectors import DETECTOR, MOG_HISTORY, MOG_VAR_THRESHOLD, create_detector  # noqa: F401
 
 # ----------------------- Configuración -----------------------
 CAMERA_SOURCE = os.environ.get('CAMERA_SOURCE', '0')  # '0' por defecto -> webcam local
 FRAME_WIDTH = int(os.environ.get('FRAME_WIDTH', 1280))
 FRAME_HEIGHT = int(os.environ.get('FRAME_HEIGHT', 720))
-MOG_HISTORY = int(os.environ.get('MOG_HISTORY', 300))
-MOG_VAR_THRESHOLD = float(os.environ.get('MOG_VAR_THRESHOLD', 25.0))
 AREA_OCCUPIED_RATIO = float(os.environ.get('AREA_OCCUPIED_RATIO', 0.02))
+ANALYSIS_FPS = float(os.environ.get('ANALYSIS_FPS', 30.0))  # frecuencia objetivo de análisis
+PIPELINE_MODE = os.environ.get('PIPELINE_MODE', '0').lower() in ('1', 'true', 'yes')
+# Planificador adaptativo: sin clientes de vídeo y sin cambios de ocupación se baja a IDLE_FPS
+IDLE_FPS = float(os.environ.get('IDLE_FPS', 1.0))
+IDLE_AFTER_SECONDS = float(os.environ.get('IDLE_AFTER_SECONDS', 30.0))
+MOTION_WAKE_RATIO = float(os.environ.get('MOTION_WAKE_RATIO', 0.05))  # fracción de píxeles en movimiento (todas las ROI)
+IDLE_SHUTDOWN_SECONDS = float(os.environ.get('IDLE_SHUTDOWN_SECONDS', 0))  # 0 = nunca liberar la cámara
+# Recorte del análisis a la zona con ROI: 'off' (frame completo), 'bbox' (rectángulo que
+# contiene todas las ROI) o 'tiles' (bandas horizontales de ROI empaquetadas en un mosaico)
+ROI_CROP = os.environ.get('ROI_CROP', 'tiles').lower()
+ROI_CROP_MARGIN = int(os.environ.get('ROI_CROP_MARGIN', 16))  # píxeles de contexto alrededor (blur/umbral adaptativo)
+ANALYSIS_SCALE = float(os.environ.get('ANALYSIS_SCALE', 1.0))  # <1 analiza a menor resolución (la anotación no cambia)
+# Captura: 'read' (read() de cada frame, en orden) o 'grab' (grab() para descartar los frames
+# atrasados y retrieve() solo de los que se analizan; la cola de la cámara no crece)
+CAPTURE_MODE = os.environ.get('CAPTURE_MODE', 'read').lower()
+GRAB_MAX_DRAIN = int(os.environ.get('GRAB_MAX_DRAIN', 300))  # grab() máximos por frame analizado (modo clásico)
+FRAME_RING_SIZE = int(os.environ.get('FRAME_RING_SIZE', 4))  # buffers por anillo (crece si los lectores retienen frames)
+# Niveles de /video_feed (?tier=<nombre>, el primero por defecto): nombre:ancho:calidad:fps,
+# ancho 0 = el del frame, fps 0 = sin tope
+STREAM_TIERS = os.environ.get('STREAM_TIERS', 'full:0:85:0,640p:640:70:15,thumb:320:60:2')
+STREAM_THUMBNAIL_TIER = os.environ.get('STREAM_THUMBNAIL_TIER', 'thumb')  # nivel de /thumbnail
+SNAPSHOT_QUALITY = int(os.environ.get('SNAPSHOT_QUALITY', 95))  # calidad JPEG de /snapshot (resolución completa)
 
 # ----------------------- Carga de recursos -----------------------
-ESPACIOS_PKL = 'espacios.pkl'
-if not os.path.exists(ESPACIOS_PKL):
-    raise FileNotFoundError(f"No se encontró {ESPACIOS_PKL}. Ejecuta 'obtener_espacios.py' para generar las ROI primero.")
+ESPACIOS_PKL = 'espacios.pkl'  # layout por defecto (layout_store usa espacios.npz y migra el .pkl)
+default_layout_store = LayoutStore(ESPACIOS_PKL)
+
+def default_espacios():
+    """ROI del layout por defecto (lista vacía si aún no se generó con obtener_espacios.py)"""
+    return default_layout_store.get()[1]
+
+# ----------------------- RoiLayout -----------------------
+class RoiLayout:
+    """Lista de ROI (x,y,w,h) precompilada a arrays NumPy recortados al frame.
+
+    Se construye una vez por cada cambio de layout y permite calcular los píxeles
+    activos de todas las ROI con una sola imagen integral y cuatro lecturas por ROI,
+    en lugar de recorrer las ROI en Python con cv2.countNonZero.
+    """
+
+    crop = None  # RoiCrop del que procede este layout (None = coordenadas del frame completo)
+
+    def __init__(self, espacios, width=FRAME_WIDTH, height=FRAME_HEIGHT, version=0):
+        self.espacios = [tuple(int(v) for v in r) for r in espacios]
+        self.width = width
+        self.height = height
+        self.version = version  # versión del layout_store de la que procede
+
+        rois = np.array(self.espacios, dtype=np.int64).reshape(-1, 4)
+        x, y, w, h = rois.T
+        # Mismo recorte que el bucle original: [max(0,x), min(W,x+w)) x [max(0,y), min(H,y+h))
+        x1 = np.maximum(0, x)
+        y1 = np.maximum(0, y)
+        x2 = np.minimum(width, x + w)
+        y2 = np.minimum(height, y + h)
+        self.valid = (x1 < x2) & (y1 < y2)
+        self.area = np.where(self.valid, (x2 - x1) * (y2 - y1), 0)
+
+        # Índices planos en la imagen integral (H+1, W+1); las ROI inválidas quedan en rango
+        x1, x2 = np.clip(x1, 0, width), np.clip(x2, 0, width)
+        y1, y2 = np.clip(y1, 0, height), np.clip(y2, 0, height)
+        stride = width + 1
+        self._i11 = y1 * stride + x1
+        self._i12 = y1 * stride + x2
+        self._i21 = y2 * stride + x1
+        self._i22 = y2 * stride + x2
+
+        # Geometría de la anotación (esquinas y origen de la etiqueta), una vez por layout
+        self.boxes = [((x, y), (x + w, y + h), (x, max(0, y - 6)), str(i + 1))
+                      for i, (x, y, w, h) in enumerate(self.espacios)]
+        # Buffers de trabajo de sums()/count_nonzero() (los usa solo el hilo de análisis)
+        self._integral = None
+        self._binary = None
+
+    def __len__(self):
+        return len(self.espacios)
+
+    def sums(self, image):
+        """Suma de los valores de `image` (uint8, 1 canal) dentro de cada ROI (array int64)"""
+        shape = (image.shape[0] + 1, image.shape[1] + 1)
+        if self._integral is None or self._integral.shape != shape:
+            self._integral = np.empty(shape, np.int32)
+        integral = cv2.integral(image, sum=self._integral, sdepth=cv2.CV_32S).ravel()
+        sums = (integral[self._i22].astype(np.int64) - integral[self._i12]
+                - integral[self._i21] + integral[self._i11])
+        return np.where(self.valid, sums, 0)
+
+    def count_nonzero(self, mask):
+        """Número de píxeles distintos de cero de `mask` dentro de cada ROI (array int64)"""
+        if self._binary is None or self._binary.shape != mask.shape:
+            self._binary = np.empty(mask.shape, np.uint8)
+        return self.sums(cv2.threshold(mask, 0, 1, cv2.THRESH_BINARY, dst=self._binary)[1])
+
+    def means(self, image):
+        """Media de `image` dentro de cada ROI (0 para ROI fuera del frame)"""
+        return self.sums(image) / np.maximum(self.area, 1)
+
+    def occupied(self, mask, ratio=AREA_OCCUPIED_RATIO):
+        """Array booleano de ocupación, idéntico a non_zero / (area + 1e-6) > ratio por ROI"""
+        return self.occupied_from_counts(self.count_nonzero(mask), ratio)
+
+    def occupied_from_counts(self, counts, ratio=AREA_OCCUPIED_RATIO):
+        return self.valid & ((counts / (self.area + 1e-6)) > ratio)
+
+    def ratios(self, counts):
+        """Fracción de píxeles activos por ROI (0 para ROI fuera del frame)"""
+        return np.where(self.valid, counts / (self.area + 1e-6), 0.0)
+
+    def motion_ratio(self, counts):
+        """Fracción de píxeles activos sumando todas las ROI"""
+        total = int(self.area.sum())
+        return float(counts.sum()) / total if total > 0 else 0.0
+
+    def mean_ratio(self, ratios):
+        """Media de una fracción por ROI ponderada por el área de cada ROI"""
+        total = int(self.area.sum())
+        return float((ratios * self.area).sum()) / total if total > 0 else 0.0
+
+
+# ----------------------- RoiCrop -----------------------
+class RoiCrop:
+    """Región de análisis: solo los píxeles que cubren las ROI de un RoiLayout.
+
+    Las ROI se agrupan en bandas horizontales (ROI que se solapan en vertical), cada banda
+    se recorta con un margen de contexto y las bandas se apilan en un mosaico. El detector
+    trabaja sobre el mosaico (opcionalmente reducido por `scale`) con `layout`, un
+    RoiLayout con las coordenadas remapeadas; la anotación sigue usando `source` a
+    resolución completa. Con el margen suficiente el resultado por ROI es el mismo que
+    analizando el frame completo.
+    """
+
+    def __init__(self, source, mode=ROI_CROP, scale=ANALYSIS_SCALE, margin=ROI_CROP_MARGIN):
+        if mode not in ('off', 'bbox', 'tiles'):
+            raise ValueError(f"ROI_CROP debe ser 'off', 'bbox' o 'tiles', no {mode!r}")
+        if not 0 < scale <= 1:
+            raise ValueError('ANALYSIS_SCALE debe estar en (0, 1]')
+        self.source = source
+        self.scale = scale
+        # INTER_AREA es rápido con factores enteros (1/2, 1/3...); para el resto, lineal
+        self._interp = cv2.INTER_AREA if float(1 / scale).is_integer() else cv2.INTER_LINEAR
+        W, H = source.width, source.height
+
+        # Cajas recortadas al frame de las ROI válidas
+        valid = np.flatnonzero(source.valid)
+        i11 = source._i11[valid]
+        boxes = np.stack([i11 % (W + 1), i11 // (W + 1),
+                          source._i22[valid] % (W + 1), source._i22[valid] // (W + 1)], axis=1)
+
+        if mode == 'off' or not len(valid):
+            bands = [(0, 0, W, H)]
+        else:
+            bands = self._bands(boxes, margin, W, H) if mode == 'tiles' else []
+            x0, y0 = boxes[:, 0].min(), boxes[:, 1].min()
+            bbox = (max(0, x0 - margin), max(0, y0 - margin),
+                    min(W, boxes[:, 2].max() + margin), min(H, boxes[:, 3].max() + margin))
+            # Las bandas solo compensan la copia al mosaico si ahorran bastante área
+            if not bands or sum((b[2] - b[0]) * (b[3] - b[1]) for b in bands) > 0.8 * (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]):
+                bands = [tuple(int(v) for v in bbox)]
+        self.mode = 'off' if bands == [(0, 0, W, H)] else mode
+        self.bands = bands
+
+        # Colocación de cada banda en el mosaico (apiladas en vertical, ya escaladas)
+        self._places = []
+        top = 0
+        for x0, y0, x1, y1 in bands:
+            bw, bh = max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale))
+            self._places.append((top, bw, bh))
+            top += bh
+        self.width = max(bw for _, bw, _ in self._places)
+        self.height = top
+
+        # ROI remapeadas al mosaico (las inválidas quedan vacías y siguen siendo inválidas)
+        remapped = [(0, 0, 0, 0)] * len(source)
+        for k, (bx1, by1, bx2, by2) in zip(valid.tolist(), boxes.tolist()):
+            b = next(j for j, (x0, y0, x1, y1) in enumerate(bands) if x0 <= bx1 and y0 <= by1 and bx2 <= x1 and by2 <= y1)
+            x0, y0 = bands[b][:2]
+            top = self._places[b][0]
+            rx1, ry1 = round((bx1 - x0) * scale), round((by1 - y0) * scale) + top
+            rx2, ry2 = round((bx2 - x0) * scale), round((by2 - y0) * scale) + top
+            remapped[k] = (rx1, ry1, max(1, rx2 - rx1), max(1, ry2 - ry1))
+        self.layout = RoiLayout(remapped, self.width, self.height, source.version)
+        self.layout.crop = self
+        self._mosaic = None
+        self._gray = None
+
+    @staticmethod
+    def _bands(boxes, margin, W, H):
+        """Agrupar cajas en bandas horizontales (con margen) que no se solapan"""
+        bands = []
+        for x1, y1, x2, y2 in sorted(boxes.tolist(), key=lambda b: b[1]):
+            y1, y2 = max(0, y1 - margin), min(H, y2 + margin)
+            x1, x2 = max(0, x1 - margin), min(W, x2 + margin)
+            if bands and y1 <= bands[-1][3]:
+                b = bands[-1]
+                bands[-1] = [min(b[0], x1), b[1], max(b[2], x2), max(b[3], y2)]
+            else:
+                bands.append([x1, y1, x2, y2])
+        return [tuple(b) for b in bands]
+
+    @property
+    def coverage(self):
+        """Fracción de píxeles del frame completo que se analizan"""
+        return (self.width * self.height) / float(self.source.width * self.source.height)
+
+    def extract(self, image):
+        """Imagen de análisis (mosaico de bandas) a partir de un frame a resolución completa"""
+        if len(self.bands) == 1:
+            x0, y0, x1, y1 = self.bands[0]
+            crop = image[y0:y1, x0:x1]  # vista, sin copia
+            if self.scale == 1:
+                return crop
+        shape = (self.height, self.width) + image.shape[2:]
+        if self._mosaic is None or self._mosaic.shape != shape or self._mosaic.dtype != image.dtype:
+            self._mosaic = np.zeros(shape, image.dtype)
+        for (x0, y0, x1, y1), (top, bw, bh) in zip(self.bands, self._places):
+            dst = self._mosaic[top:top + bh, :bw]
+            if self.scale == 1:
+                dst[...] = image[y0:y1, x0:x1]
+            else:
+                cv2.resize(image[y0:y1, x0:x1], (bw, bh), dst=dst, interpolation=self._interp)
+        return self._mosaic
+
+    def gray(self, region):
+        """`region` (BGR) en gris, en un buffer del recorte que se reutiliza en cada frame"""
+        if self._gray is None or self._gray.shape != region.shape[:2]:
+            self._gray = np.empty(region.shape[:2], np.uint8)
+        return cv2.cvtColor(region, cv2.COLOR_BGR2GRAY, dst=self._gray)
+
+    def get_info(self):
+        return {'mode': self.mode, 'bands': len(self.bands), 'scale': self.scale,
+                'size': [self.width, self.height], 'coverage': round(self.coverage, 3)}
+
+
+def score_frame(frame, crop, detector, timer=None, ring=None):
+    """Resize + recorte a las ROI + gris + detector. Devuelve (frame_resized, fracción por ROI).
+
+    Es el análisis de cada frame de VideoProcessor; también lo usa reanalisis.py. Con
+    `timer` (metrics.StageTimer) se mide cada paso: resize, crop, cvtcolor y los del motor.
+    Con `ring` (FrameRing) el resize escribe en un buffer del anillo en lugar de uno nuevo
+    (con una referencia para quien llama, que debe soltarla).
+    """
+    lap = _no_lap if timer is None else timer.lap
+    if timer is not None:
+        timer.reset()
+    # Procesamiento básico: redimensionar para velocidad y estabilidad (si hace falta)
+    size = (crop.source.width, crop.source.height)
+    if frame.shape[1::-1] == size:
+        frame_resized = frame
+    elif ring is None:
+        frame_resized = cv2.resize(frame, size)
+    else:
+        ring.reshape((size[1], size[0]) + frame.shape[2:])
+        frame_resized = cv2.resize(frame, size, dst=ring.acquire())
+    lap('resize')
+    # Fracción de píxeles activos de todas las ROI a la vez según el motor elegido,
+    # analizando solo el mosaico de bandas con ROI (coordenadas remapeadas en crop.layout)
+    region = crop.extract(frame_resized)
+    lap('crop')
+    gray = crop.gray(region)
+    lap('cvtcolor')
+    return frame_resized, detector.score(gray, crop.layout, timer)
+
+
+def _no_lap(name):
+    pass
+
+
+# ----------------------- AnnotationOverlay -----------------------
+ANNOTATION_COLORS = ((0, 255, 0), (0, 0, 255))  # verde libre, rojo ocupado
+ANNOTATION_LABELS = ('Libre', 'Ocupado')
+
+
+class AnnotationOverlay:
+    """Capa de anotación pre-renderizada de un RoiLayout.
+
+    Al crearla se dibujan una sola vez, para cada ROI, sus dos variantes (rectángulo +
+    etiqueta "N Libre" / "N Ocupado") como parches con máscara. La capa compuesta
+    (`image` + `mask`, del tamaño del frame) solo se actualiza en la zona de las ROI que
+    cambian de estado, y anotar un frame es una única copia con máscara (render()),
+    con un coste que no depende del número de espacios. La máscara es binaria: los
+    bordes suavizados del texto se recortan al 50 % de cobertura.
+    """
+
+    def __init__(self, layout):
+        self.layout = layout
+        H, W = layout.height, layout.width
+        self.image = np.zeros((H, W, 3), np.uint8)
+        self.mask = np.zeros((H, W), np.uint8)
+        self.state = np.zeros(len(layout), dtype=bool)
+        self._patches = []  # por ROI: [(y0, y1, x0, x1, máscara bool)] para libre y ocupado
+        union = np.zeros((len(layout), 4), np.int64)
+        for k, (p1, p2, origin, number) in enumerate(layout.boxes):
+            variants = [self._render(p1, p2, origin, f'{number} {label}', W, H) for label in ANNOTATION_LABELS]
+            self._patches.append(variants)
+            union[k] = (min(v[0] for v in variants), max(v[1] for v in variants),
+                        min(v[2] for v in variants), max(v[3] for v in variants))
+        self._union = union
+        # ROI cuyos parches se pisan con los de cada ROI (se redibujan al cambiar esa ROI)
+        self._neighbors = []
+        for k in range(len(layout)):
+            y0, y1, x0, x1 = union[k]
+            hit = (union[:, 0] < y1) & (union[:, 1] > y0) & (union[:, 2] < x1) & (union[:, 3] > x0)
+            self._neighbors.append(np.flatnonzero(hit).tolist())
+        for k in range(len(layout)):
+            self._apply(k, (0, H, 0, W))
+
+    @staticmethod
+    def _render(p1, p2, origin, label, W, H):
+        """Parche (y0, y1, x0, x1, máscara) con el rectángulo y la etiqueta, recortado al frame"""
+        (tw, th), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        x0 = max(0, min(p1[0], origin[0]) - 2)
+        y0 = max(0, min(p1[1], origin[1] - th) - 2)
+        x1 = min(W, max(p2[0], origin[0] + tw) + 2)
+        y1 = min(H, max(p2[1], origin[1] + baseline) + 2)
+        if x0 >= x1 or y0 >= y1:
+            return 0, 0, 0, 0, np.zeros((0, 0), bool)
+        canvas = np.zeros((y1 - y0, x1 - x0), np.uint8)
+        shift = np.array([x0, y0])
+        cv2.rectangle(canvas, tuple(np.subtract(p1, shift).tolist()), tuple(np.subtract(p2, shift).tolist()), 255, 2)
+        cv2.putText(canvas, label, tuple(np.subtract(origin, shift).tolist()), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 255, 1,
+                    cv2.LINE_AA)
+        return y0, y1, x0, x1, canvas >= 128
+
+    def _apply(self, k, region):
+        """Dibujar la variante actual de la ROI k dentro de `region` (y0, y1, x0, x1)"""
+        ocupado = int(self.state[k])
+        py0, py1, px0, px1, mask = self._patches[k][ocupado]
+        y0, y1 = max(py0, region[0]), min(py1, region[1])
+        x0, x1 = max(px0, region[2]), min(px1, region[3])
+        if y0 >= y1 or x0 >= x1:
+            return
+        sub = mask[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+        self.image[y0:y1, x0:x1][sub] = ANNOTATION_COLORS[ocupado]
+        self.mask[y0:y1, x0:x1][sub] = 255
+
+    def update(self, estado):
+        """Aplicar un vector de ocupación; solo se recompone la zona de las ROI que cambiaron"""
+        estado = np.asarray(estado, dtype=bool)
+        for k in np.flatnonzero(estado != self.state).tolist():
+            self.state[k] = estado[k]
+            y0, y1, x0, x1 = region = tuple(self._union[k].tolist())
+            self.mask[y0:y1, x0:x1] = 0
+            # En orden de ROI, como el dibujo original: las posteriores quedan encima
+            for j in self._neighbors[k]:
+                self._apply(j, region)
+
+    def render(self, frame, out):
+        """Copiar `frame` en `out` con la anotación encima (una sola copia con máscara)"""
+        np.copyto(out, frame)
+        cv2.copyTo(self.image, self.mask, out)
+        return out
+
+
+# ----------------------- Niveles de stream -----------------------
+class StreamTier:
+    """Nivel de /video_feed: ancho máximo (0 = el del frame), calidad JPEG y tope de fps (0 = sin tope)"""
+
+    def __init__(self, name, width=0, quality=95, max_fps=0.0):
+        if not 1 <= int(quality) <= 100:
+            raise ValueError(f'calidad JPEG fuera de 1..100 en el nivel {name!r}: {quality}')
+        self.name = str(name)
+        self.width = int(width)
+        self.quality = int(quality)
+        self.max_fps = float(max_fps)
+
+    def as_dict(self):
+        return {'width': self.width, 'quality': self.quality, 'max_fps': self.max_fps}
+
+
+def parse_stream_tiers(spec):
+    """Lista de StreamTier desde 'nombre:ancho:calidad:fps,...' (los campos finales son opcionales)"""
+    tiers = []
+    for item in spec.split(','):
+        fields = item.strip().split(':')
+        if fields[0]:
+            tiers.append(StreamTier(fields[0], *(float(f) for f in fields[1:4])))
+    names = [t.name for t in tiers]
+    if not tiers or len(set(names)) != len(names):
+        raise ValueError(f'STREAM_TIERS debe definir al menos un nivel y sin nombres repetidos: {spec!r}')
+    return tiers
+
+
+STREAM_TIER_LIST = parse_stream_tiers(STREAM_TIERS)
+
+
+class TierCache:
+    """Último JPEG codificado de un nivel (con su secuencia) y el buffer de su resize.
+
+    El JPEG solo se reemplaza con self.lock tomado; el resize escribe siempre en el mismo
+    buffer (dst=), así codificar un nivel reducido no asigna un frame nuevo cada vez.
+    """
+
+    def __init__(self, tier):
+        self.tier = tier
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.jpeg = None
+        self.due = 0.0          # time.monotonic() a partir del cual el tope de fps permite otro frame
+        self.subscribers = 0
+        self.encoded = 0
+        self._params = [cv2.IMWRITE_JPEG_QUALITY, tier.quality]
+        self._buf = None
+
+    def encode(self, frame, seq):
+        """Codificar `frame` como el frame `seq` (con self.lock tomado). False si imencode falla"""
+        h, w = frame.shape[:2]
+        width = self.tier.width
+        if 0 < width < w:
+            size = (width, max(1, round(h * width / w)))
+            if self._buf is None or self._buf.shape[1::-1] != size or self._buf.shape[2:] != frame.shape[2:]:
+                self._buf = np.empty((size[1], size[0]) + frame.shape[2:], frame.dtype)
+            frame = cv2.resize(frame, size, dst=self._buf, interpolation=cv2.INTER_AREA)
+        ret, jpeg = cv2.imencode('.jpg', frame, self._params)
+        if not ret:
+            return False
+        self.seq, self.jpeg = seq, jpeg.tobytes()
+        self.encoded += 1
+        if self.tier.max_fps > 0:
+            # Cadencia fija: un cliente que llega tarde no retrasa los turnos siguientes
+            interval = 1.0 / self.tier.max_fps
+            self.due = max(self.due, time.monotonic() - interval) + interval
+        return True
+
+    def get_info(self):
+        jpeg = self.jpeg
+        return {'subscribers': self.subscribers, 'encoded': self.encoded,
+                'jpeg_bytes': len(jpeg) if jpeg is not None else 0}
+
+
+# ----------------------- FrameBroadcaster -----------------------
+class FrameBroadcaster:
+    """Difunde el último frame anotado a cualquier número de clientes MJPEG.
+
+    El productor (hilo lector) solo publica la referencia al frame y un número de
+    secuencia; la codificación JPEG se hace una única vez por frame y por nivel de
+    calidad (StreamTier), la primera vez que algún cliente de ese nivel lo pide, y el
+    resultado se comparte entre todos. Un nivel sin clientes no codifica nada. Los
+    clientes esperan "un frame más nuevo que N" en lugar de sondear, y si son lentos
+    simplemente se saltan frames; en un nivel con tope de fps además esperan al turno
+    del nivel (el tope limita también las codificaciones).
+
+    Los clientes asyncio (servidor asíncrono, asgi.py) no ocupan un hilo cada uno: todos
+    los de un mismo event loop esperan un único Future que publish() resuelve con
+    call_soon_threadsafe.
+
+    Con `frames` (FramePool) el frame publicado y el que se está codificando se retienen
+    en su anillo hasta que se reemplazan o termina la codificación.
+    """
+
+    def __init__(self, tiers=None, frames=None):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._frame = None
+        self._frames = frames
+        self._closed = False
+        self.tiers = list(tiers or STREAM_TIER_LIST)
+        self._caches = {t.name: TierCache(t) for t in self.tiers}
+        self.default_tier = self.tiers[0].name
+        # /thumbnail: STREAM_THUMBNAIL_TIER si existe, si no el último (el más pequeño por convención)
+        self.thumbnail_tier = STREAM_THUMBNAIL_TIER if STREAM_THUMBNAIL_TIER in self._caches else self.tiers[-1].name
+        self.subscribers = 0
+        self.on_subscribe = None  # callback opcional cuando se conecta un cliente
+        self.on_encode = None     # callback opcional(segundos, nivel) con el coste de cada imencode
+        self.skipped = 0          # frames que algún cliente lento se saltó (niveles sin tope de fps)
+        self._loop_waiters = {}   # event loop -> Future compartido por sus clientes
+
+    def has_tier(self, name):
+        return name is None or name in self._caches
+
+    def get_tier(self, name=None):
+        return self._cache(name).tier
+
+    def _cache(self, tier):
+        return self._caches[tier or self.default_tier]
+
+    def publish(self, frame):
+        """Publicar un nuevo frame (no se copia: el productor no debe modificarlo después)"""
+        self._retain(frame)
+        with self._cond:
+            self._seq += 1
+            previous, self._frame = self._frame, frame
+            self._cond.notify_all()
+            self._wake_loops()
+            seq = self._seq
+        self._release(previous)
+        return seq
+
+    def publish_jpeg(self, jpeg, tier=None):
+        """Publicar un frame ya codificado para un nivel (p. ej. recibido desde un proceso de cámara).
+
+        Cada nivel lleva aquí su propia secuencia: un broadcaster recibe frames o JPEG, no ambos.
+        """
+        cache = self._cache(tier)
+        with self._cond:
+            self._seq += 1
+            previous, self._frame = self._frame, None
+            with cache.lock:
+                cache.seq, cache.jpeg = cache.seq + 1, jpeg
+            self._cond.notify_all()
+            self._wake_loops()
+            seq = cache.seq
+        self._release(previous)
+        return seq
+
+    def _retain(self, frame):
+        if self._frames is not None:
+            self._frames.retain(frame)
+
+    def _release(self, frame):
+        if self._frames is not None:
+            self._frames.release(frame)
+
+    def frame_copy(self):
+        """Copia del último frame publicado (None si no hay o si se publican JPEG)"""
+        with self._cond:
+            return None if self._frame is None else self._frame.copy()
+
+    def _available(self, cache):
+        # Con self._cond tomado: secuencia del frame más nuevo que puede recibir un cliente del nivel
+        return self._seq if self._frame is not None else cache.seq
+
+    def _ready(self, cache, after_seq, now):
+        # Con self._cond tomado: hay un frame más nuevo y el tope de fps del nivel lo permite
+        # (o algún cliente ya codificó uno más nuevo en este turno)
+        return self._available(cache) > after_seq and (cache.seq > after_seq or now >= cache.due)
+
+    def latest(self, tier=None):
+        """Devolver (seq, jpeg_bytes) del último frame publicado en un nivel, codificándolo si hace falta"""
+        cache = self._cache(tier)
+        with self._cond:
+            seq, frame = self._seq, self._frame
+            # Retenido con _cond tomado: publish() no puede soltarlo antes
+            self._retain(frame)
+        try:
+            with cache.lock:
+                # Solo se codifica si nadie lo ha hecho ya (ni con este frame ni con uno más nuevo)
+                # y el nivel no está esperando su turno
+                if frame is None or cache.seq >= seq or (cache.jpeg is not None and time.monotonic() < cache.due):
+                    return cache.seq, cache.jpeg
+                t0 = time.perf_counter()
+                cache.encode(frame, seq)
+                if self.on_encode is not None:
+                    self.on_encode(time.perf_counter() - t0, cache.tier.name)
+                return cache.seq, cache.jpeg
+        finally:
+            self._release(frame)
+
+    def encode_subscribed(self):
+        """Codificar el último frame en cada nivel con clientes (etapa de anotación del pipeline)"""
+        for name, cache in self._caches.items():
+            if cache.subscribers:
+                self.latest(name)
+
+    def wait_next(self, after_seq, timeout=1.0, tier=None):
+        """Bloquear hasta que el nivel tenga un frame con seq > after_seq. Devuelve (seq, jpeg) o (after_seq, None)"""
+        cache = self._cache(tier)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    return after_seq, None
+                now = time.monotonic()
+                if self._ready(cache, after_seq, now):
+                    break
+                if now >= deadline:
+                    return after_seq, None
+                wait = deadline - now
+                if self._available(cache) > after_seq:
+                    wait = min(wait, cache.due - now)  # hay frame nuevo pero el nivel aún no toca
+                self._cond.wait(wait)
+        seq, jpeg = self.latest(tier)
+        return (seq, jpeg) if seq > after_seq and jpeg is not None else (after_seq, None)
+
+    def stream(self, timeout=1.0, tier=None):
+        """Generador de jpeg_bytes de un nivel para un cliente; lleva la cuenta de suscriptores activos"""
+        cache = self._cache(tier)
+        self._subscribe(cache, 1)
+        if self.on_subscribe is not None:
+            self.on_subscribe()
+        try:
+            seq = 0
+            while not self._closed:
+                new_seq, jpeg = self.wait_next(seq, timeout, tier)
+                if jpeg is None:
+                    continue
+                self._count_skipped(cache, seq, new_seq)
+                seq = new_seq
+                yield jpeg
+        finally:
+            self._subscribe(cache, -1)
+
+    def _subscribe(self, cache, delta):
+        with self._cond:
+            self.subscribers += delta
+            cache.subscribers += delta
+
+    def _count_skipped(self, cache, seq, new_seq):
+        # En un nivel con tope de fps saltarse frames es lo esperado, no un cliente lento
+        if seq and new_seq > seq + 1 and not cache.tier.max_fps:
+            with self._cond:
+                self.skipped += new_seq - seq - 1
+
+    def subscriber_counts(self):
+        """{nivel: clientes} de los niveles con algún cliente"""
+        with self._cond:
+            return {name: c.subscribers for name, c in self._caches.items() if c.subscribers}
+
+    def get_tiers_info(self):
+        return {name: dict(c.tier.as_dict(), **c.get_info()) for name, c in self._caches.items()}
+
+    def close(self):
+        """Terminar todos los streams activos (p. ej. al detener el procesador)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            self._wake_loops()
+
+    # ----------------- Clientes asyncio -----------------
+    def _wake_loops(self):
+        # Llamado con self._cond tomado
+        waiters, self._loop_waiters = self._loop_waiters, {}
+        for loop, future in waiters.items():
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # loop ya cerrado
+
+    async def wait_next_async(self, after_seq, timeout=1.0, tier=None):
+        """Como wait_next() pero sin bloquear el event loop"""
+        loop = asyncio.get_running_loop()
+        cache = self._cache(tier)
+        deadline = time.monotonic() + timeout
+        while True:
+            future = None
+            with self._cond:
+                if self._closed:
+                    return after_seq, None
+                now = time.monotonic()
+                if self._ready(cache, after_seq, now):
+                    encoded = self._frame is None or cache.seq >= self._seq or now < cache.due
+                    break
+                delay = deadline - now
+                if delay <= 0:
+                    return after_seq, None
+                if self._available(cache) > after_seq:
+                    delay = min(delay, cache.due - now)  # el nivel aún no toca
+                else:
+                    future = self._loop_waiters.get(loop)
+                    if future is None:
+                        future = self._loop_waiters[loop] = loop.create_future()
+            if future is None:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await asyncio.wait_for(asyncio.shield(future), delay)
+            except asyncio.TimeoutError:
+                pass
+        # La codificación JPEG (una vez por frame y nivel) va a un hilo para no frenar a los demás clientes
+        seq, jpeg = self.latest(tier) if encoded else await loop.run_in_executor(None, self.latest, tier)
+        return (seq, jpeg) if seq > after_seq and jpeg is not None else (after_seq, None)
+
+    async def stream_async(self, timeout=1.0, tier=None):
+        """Versión asíncrona de stream(): generador asíncrono de jpeg_bytes"""
+        cache = self._cache(tier)
+        self._subscribe(cache, 1)
+        if self.on_subscribe is not None:
+            self.on_subscribe()
+        try:
+            seq = 0
+            while not self._closed:
+                new_seq, jpeg = await self.wait_next_async(seq, timeout, tier)
+                if jpeg is None:
+                    continue
+                self._count_skipped(cache, seq, new_seq)
+                seq = new_seq
+                yield jpeg
+        finally:
+            self._subscribe(cache, -1)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# ----------------------- Buffers de frames -----------------------
+class FrameRing:
+    """Anillo de buffers preasignados de una misma forma (frames de un procesador).
+
+    Cada buffer lleva la cuenta explícita de quién lo tiene: acquire() lo entrega con una
+    referencia (la del productor) y cada sitio que lo guarda o lo lee desde otro hilo
+    (state.frame, el frame del broadcaster, un buzón del pipeline, /snapshot mientras
+    codifica) hace retain() al tomarlo y release() al soltarlo. Un buffer solo vuelve a
+    entregarse cuando su cuenta llega a 0. Si todos están ocupados se añade otro hasta
+    `limit`; por encima se entrega un array suelto (`misses`), que retain/release ignoran
+    (igual que los buffers de una forma anterior). Cada anillo lo usa un solo productor.
+    """
+
+    def __init__(self, shape=None, dtype=np.uint8, size=FRAME_RING_SIZE, limit=None, lock=None):
+        self.dtype = dtype
+        self.size = max(1, size)
+        self.limit = limit or self.size * 4
+        self.shape = None
+        self.misses = 0
+        self.lock = lock or threading.RLock()
+        self._buffers = []
+        self._holds = []    # referencias de cada buffer (0 = libre)
+        self._index = {}    # id(buffer) -> posición en _buffers
+        self._next = 0
+        if shape is not None:
+            self.reshape(shape)
+
+    def reshape(self, shape):
+        """Cambiar la forma de los buffers (p. ej. la cámara entrega otra resolución)"""
+        shape = tuple(shape)
+        with self.lock:
+            if shape != self.shape:
+                self.shape = shape
+                self._buffers = [np.empty(shape, self.dtype) for _ in range(self.size)]
+                self._holds = [0] * self.size
+                self._index = {id(buf): k for k, buf in enumerate(self._buffers)}
+                self._next = 0
+
+    def acquire(self):
+        """Buffer libre del anillo con una referencia para quien lo pide (None si aún no se conoce la forma)"""
+        with self.lock:
+            if self.shape is None:
+                return None
+            n = len(self._buffers)
+            for i in range(n):
+                k = (self._next + i) % n
+                if not self._holds[k]:
+                    self._holds[k] = 1
+                    self._next = (k + 1) % n
+                    return self._buffers[k]
+            buf = np.empty(self.shape, self.dtype)
+            if n < self.limit:
+                self._index[id(buf)] = n
+                self._buffers.append(buf)
+                self._holds.append(1)
+            else:
+                self.misses += 1
+            return buf
+
+    def _find(self, buf):
+        k = self._index.get(id(buf))
+        return k if k is not None and self._buffers[k] is buf else None
+
+    def retain(self, buf):
+        """Añadir una referencia a `buf`. False si no es un buffer de este anillo"""
+        with self.lock:
+            k = self._find(buf)
+            if k is None:
+                return False
+            self._holds[k] += 1
+            return True
+
+    def release(self, buf):
+        """Quitar una referencia a `buf`. False si no es un buffer de este anillo"""
+        with self.lock:
+            k = self._find(buf)
+            if k is None:
+                return False
+            self._holds[k] = max(0, self._holds[k] - 1)
+            return True
+
+    def get_info(self):
+        with self.lock:
+            in_use = sum(1 for h in self._holds if h)
+        return {'shape': list(self.shape) if self.shape else None, 'buffers': len(self._buffers),
+                'in_use': in_use, 'misses': self.misses}
+
+
+class FramePool:
+    """Anillos de un procesador con un lock común: retain/release de un frame de cualquiera.
+
+    Quien reemplaza un frame publicado retiene el nuevo, lo publica y después suelta el
+    viejo; un lector que lee el frame y lo retiene con `lock` tomado lo tiene retenido
+    antes de que el viejo pueda soltarse, o ya ve el nuevo.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.rings = []
+
+    def ring(self, **kwargs):
+        ring = FrameRing(lock=self.lock, **kwargs)
+        self.rings.append(ring)
+        return ring
+
+    def retain(self, frame):
+        if frame is not None:
+            with self.lock:
+                any(ring.retain(frame) for ring in self.rings)
+
+    def release(self, frame):
+        if frame is not None:
+            with self.lock:
+                any(ring.release(frame) for ring in self.rings)
+
+
+# ----------------------- Etapas del pipeline -----------------------
+class LatestSlot:
+    """Buzón de un solo elemento entre dos etapas: guarda solo el valor más reciente.
+
+    Si el productor publica antes de que el consumidor recoja el valor anterior, ese
+    valor se descarta y se cuenta como 'drop'. Así una etapa lenta nunca acumula
+    frames viejos detrás de una rápida. `on_drop(valor)` recibe los valores descartados
+    sin consumir (p. ej. para devolver sus buffers al anillo); el consumidor se queda con
+    los que recoge.
+    """
+
+    def __init__(self, on_drop=None):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._taken_seq = 0
+        self._value = None
+        self._closed = False
+        self.on_drop = on_drop
+        self.drops = 0
+        self.waiting = 0  # consumidores bloqueados en get_newer()
+
+    def put(self, value):
+        dropped = None
+        with self._cond:
+            if self._seq > self._taken_seq:
+                self.drops += 1
+                dropped = self._value
+            self._seq += 1
+            self._value = value
+            self._cond.notify_all()
+            seq = self._seq
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+        return seq
+
+    def get_newer(self, after_seq, timeout=1.0):
+        """Esperar un valor con seq > after_seq. Devuelve (seq, valor) o (after_seq, None)"""
+        with self._cond:
+            self.waiting += 1
+            try:
+                if not self._cond.wait_for(lambda: self._seq > after_seq or self._closed, timeout):
+                    return after_seq, None
+            finally:
+                self.waiting -= 1
+            if self._closed:
+                return after_seq, None
+            self._taken_seq = self._seq
+            return self._seq, self._value
+
+    @property
+    def depth(self):
+        """Elementos pendientes de consumir (0 o 1)"""
+        return 1 if self._seq > self._taken_seq else 0
+
+    def close(self):
+        dropped = None
+        with self._cond:
+            self._closed = True
+            if self._seq > self._taken_seq:
+                dropped, self._taken_seq = self._value, self._seq
+            self._cond.notify_all()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+
+class StageStats:
+    """Contadores de una etapa: frames procesados, latencias (última, media móvil, máxima, histograma)"""
+
+    def __init__(self, name, slot=None):
+        self.name = name
+        self.slot = slot  # buzón de entrada de la etapa (para profundidad y drops)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.last_ms = 0.0
+        self.avg_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = Histogram()
+
+    def record(self, seconds):
+        ms = seconds * 1000.0
+        with self._lock:
+            self.count += 1
+            self.last_ms = ms
+            self.avg_ms = ms if self.count == 1 else self.avg_ms * 0.9 + ms * 0.1
+            self.max_ms = max(self.max_ms, ms)
+            self.histogram.observe(seconds)
+
+    def as_dict(self, histogram=False):
+        with self._lock:
+            d = {
+                'count': self.count,
+                'last_ms': round(self.last_ms, 3),
+                'avg_ms': round(self.avg_ms, 3),
+                'max_ms': round(self.max_ms, 3),
+            }
+            if histogram:
+                d['histogram'] = self.histogram.snapshot()
+        d['queue_depth'] = self.slot.depth if self.slot is not None else 0
+        d['drops'] = self.slot.drops if self.slot is not None else 0
+        return d
+
+
+# ----------------------- ProcessorState -----------------------
+class ProcessorState:
+    """Resultado publicado por el procesador; se crea entero y no se modifica después.
+
+    El procesador lo reemplaza con una sola asignación de referencia (self.state), así
+    que un lector hace `state = vp.state` una vez, sin lock, y todos los campos que lee
+    son del mismo resultado: el frame, su secuencia, la ocupación y el layout con el que
+    se calculó. `frame` es un buffer del anillo de resize: mientras haya una referencia
+    al estado (o al frame) el anillo no lo reutiliza.
+    """
+
+    def __init__(self, seq, frame, estado, layout, estado_version, timestamp):
+        self.seq = seq                        # frames analizados (cambia con cada frame)
+        self.frame = frame                    # último frame redimensionado (sin anotar) o None
+        self.estado = estado                  # tupla de bool por espacio (estado estable del tracker)
+        self.layout = layout                  # RoiLayout con el que se calculó `estado`
+        self.estado_version = estado_version  # cambia con cada cambio de ocupación, de layout o de detector
+        self.timestamp = timestamp            # time.time() de la publicación
+
+    @property
+    def layout_version(self):
+        return self.layout.version
+
+    def replace(self, **changes):
+        """Copia con algunos campos cambiados (el original no se toca)"""
+        fields = dict(self.__dict__, timestamp=time.time())
+        fields.update(changes)
+        return ProcessorState(**fields)
 
-with open(ESPACIOS_PKL, 'rb') as f:
-    espacios = pickle.load(f)  # lista de (x,y,w,h)
 
 # ----------------------- VideoProcessor -----------------------
 class VideoProcessor:
-    def __init__(self, src):
+    """Captura + análisis de ocupación de una cámara.
+
+    Dos modos de ejecución:
+      - clásico (pipeline=False): un único hilo hace captura, análisis y anotación.
+      - pipeline (pipeline=True): tres hilos conectados por buzones LatestSlot:
+          captura -> análisis (detector + ROI) -> anotación/codificación.
+        La captura siempre conserva solo el último frame, el análisis corre a
+        `target_fps` y la anotación solo trabaja si hay clientes en /video_feed.
+    """
+
+    def __init__(self, src, espacios_rois=None, pipeline=PIPELINE_MODE, target_fps=ANALYSIS_FPS,
+                 detector=DETECTOR, detector_options=None, roi_crop=ROI_CROP, analysis_scale=ANALYSIS_SCALE,
+                 capture_mode=CAPTURE_MODE):
         # Camera source puede ser '0' (string), '1' etc. o una URL
         try:
             src_int = int(src)
@@ -57,20 +1028,90 @@ class VideoProcessor:
         except Exception:
             self.src = src
 
+        if capture_mode not in ('read', 'grab'):
+            raise ValueError(f"CAPTURE_MODE debe ser 'read' o 'grab', no {capture_mode!r}")
         self.capture = None
-        self.lock = threading.Lock()
-        self.frame = None
-        self.annotated_frame = None
-        self.estado_espacios = [False] * len(espacios)
+        self.capture_mode = capture_mode
+        self.stats = {}
+        # Lock entre escritores (análisis, set_espacios, set_detector) para publicar el
+        # estado; los lectores no lo toman. Mide espera y retención (etapas lock_wait / lock_hold)
+        self.lock = TimedLock(self._record_stage)
+        self._snapshots = {}    # nivel (None = /snapshot a resolución completa) -> TierCache
+        # Anillos de buffers: frames de la cámara (su resolución), redimensionados y anotados.
+        # Cada sitio que guarda uno de sus frames lo retiene y lo suelta al reemplazarlo
+        self._frames = FramePool()
+        self._capture_ring = self._frames.ring()
+        self._resize_ring = self._frames.ring()
+        self._annotate_ring = self._frames.ring()
+        # Cada procesador tiene su propio layout; por defecto el de espacios.npz / espacios.pkl
+        layout = RoiLayout(default_espacios() if espacios_rois is None else espacios_rois)
+        # Región de análisis (solo la zona con ROI, opcionalmente a menor resolución)
+        self.roi_crop = roi_crop
+        self.analysis_scale = analysis_scale
+        # Motor de detección (mog2 / adaptive / reference), elegible por cámara
+        detector = detector if hasattr(detector, 'score') else create_detector(detector, **(detector_options or {}))
+        # (recorte, tracker, motor) que usa el análisis: se reemplaza entero, como el estado.
+        # El tracker da el estado estable por espacio (histéresis + permanencia mínima) y los eventos
+        self._analysis = (RoiCrop(layout, roi_crop, analysis_scale), self._new_tracker(len(layout), detector), detector)
+        # Último resultado publicado (ver ProcessorState); estado_version sirve de ETag
+        self.state = ProcessorState(0, None, (False,) * len(layout), layout, 0, time.time())
+        self.etag_token = uuid.uuid4().hex[:8]
+        self.broadcaster = FrameBroadcaster(frames=self._frames)
+        self.pipeline = bool(pipeline)
+        self.target_fps = float(target_fps)
         self._stop = False
-        self._thread = threading.Thread(target=self._reader_worker, daemon=True)
+        self._reconnect_delay = 1.0
+        self._last_analysis_end = None
+        self.achieved_fps = 0.0
+
+        # Planificador adaptativo: 'full' (target_fps), 'idle' (IDLE_FPS, sin anotar)
+        # o 'suspended' (cámara liberada hasta el próximo acceso)
+        self.mode = 'full'
+        self.idle_fps = IDLE_FPS
+        self.last_motion = 0.0
+        self._last_change = time.monotonic()
+        self._last_access = time.monotonic()
+        self._wake = threading.Event()
+        self.broadcaster.on_subscribe = self.touch
+        # callback(estado, timestamp) tras cada cambio confirmado (ver add_listener)
+        self._listeners = []
+
+        # Buzones y métricas por etapa
+        self._capture_slot = LatestSlot(on_drop=lambda item: self._frames.release(item[0]))
+        self._analysis_slot = LatestSlot(on_drop=lambda result: self._frames.release(result[0]))
+        self.stats.update({
+            'capture': StageStats('capture'),
+            'analysis': StageStats('analysis', self._capture_slot),
+            'annotation': StageStats('annotation', self._analysis_slot),
+            # Edad del frame al publicar su análisis (desde que llegó de la cámara)
+            'frame_age': StageStats('frame_age'),
+        })
+        # Pasos del análisis (score_frame + motor) y codificación JPEG (una etapa por nivel)
+        self._timer = StageTimer(self._record_stage)
+        self.broadcaster.on_encode = lambda seconds, tier: self._record_stage(f'imencode_{tier}', seconds)
+        self.reconnects = 0
+        self.read_failures = 0
+        self._signal_lost = False
+        # Captura: frames entregados (read/retrieve), descartados con grab() y llegada del último
+        self.grab_skipped = 0
+        self.retrieved = 0
+        self._captured_at = 0.0
+        self._grabbed_at = 0.0
+        self._frame_interval = 1.0 / 30
+        self._lag_base = None
+        self._overlay = None  # AnnotationOverlay del layout actual (la crea la anotación)
 
-        # Background subtractor (una por toda la imagen, suficiente y simple)
-        self.backsub = cv2.createBackgroundSubtractorMOG2(history=MOG_HISTORY, varThreshold=MOG_VAR_THRESHOLD, detectShadows=False)
+        if self.pipeline:
+            workers = [self._capture_worker, self._analysis_worker, self._annotation_worker]
+        else:
+            workers = [self._reader_worker]
+        self._threads = [threading.Thread(target=w, daemon=True) for w in workers]
+        self._thread = self._threads[0]
 
         # Start
         self._open_capture()
-        self._thread.start()
+        for t in self._threads:
+            t.start()
 
     def _open_capture(self):
         if self.capture is not None:
@@ -80,96 +1121,491 @@ class VideoProcessor:
                 pass
             self.capture = None
 
-        self.capture = cv2.VideoCapture(self.src)
+        # Índice/URL de cámara, o una fuente de frame_sources (vídeo o generador con ritmo)
+        self.capture = open_source(self.src)
         # Configurar resolución si es posible
         try:
             self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
             self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
         except Exception:
             pass
+        try:
+            fps = float(self.capture.get(cv2.CAP_PROP_FPS))
+        except Exception:
+            fps = 0.0
+        # Intervalo entre frames de la cámara (para reconocer cuándo grab() espera al directo)
+        self._frame_interval = 1.0 / fps if 0 < fps < 1000 else 1.0 / 30
+        self._lag_base = None
+
+    # ----------------- Etapas -----------------
+    def _ensure_open(self):
+        """True si la cámara está abierta; si no, intenta reabrirla (con espera creciente)"""
+        if self.capture is not None and self.capture.isOpened():
+            return True
+        # intentar abrir
+        if self._signal_lost:
+            self.reconnects += 1
+        self._open_capture()
+        time.sleep(self._reconnect_delay)
+        self._reconnect_delay = min(5.0, self._reconnect_delay * 1.5)
+        return False
+
+    def _capture_failed(self):
+        # intentar reconectar
+        self.read_failures += 1
+        self._signal_lost = True
+        self.capture.release()
+        self.capture = None
+        time.sleep(1.0)
+        return None
+
+    def _read_frame(self):
+        """Leer un frame de la cámara (reconectando si hace falta). Devuelve None si no hay frame"""
+        if not self._ensure_open():
+            return None
+        t0 = time.perf_counter()
+        if self.capture_mode == 'grab':
+            # Vaciar la cola: los frames atrasados se descartan sin convertirlos
+            if not self._grab_latest():
+                return self._capture_failed()
+            return self._retrieve(t0)
+        buf = self._capture_ring.acquire()
+        ok, frame = self.capture.read(buf) if buf is not None else self.capture.read()
+        if not ok or frame is None:
+            self._capture_ring.release(buf)
+            return self._capture_failed()
+        self._grabbed_at = time.perf_counter()
+        return self._accept(frame, buf, t0)
+
+    def _grab_latest(self):
+        """grab() hasta llegar al directo: los frames en cola vuelven al instante, el del
+        directo hace esperar a la cámara. False si la cámara falla"""
+        live_wait = self._frame_interval * 0.5
+        for n in range(max(1, GRAB_MAX_DRAIN)):
+            t0 = time.perf_counter()
+            if not self.capture.grab():
+                return False
+            self._grabbed_at = time.perf_counter()
+            if self._grabbed_at - t0 >= live_wait:
+                break
+        self.grab_skipped += n
+        return True
+
+    def _grab_frame(self, wanted):
+        """Modo pipeline con grab: grab() de cada frame y retrieve() solo si wanted()"""
+        if not self._ensure_open():
+            return None
+        t0 = time.perf_counter()
+        if not self.capture.grab():
+            return self._capture_failed()
+        self._grabbed_at = time.perf_counter()
+        if not wanted():
+            self.grab_skipped += 1
+            return None
+        return self._retrieve(t0)
+
+    def _retrieve(self, t0):
+        buf = self._capture_ring.acquire()
+        ok, frame = self.capture.retrieve(buf) if buf is not None else self.capture.retrieve()
+        if not ok or frame is None:
+            self._capture_ring.release(buf)
+            return self._capture_failed()
+        return self._accept(frame, buf, t0)
+
+    def _accept(self, frame, buf, t0):
+        """Contabilidad de un frame recibido: tiempos, llegada y forma del anillo.
+
+        Quien recibe el frame tiene una referencia en el anillo y debe soltarla (_frames.release).
+        """
+        self.stats['capture'].record(time.perf_counter() - t0)
+        self.retrieved += 1
+        self._captured_at = self._grabbed_at - self._stream_lag(self._grabbed_at)
+        if frame is not buf:
+            # Primer frame o la cámara cambió de resolución: el anillo adopta su forma
+            self._capture_ring.release(buf)
+            self._capture_ring.reshape(frame.shape)
+
+        # Reset reconnect delay on success
+        self._reconnect_delay = 1.0
+        self._signal_lost = False
+        return frame
+
+    def _stream_lag(self, now):
+        """Retraso del frame en la cola de la cámara según su marca de tiempo (0 si no la hay).
+
+        now - posición del stream es constante mientras se lee al ritmo de la cámara y
+        crece si se acumulan frames; el retraso se mide contra el mínimo observado.
+        """
+        try:
+            pos = float(self.capture.get(cv2.CAP_PROP_POS_MSEC))
+        except Exception:
+            return 0.0
+        if pos <= 0:
+            return 0.0
+        offset = now - pos / 1000.0
+        if self._lag_base is None or offset < self._lag_base:
+            self._lag_base = offset
+        return offset - self._lag_base
 
+    def _analyze(self, frame, captured_at=None):
+        """Resize + gris + detector + ocupación por ROI. Devuelve (frame_resized, estado, layout).
+
+        frame_resized llega con una referencia en su anillo para quien llama (que la suelta).
+        """
+        t0 = time.perf_counter()
+        analysis = self._analysis
+        crop, tracker, detector = analysis
+        layout = crop.source
+        frame_resized, ratios = score_frame(frame, crop, detector, self._timer, self._resize_ring)
+        if frame_resized is frame:
+            self._frames.retain(frame)  # sin resize: el mismo buffer de captura
+        # El estado publicado es el estable del tracker, no el dato crudo de este frame
+        changed = tracker.update(ratios).size > 0
+        new_estado = tracker.state.tolist()
+
+        self._frames.retain(frame_resized)  # referencia del estado publicado
+        with self.lock:
+            state = self.state
+            # Si el layout o el detector cambiaron durante este frame, el estado ya fue
+            # reiniciado por set_espacios / set_detector: solo se publica el frame
+            published = analysis is self._analysis and changed
+            if published:
+                self.state = state.replace(seq=state.seq + 1, frame=frame_resized, estado=tuple(new_estado),
+                                           estado_version=state.estado_version + 1)
+            else:
+                self.state = state.replace(seq=state.seq + 1, frame=frame_resized)
+        # El frame anterior se suelta después de publicar el nuevo (ver FramePool)
+        self._frames.release(state.frame)
+        if published:
+            self._emit(new_estado)
+        self._update_mode(changed, detector.motion(ratios, crop.layout))
+
+        now = time.perf_counter()
+        self.stats['analysis'].record(now - t0)
+        if captured_at is not None:
+            self.stats['frame_age'].record(now - captured_at)
+        if self._last_analysis_end is not None:
+            interval = now - self._last_analysis_end
+            if interval > 0:
+                fps = 1.0 / interval
+                self.achieved_fps = fps if self.achieved_fps == 0.0 else self.achieved_fps * 0.9 + fps * 0.1
+        self._last_analysis_end = now
+        return frame_resized, new_estado, layout
+
+    def _annotate(self, frame_resized, estado, layout):
+        """Dibujar ROI + etiquetas, publicar al broadcaster y dejar el JPEG codificado"""
+        t0 = time.perf_counter()
+        # Capa pre-renderizada del layout (se crea una vez por versión) compuesta sobre una
+        # copia del frame en un buffer del anillo
+        overlay = self._overlay
+        if overlay is None or overlay.layout is not layout:
+            overlay = self._overlay = AnnotationOverlay(layout)
+        overlay.update(estado)
+        self._annotate_ring.reshape(frame_resized.shape)
+        annotated = overlay.render(frame_resized, self._annotate_ring.acquire())
+
+        # Publicar para los clientes MJPEG (la codificación la hace quien lo pide o esta etapa en pipeline)
+        self.broadcaster.publish(annotated)
+        if self.pipeline:
+            # En modo pipeline la codificación JPEG (de cada nivel con clientes) también es parte de esta etapa
+            self.broadcaster.encode_subscribed()
+        self._frames.release(annotated)  # desde aquí lo retiene el broadcaster
+        self.stats['annotation'].record(time.perf_counter() - t0)
+
+    # ----------------- Planificador adaptativo -----------------
+    def touch(self):
+        """Registrar un acceso (API o cliente de vídeo): sale de 'suspended'/'idle' si hace falta"""
+        now = time.monotonic()
+        self._last_access = now
+        if self.mode == 'suspended' or (self.mode == 'idle' and self.broadcaster.subscribers > 0):
+            self.mode = 'full'
+            self._last_change = now
+            self._wake.set()
+
+    def _update_mode(self, changed, motion):
+        """Elegir el ritmo tras cada análisis según clientes, cambios de ocupación y movimiento"""
+        now = time.monotonic()
+        self.last_motion = motion
+        if changed or motion >= MOTION_WAKE_RATIO:
+            self._last_change = now
+        if self.broadcaster.subscribers > 0 or now - self._last_change < IDLE_AFTER_SECONDS:
+            self.mode = 'full'
+        else:
+            self.mode = 'idle'
+
+    def current_fps(self):
+        return self.target_fps if self.mode == 'full' else self.idle_fps
+
+    def _maybe_suspend(self):
+        """Liberar la cámara si nadie ha consultado nada en IDLE_SHUTDOWN_SECONDS; True si está suspendido"""
+        if IDLE_SHUTDOWN_SECONDS <= 0 or self.broadcaster.subscribers > 0:
+            return False
+        if self.mode != 'suspended' and time.monotonic() - self._last_access < IDLE_SHUTDOWN_SECONDS:
+            return False
+        if self.capture is not None:
+            try:
+                self.capture.release()
+            except Exception:
+                pass
+            self.capture = None
+        self.mode = 'suspended'
+        self._wake.wait(1.0)
+        self._wake.clear()
+        return self.mode == 'suspended'
+
+    def _pace(self, started):
+        """Esperar lo necesario para no superar el ritmo actual (sustituye al sleep fijo)"""
+        fps = self.current_fps()
+        if fps > 0:
+            remaining = (1.0 / fps) - (time.perf_counter() - started)
+            # Un cliente nuevo de /video_feed corta la espera (vuelta inmediata a 'full')
+            if remaining > 0 and self._wake.wait(remaining):
+                self._wake.clear()
+
+    # ----------------- Modo clásico (un hilo) -----------------
     def _reader_worker(self):
-        reconnect_delay = 1.0
         while not self._stop:
-            if self.capture is None or not self.capture.isOpened():
-                # intentar abrir
-                self._open_capture()
-                time.sleep(reconnect_delay)
-                reconnect_delay = min(5.0, reconnect_delay * 1.5)
+            if self._maybe_suspend():
                 continue
+            started = time.perf_counter()
+            frame = self._read_frame()
+            if frame is None:
+                continue
+            # Sin clientes en /video_feed no se anota ni se codifica
+            self._process(frame, annotate=self.broadcaster.subscribers > 0)
+            self._pace(started)
 
-            ok, frame = self.capture.read()
-            if not ok or frame is None:
-                # intentar reconectar
-                self.capture.release()
-                self.capture = None
-                time.sleep(1.0)
+    def _process(self, frame, annotate=True):
+        """Analizar un frame leído (y anotarlo si `annotate`) y soltar después sus buffers"""
+        frame_resized, estado, layout = self._analyze(frame, self._captured_at)
+        self._frames.release(frame)
+        if annotate:
+            self._annotate(frame_resized, estado, layout)
+        self._frames.release(frame_resized)
+
+    # ----------------- Modo pipeline (tres hilos) -----------------
+    def _capture_worker(self):
+        # Lee tan rápido como entrega la cámara; el buzón solo guarda el último frame.
+        # Con CAPTURE_MODE=grab se hace grab() de todos (la cola de la cámara no crece) y
+        # retrieve() solo cuando el análisis está esperando un frame
+        wanted = lambda: self._capture_slot.waiting > 0
+        while not self._stop:
+            if self._maybe_suspend():
                 continue
+            frame = self._grab_frame(wanted) if self.capture_mode == 'grab' else self._read_frame()
+            if frame is not None:
+                self._capture_slot.put((frame, self._captured_at))
 
-            # Reset reconnect delay on success
-            reconnect_delay = 1.0
-
-            # Procesamiento básico: redimensionar para velocidad y estabilidad
-            frame_resized = cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT))
-            gray = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2GRAY)
-            blurred = cv2.GaussianBlur(gray, (5,5), 0)
-
-            # Aplicar sustracción de fondo a la imagen completa
-            fgmask = self.backsub.apply(blurred)
-
-            # Para cada ROI, determinar si ocupado
-            new_estado = []
-            for (idx, (x, y, w, h)) in enumerate(espacios):
-                # Asegurar coordenadas dentro del frame
-                x2 = max(0, x)
-                y2 = max(0, y)
-                xw = min(FRAME_WIDTH, x + w)
-                yh = min(FRAME_HEIGHT, y + h)
-                if x2 >= xw or y2 >= yh:
-                    new_estado.append(False)
-                    continue
+    def _analysis_worker(self):
+        seq = 0
+        while not self._stop:
+            started = time.perf_counter()
+            seq, item = self._capture_slot.get_newer(seq)
+            if item is None:
+                continue
+            result = self._analyze(*item)
+            self._frames.release(item[0])
+            # La referencia de frame_resized pasa al buzón y de ahí a la anotación
+            self._analysis_slot.put(result)
+            self._pace(started)
 
-                roi_mask = fgmask[y2:yh, x2:xw]
-                # Contar píxeles en movimiento
-                non_zero = int(cv2.countNonZero(roi_mask))
-                area = (xw - x2) * (yh - y2)
+    def _annotation_worker(self):
+        seq = 0
+        while not self._stop:
+            if self.broadcaster.subscribers == 0:
+                # Nadie mira /video_feed: no anotar ni codificar
+                time.sleep(0.1)
+                continue
+            seq, result = self._analysis_slot.get_newer(seq)
+            if result is None:
+                continue
+            self._annotate(*result)
+            self._frames.release(result[0])
 
-                occupied = (non_zero / float(area + 1e-6)) > AREA_OCCUPIED_RATIO
-                new_estado.append(bool(occupied))
+    def _record_stage(self, name, seconds):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats.setdefault(name, StageStats(name))
+        stats.record(seconds)
 
-            # Dibujar rectángulos sobre la copia para streaming
-            annotated = frame_resized.copy()
-            for i, (x,y,w,h) in enumerate(espacios):
-                color = (0,255,0) if not new_estado[i] else (0,0,255)  # verde libre, rojo ocupado
-                cv2.rectangle(annotated, (x,y), (x+w, y+h), color, 2)
-                label = f"{i+1} {'Libre' if not new_estado[i] else 'Ocupado'}"
-                cv2.putText(annotated, label, (x, max(0,y-6)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+    def get_pipeline_stats(self, histograms=False):
+        """Métricas por etapa: profundidad de cola, drops y latencias (y sus histogramas para /metrics)"""
+        return {
+            'mode': 'pipeline' if self.pipeline else 'single',
+            'target_fps': self.target_fps,
+            'achieved_fps': round(self.achieved_fps, 2),
+            'stream_clients': self.broadcaster.subscribers,
+            'stream_tiers': self.broadcaster.get_tiers_info(),
+            'stages': {name: st.as_dict(histograms) for name, st in list(self.stats.items())},
+            'capture_mode': self.capture_mode,
+            'counters': {'reconnects': self.reconnects, 'read_failures': self.read_failures,
+                         'stream_skipped': self.broadcaster.skipped, 'grab_skipped': self.grab_skipped,
+                         'retrieved': self.retrieved},
+            'scheduler': self.get_status(),
+            'detector': self.detector.get_info(),
+            'crop': self.crop.get_info(),
+            'buffers': {'capture': self._capture_ring.get_info(), 'resize': self._resize_ring.get_info(),
+                        'annotate': self._annotate_ring.get_info()},
+        }
 
-            with self.lock:
-                self.frame = frame_resized
-                self.annotated_frame = annotated
-                self.estado_espacios = new_estado
+    def get_status(self):
+        """Modo y ritmo actuales del planificador adaptativo"""
+        now = time.monotonic()
+        return {
+            'mode': self.mode,
+            'current_fps': self.current_fps() if self.mode != 'suspended' else 0.0,
+            'target_fps': self.target_fps,
+            'idle_fps': self.idle_fps,
+            'achieved_fps': round(self.achieved_fps, 2),
+            'stream_clients': self.broadcaster.subscribers,
+            'last_motion_ratio': round(self.last_motion, 4),
+            'seconds_since_change': round(now - self._last_change, 1),
+            'seconds_since_access': round(now - self._last_access, 1),
+        }
 
-            # Small sleep to yield CPU (control FPS)
-            time.sleep(0.03)
+    def profile(self, seconds=3.0):
+        """Muestrear las pilas de los hilos de trabajo durante `seconds` (texto collapsed)"""
+        return sample_stacks([t.ident for t in self._threads], seconds)
 
     def get_frame_bytes(self):
-        """Obtener frame anotado en bytes JPEG (para streaming MJPEG)"""
+        """Obtener frame anotado en bytes JPEG (codificado una sola vez por frame)"""
+        self.touch()
+        _, jpeg = self.broadcaster.latest()
+        return jpeg
+
+    def get_snapshot_bytes(self, tier=None):
+        """Frame actual (sin anotar) en JPEG, o None si aún no hay frame.
+
+        Sin `tier` es el frame completo con SNAPSHOT_QUALITY (calibración); con un nivel del
+        stream, su tamaño y calidad (p. ej. /thumbnail). Cada frame se codifica una sola vez
+        por nivel: las peticiones siguientes reciben el JPEG guardado.
+        """
+        self.touch()
+        cache = self._snapshots.get(tier)
+        if cache is None:
+            # Sin tope de fps: la caché va por secuencia de frame, no por turnos
+            base = self.broadcaster.get_tier(tier) if tier is not None else StreamTier('snapshot', 0, SNAPSHOT_QUALITY)
+            cache = self._snapshots.setdefault(tier, TierCache(StreamTier(base.name, base.width, base.quality)))
+        # Sin copia ni self.lock: el frame se retiene en su anillo mientras se codifica
+        with self._frames.lock:
+            state = self.state
+            self._frames.retain(state.frame)
+        if state.frame is None:
+            return None
+        try:
+            with cache.lock:
+                if cache.seq != state.seq and not cache.encode(state.frame, state.seq):
+                    return None
+                return cache.jpeg
+        finally:
+            self._frames.release(state.frame)
+
+    def set_espacios(self, new_rois, version=0):
+        """Cambiar el layout de ROI; se precompila aquí una sola vez y se aplica en el siguiente frame"""
+        layout = RoiLayout(new_rois, version=version)
+        crop = RoiCrop(layout, self.roi_crop, self.analysis_scale)
         with self.lock:
-            if self.annotated_frame is None:
-                return None
-            ret, jpeg = cv2.imencode('.jpg', self.annotated_frame)
-            if not ret:
-                return None
-            return jpeg.tobytes()
+            detector = self.detector
+            self._analysis = (crop, self._new_tracker(len(layout), detector), detector)
+            state = self.state
+            self.state = state.replace(estado=(False,) * len(layout), layout=layout,
+                                       estado_version=state.estado_version + 1)
+        self._emit([False] * len(layout))
 
-    def get_estado_espacios(self):
+    def get_espacios(self):
+        return list(self.layout.espacios)
+
+    def _new_tracker(self, n, detector):
+        """Tracker con los umbrales de `detector` (continúa la numeración de eventos)"""
+        previous = self.tracker if hasattr(self, '_analysis') else None
+        return OccupancyTracker(n, detector.enter_ratio, detector.exit_ratio,
+                                event_seq=previous.event_seq if previous is not None else 0)
+
+    def set_detector(self, name, **options):
+        """Cambiar de motor de detección en caliente (el estado se reinicia)"""
+        detector = create_detector(name, **options)
         with self.lock:
-            # devolver copia para evitar race
-            return list(self.estado_espacios)
+            self._analysis = (self.crop, self._new_tracker(len(self.layout), detector), detector)
+            state = self.state
+            self.state = state = state.replace(estado=(False,) * len(state.layout),
+                                               estado_version=state.estado_version + 1)
+        self._emit(list(state.estado))
+
+    # Vistas del último estado publicado y de la configuración del análisis (lectura sin lock)
+    @property
+    def layout(self):
+        return self.state.layout
+
+    @property
+    def frame(self):
+        """Copia del último frame analizado (el buffer original vuelve al anillo)"""
+        with self._frames.lock:
+            frame = self.state.frame
+            return None if frame is None else frame.copy()
+
+    @property
+    def annotated_frame(self):
+        """Copia del último frame anotado"""
+        return self.broadcaster.frame_copy()
+
+    @property
+    def estado_espacios(self):
+        return list(self.state.estado)
+
+    @property
+    def estado_version(self):
+        return self.state.estado_version
+
+    @property
+    def crop(self):
+        return self._analysis[0]
+
+    @property
+    def tracker(self):
+        return self._analysis[1]
+
+    @property
+    def detector(self):
+        return self._analysis[2]
+
+    def get_detector_info(self):
+        return self.detector.get_info()
+
+    def add_listener(self, callback):
+        """Registrar callback(estado, timestamp) que se llama (fuera del lock) con cada nuevo estado publicado"""
+        self._listeners.append(callback)
+
+    def _emit(self, estado):
+        ts = time.time()
+        for callback in list(self._listeners):
+            try:
+                callback(estado, ts)
+            except Exception:
+                pass
+
+    def get_eventos(self, since=0):
+        """Transiciones confirmadas [(seq, timestamp, indice, ocupado)] con seq > since"""
+        return self.tracker.events_since(since)
+
+    def estado_etag(self):
+        """Identificador de la versión actual del estado (leerlo antes que el estado)"""
+        return f'{self.etag_token}-{self.state.estado_version}'
+
+    def get_estado_espacios(self):
+        self.touch()
+        # La tupla del estado publicado no cambia: basta una lectura de referencia, sin lock
+        return list(self.state.estado)
 
     def stop(self):
         self._stop = True
+        self._capture_slot.close()
+        self._analysis_slot.close()
+        self.broadcaster.close()
+        self._wake.set()
+        # Esperar a que los hilos terminen antes de liberar la captura (read() no es reentrante)
+        for t in self._threads:
+            if t is not threading.current_thread():
+                t.join(timeout=2.0)
         try:
             if self.capture is not None:
                 self.capture.release()
@@ -188,12 +1624,8 @@ def index():
 
 # Stream MJPEG
 def mjpeg_generator():
-    while True:
-        frame = video_processor.get_frame_bytes()
-        if frame is None:
-            # enviar frame vacío o log
-            time.sleep(0.05)
-            continue
+    # Cada cliente espera el siguiente frame del broadcaster (sin sondeo ni recodificación)
+    for frame in video_processor.broadcaster.stream():
         yield (b'--frame\r\n'
                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
@@ -0,0 +1,280 @@
+"""
+Modo de servicio asíncrono (ASGI) para app.py.
+
+Con el servidor de desarrollo de Flask cada cliente de /video_feed o de
+/api/stream/estado ocupa un hilo del sistema mientras está conectado. Aquí esas rutas,
+y /api/estado (la más sondeada), son corrutinas alimentadas directamente por el
+pipeline: FrameBroadcaster.stream_async() y live_feed.sse_stream_async() esperan un
+Future compartido por event loop, así que un cliente conectado cuesta una tarea asyncio
+y sus buffers (unos KB), no un hilo. El resto de rutas (páginas, autenticación,
+reservas, historial...) se siguen atendiendo con la aplicación Flask, ejecutada en un
+pool de ASYNC_WSGI_THREADS hilos.
+
+Requiere un servidor ASGI (uvicorn, dependencia opcional):
+  SERVER_MODE=async python app.py
+  uvicorn --factory app:create_asgi_app --host 0.0.0.0 --port 5000
+
+Un solo proceso: el registro de cámaras, los feeds y el índice de reservas viven en
+memoria del proceso (no usar --workers > 1).
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import live_feed
+
+ASYNC_WSGI_THREADS = int(os.environ.get('ASYNC_WSGI_THREADS', 16))  # hilos para las rutas Flask
+MJPEG_PART = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+
+class AsyncStreamingApp:
+    """Aplicación ASGI: rutas de streaming/estado como corrutinas y el resto a Flask"""
+
+    def __init__(self, flask_app, registry, get_feed, threads=ASYNC_WSGI_THREADS):
+        self.flask_app = flask_app
+        self.registry = registry
+        self.get_feed = get_feed
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        self.routes = {
+            '/video_feed': self.video_feed,
+            '/api/stream/estado': self.stream_estado,
+            '/api/estado': self.estado,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        handler = self.routes.get(scope['path'])
+        if handler is not None and scope['method'] in ('GET', 'HEAD'):
+            await handler(scope, receive, send)
+        else:
+            await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # ----------------- Rutas asíncronas -----------------
+    async def _processor(self, cam_id, send):
+        """Procesador de la cámara (arrancándolo fuera del event loop si hace falta) o None tras un 404"""
+        try:
+            processor = self.registry.get(cam_id, start=False)
+            if processor is None:
+                processor = await asyncio.get_running_loop().run_in_executor(self.executor, self.registry.get, cam_id)
+        except KeyError:
+            await self._json(send, 404, {'error': 'unknown camera', 'camera': cam_id, 'cameras': self.registry.ids()})
+            return None
+        return processor
+
+    async def video_feed(self, scope, receive, send):
+        query = _query(scope)
+        processor = await self._processor(query.get('camera'), send)
+        if processor is None:
+            return
+        tier = query.get('tier') or None
+        if not processor.broadcaster.has_tier(tier):
+            await self._json(send, 400, {'error': 'unknown tier', 'tier': tier,
+                                         'tiers': processor.broadcaster.get_tiers_info()})
+            return
+
+        async def parts():
+            async for jpeg in processor.broadcaster.stream_async(tier=tier):
+                yield MJPEG_PART + jpeg + b'\r\n'
+        await self._stream(receive, send, 'multipart/x-mixed-replace; boundary=frame', parts())
+
+    async def stream_estado(self, scope, receive, send):
+        query = _query(scope)
+        cam_id = query.get('camera')
+        try:
+            feed = self.get_feed(cam_id)
+        except KeyError:
+            await self._json(send, 404, {'error': 'unknown camera', 'camera': cam_id, 'cameras': self.registry.ids()})
+            return
+        since = _header(scope, b'last-event-id') or query.get('since')
+
+        async def messages():
+            async for message in live_feed.sse_stream_async(feed, since):
+                yield message.encode('utf-8')
+        await self._stream(receive, send, 'text/event-stream', messages(),
+                           [(b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')])
+
+    async def estado(self, scope, receive, send):
+        processor = await self._processor(_query(scope).get('camera'), send)
+        if processor is None:
+            return
+        # Mismo contrato que la ruta Flask: ETag por versión del estado y 304 si no cambió
+        etag = processor.estado_etag()
+        headers = [(b'etag', f'"{etag}"'.encode()), (b'cache-control', b'no-cache')]
+        if _etag_matches(_header(scope, b'if-none-match'), etag):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await self._json(send, 200, processor.get_estado_espacios(), headers)
+
+    # ----------------- Respuestas -----------------
+    async def _json(self, send, status, payload, headers=()):
+        body = json.dumps(payload).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode())] + list(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _stream(self, receive, send, content_type, chunks, headers=()):
+        """Enviar `chunks` (generador asíncrono de bytes) hasta que se agote o el cliente se desconecte"""
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', content_type.encode())] + list(headers)})
+
+        async def pump():
+            async for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        async def disconnected():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnected())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await chunks.aclose()
+        try:
+            await send({'type': 'http.response.body', 'body': b''})
+        except Exception:
+            pass  # conexión ya cerrada
+
+    # ----------------- Puente WSGI (rutas Flask) -----------------
+    async def _wsgi(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        environ = _environ(scope, bytes(body))
+        loop = asyncio.get_running_loop()
+        status, headers, result = await loop.run_in_executor(self.executor, _start_wsgi, self.flask_app, environ)
+        chunks = iter(result)
+        try:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            # Cada trozo se pide en el pool (el iterador de Flask puede bloquear) y se envía en cuanto llega
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+
+
+def _start_wsgi(wsgi_app, environ):
+    """Llamar a la aplicación WSGI (en un hilo del pool): (estado, cabeceras, iterable del cuerpo)"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    result = wsgi_app(environ, start_response)
+    if 'status' not in response:
+        # start_response puede llegar con el primer trozo (WSGI lo permite): adelantarlo
+        first = next(iter(result), b'')
+        return response['status'], response['headers'], _prepend(first, result)
+    return response['status'], response['headers'], result
+
+
+class _prepend:
+    """Iterable con `first` seguido del resto de `result` (conserva su close())"""
+
+    def __init__(self, first, result):
+        self.first, self.result = first, result
+
+    def __iter__(self):
+        yield self.first
+        yield from self.result
+
+    def close(self):
+        if hasattr(self.result, 'close'):
+            self.result.close()
+
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # PATH_INFO va decodificado (como en Werkzeug): los bytes UTF-8 del path vistos como latin-1
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _query(scope):
+    return {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/').strip('"') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
+def _header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def serve(application, host='0.0.0.0', port=5000):
+    """Servir `application` con uvicorn (pip install uvicorn)"""
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('SERVER_MODE=async requiere uvicorn: pip install uvicorn')
+    # backlog alto: miles de clientes de streaming conectándose a la vez
+    uvicorn.run(application, host=host, port=port, backlog=4096, log_level='warning')
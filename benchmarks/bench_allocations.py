@@ -0,0 +1,107 @@
+"""
+Benchmark: memoria asignada por frame en el camino de VideoProcessor (tracemalloc).
+
+Ejecuta en este hilo, frame a frame, los mismos pasos que el bucle clásico del
+procesador (leer, analizar, anotar) más la codificación JPEG para /video_feed y, con
+--snapshot, la de /snapshot (la salida de imencode es memoria nueva en cada frame: del
+orden de dos veces el tamaño del JPEG; --no-encode la excluye). La cámara es una FrameSource que copia cada frame en el
+buffer que recibe en read(), como cv2.VideoCapture.read(image).
+
+Por cada frame se mide, tras el calentamiento:
+  - pico transitorio: cuánta memoria llegó a haber asignada por encima de la del inicio
+    del frame (tracemalloc.reset_peak / get_traced_memory); con buffers reutilizados es
+    casi cero, con arrays nuevos por paso es del orden de varios frames completos
+  - memoria retenida al final del frame respecto al inicio (debería ser ~0)
+y al final las líneas que más memoria nueva retienen (snapshot.compare_to).
+
+Uso (desde la raíz del proyecto):
+  python benchmarks/bench_allocations.py
+  python benchmarks/bench_allocations.py --camera-size 1920x1080 --detector mog2 --snapshot
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app_camera import FRAME_HEIGHT, FRAME_WIDTH, VideoProcessor  # noqa: E402
+from frame_sources import FrameSource  # noqa: E402
+from synthetic_lot import SyntheticLot  # noqa: E402
+
+
+class ManualProcessor(VideoProcessor):
+    """VideoProcessor sin hilo de trabajo: el benchmark ejecuta cada paso"""
+
+    def _reader_worker(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--spaces', type=int, default=69)
+    parser.add_argument('--detector', default='adaptive')
+    parser.add_argument('--camera-size', default=f'{FRAME_WIDTH}x{FRAME_HEIGHT}',
+                        help='resolución que entrega la cámara (distinta de FRAME_WIDTHxFRAME_HEIGHT = con resize)')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--snapshot', action='store_true', help='codificar también /snapshot en cada frame')
+    parser.add_argument('--no-encode', action='store_true', help='sin codificación JPEG (solo captura, análisis y anotación)')
+    parser.add_argument('--top', type=int, default=8)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.camera_size.lower().split('x'))
+    lot = SyntheticLot(args.spaces, FRAME_WIDTH, FRAME_HEIGHT, seed=0)
+    # Un banco de frames ya generados a la resolución de la cámara (el generador no cuenta)
+    bank = []
+    for frame, _ in lot.frames(16):
+        bank.append(frame if (width, height) == (FRAME_WIDTH, FRAME_HEIGHT) else cv2.resize(frame, (width, height)))
+    options = {'reference': lot.empty_frame()} if args.detector == 'reference' else None
+    source = FrameSource(itertools.cycle(bank), fps=30, pacing='fast')
+    vp = ManualProcessor(source, lot.espacios, pipeline=False, target_fps=0, detector=args.detector,
+                         detector_options=options)
+
+    def step():
+        vp._process(vp._read_frame())
+        if not args.no_encode:
+            vp.broadcaster.latest()
+        if args.snapshot:
+            vp.get_snapshot_bytes()
+
+    for _ in range(args.warmup):
+        step()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    peaks, retained = [], []
+    t0 = time.perf_counter()
+    for _ in range(args.frames):
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        step()
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - start)
+        retained.append(current - start)
+    elapsed = time.perf_counter() - t0
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    vp.stop()
+
+    frame_mb = FRAME_WIDTH * FRAME_HEIGHT * 3 / 1e6
+    peaks, retained = np.array(peaks) / 1e6, np.array(retained) / 1e6
+    print(f'cámara {width}x{height} -> {FRAME_WIDTH}x{FRAME_HEIGHT}, {args.spaces} plazas, detector {args.detector}, '
+          f'{args.frames} frames ({elapsed / args.frames * 1000:.1f} ms/frame con tracemalloc)')
+    print(f'pico transitorio por frame: mediana {np.median(peaks):.3f} MB, máx {peaks.max():.3f} MB '
+          f'({np.median(peaks) / frame_mb:.2f} frames BGR completos)')
+    print(f'retenido por frame: media {retained.mean() * 1000:.1f} kB; total {retained.sum():.3f} MB')
+    print('\nLíneas con más memoria nueva retenida:')
+    for stat in after.compare_to(before, 'lineno')[:args.top]:
+        print(f'  {stat}')
+
+
+if __name__ == '__main__':
+    main()
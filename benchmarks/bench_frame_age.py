@@ -0,0 +1,80 @@
+"""
+Benchmark: edad de los frames analizados con CAPTURE_MODE=read frente a CAPTURE_MODE=grab.
+
+Simula una cámara RTSP: una FrameSource 'realtime' con buffered=True entrega frames a
+--camera-fps y, si el consumidor va más lento, los acumula en cola en lugar de
+descartarlos (como el buffer interno del backend de FFmpeg). El VideoProcessor analiza a
+--analysis-fps. Con 'read' cada frame sale de la cola en orden y su edad crece sin
+límite; con 'grab' la cola se vacía con grab() y solo se hace retrieve() del frame que
+se analiza.
+
+Por cada modo (y modo clásico / pipeline) informa: frames analizados, frames entregados
+por read()/retrieve() (convertidos y copiados), frames descartados con grab(), edad del
+frame analizado (media, p50/p99 a partir del histograma de /metrics y máximo) y CPU.
+
+Uso (desde la raíz del proyecto):
+  python benchmarks/bench_frame_age.py
+  python benchmarks/bench_frame_age.py --camera-fps 25 --analysis-fps 5 --seconds 20 --pipeline
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app_camera import FRAME_HEIGHT, FRAME_WIDTH, VideoProcessor  # noqa: E402
+from frame_sources import FrameSource  # noqa: E402
+from metrics import LATENCY_BUCKETS  # noqa: E402
+from synthetic_lot import SyntheticLot  # noqa: E402
+
+
+def histogram_quantile(snapshot, q):
+    """Cuantil aproximado (límite superior del cubo, como histogram_quantile de Prometheus)"""
+    total = snapshot['count']
+    if not total:
+        return float('nan')
+    for bound, n in zip(list(LATENCY_BUCKETS) + [float('inf')], snapshot['buckets']):
+        if n >= q * total:
+            return bound
+    return float('inf')
+
+
+def run(mode, pipeline, args, bank, espacios):
+    source = FrameSource(itertools.cycle(bank), fps=args.camera_fps, pacing='realtime', buffered=True)
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    vp = VideoProcessor(source, espacios, pipeline=pipeline, target_fps=args.analysis_fps, detector=args.detector,
+                        capture_mode=mode)
+    time.sleep(args.seconds)
+    stats = vp.get_pipeline_stats(histograms=True)
+    cpu, elapsed = time.process_time() - cpu0, time.perf_counter() - t0
+    vp.stop()
+    age = stats['stages']['frame_age']
+    fmt = lambda s: f'{s * 1000:.0f}' if s != float('inf') else f">{LATENCY_BUCKETS[-1] * 1000:.0f}"
+    print(f"{mode:>5} {'pipeline' if pipeline else 'clásico':>9} {age['count']:>9} {stats['counters']['retrieved']:>9} "
+          f"{stats['counters']['grab_skipped']:>9} {age['avg_ms']:>9.0f} {fmt(histogram_quantile(age['histogram'], 0.5)):>8} "
+          f"{fmt(histogram_quantile(age['histogram'], 0.99)):>8} {age['max_ms']:>9.0f} {cpu / elapsed * 100:>6.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--camera-fps', type=float, default=30.0)
+    parser.add_argument('--analysis-fps', type=float, default=10.0)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--spaces', type=int, default=69)
+    parser.add_argument('--detector', default='adaptive')
+    parser.add_argument('--pipeline', action='store_true', help='medir también el modo pipeline')
+    args = parser.parse_args()
+
+    lot = SyntheticLot(args.spaces, FRAME_WIDTH, FRAME_HEIGHT, args.camera_fps, seed=0)
+    bank = [frame for frame, _ in lot.frames(16)]
+    print(f'cámara {args.camera_fps:g} fps (con cola), análisis {args.analysis_fps:g} fps, {args.seconds:g} s por modo')
+    print(f"{'modo':>5} {'hilos':>9} {'análisis':>9} {'retrieve':>9} {'grab desc':>9} {'edad ms':>9} {'p50 ms':>8} "
+          f"{'p99 ms':>8} {'máx ms':>9} {'CPU':>7}")
+    for pipeline in ([False, True] if args.pipeline else [False]):
+        for mode in ('read', 'grab'):
+            run(mode, pipeline, args, bank, lot.espacios)
+
+
+if __name__ == '__main__':
+    main()
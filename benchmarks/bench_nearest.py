@@ -0,0 +1,133 @@
+"""
+Benchmark: búsqueda de los k espacios libres y sin reserva más cercanos (spatial_index).
+
+Monta un lote de --cameras cámaras con --spaces plazas cada una (layouts de
+synthetic_lot), colocadas en mosaico con su lot_transform, una ocupación aleatoria
+(--occupied) y un --reserved de reservas. La vista del lote (ids, config, lot_espacios,
+lot_estado, lot_etag) la da StaticLot con datos fijos, en lugar de CameraRegistry, para
+no arrancar cámaras; NearestFreeSpaces es el mismo que usa /api/lote/cercanos.
+
+Informa:
+  - construcción del índice (una vez por versión de layout) y de la máscara de
+    disponibles (cuando cambia el estado o las reservas)
+  - latencia de NearestFreeSpaces.query con 1 y con 3 entradas (p50 / p99)
+  - la misma consulta por fuerza bruta con numpy, y que ambas dan las mismas distancias
+  - bytes de la respuesta frente a /api/lote/espacios + /api/lote/estado
+
+Uso (desde la raíz del proyecto):
+  python benchmarks/bench_nearest.py
+  python benchmarks/bench_nearest.py --cameras 16 --spaces 2000 --occupied 0.97 --k 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from spatial_index import NearestFreeSpaces, as_transform  # noqa: E402
+from synthetic_lot import SyntheticLot  # noqa: E402
+
+
+class StaticConfig:
+    def __init__(self, espacios, lot_transform):
+        self.espacios = espacios
+        self.lot_transform = lot_transform
+
+
+class StaticLot:
+    """Vista del lote con la interfaz de CameraRegistry que usa NearestFreeSpaces"""
+
+    def __init__(self, configs, estado):
+        self.configs = configs
+        self.estado = list(estado)
+        self.version = 0
+
+    def ids(self):
+        return list(self.configs)
+
+    def config(self, cam_id=None):
+        return self.configs[cam_id or next(iter(self.configs))]
+
+    def lot_espacios(self):
+        espacios, offset = [], 0
+        for cam_id, cfg in self.configs.items():
+            for i, (x, y, w, h) in enumerate(cfg.espacios):
+                espacios.append({'numero': offset + i + 1, 'camara': cam_id, 'indice': i,
+                                 'x': x, 'y': y, 'w': w, 'h': h})
+            offset += len(cfg.espacios)
+        return espacios
+
+    def lot_estado(self):
+        return list(self.estado)
+
+    def lot_etag(self):
+        return str(self.version)
+
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return f'p50 {np.percentile(ms, 50):.3f} ms, p99 {np.percentile(ms, 99):.3f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cameras', type=int, default=8)
+    parser.add_argument('--spaces', type=int, default=1000, help='plazas por cámara')
+    parser.add_argument('--occupied', type=float, default=0.9, help='fracción de plazas ocupadas')
+    parser.add_argument('--reserved', type=float, default=0.02, help='fracción de plazas con reserva activa')
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    espacios = SyntheticLot(args.spaces, 1280, 720, noise=0, seed=args.seed).espacios
+    per_row = int(np.ceil(np.sqrt(args.cameras)))
+    # Cada cámara ve un rectángulo de 1280x720 px del lote; el lote se mide en "px de cámara"
+    configs = {f'cam{c}': StaticConfig(list(espacios), as_transform([[1, 0, (c % per_row) * 1300],
+                                                                    [0, 1, (c // per_row) * 740]]))
+               for c in range(args.cameras)}
+    n = args.cameras * len(espacios)
+    lot = StaticLot(configs, (rng.random(n) < args.occupied).tolist())
+    reserved = (1, tuple(int(s) for s in np.flatnonzero(rng.random(n) < args.reserved) + 1))
+    finder = NearestFreeSpaces(lot, lambda: reserved)
+
+    t0 = time.perf_counter()
+    index, spaces = finder._get_index()
+    t_index = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    available = finder._available(len(spaces))
+    t_mask = time.perf_counter() - t0
+    print(f'{args.cameras} cámaras x {len(espacios)} plazas = {n} plazas, {int(available.sum())} disponibles '
+          f'({args.occupied:.0%} ocupadas, {args.reserved:.0%} reservadas), k={args.k}')
+    print(f'índice: {t_index * 1000:.1f} ms ({index.gx}x{index.gy} celdas de {index.cell:.1f}); '
+          f'máscara: {t_mask * 1000:.2f} ms')
+
+    lo, hi = index.points.min(axis=0), index.points.max(axis=0)
+    entries = rng.uniform(lo, hi, (args.queries, 3, 2))
+    for count in (1, 3):
+        times, brute, mismatches = [], [], 0
+        for pts in entries[:, :count]:
+            t0 = time.perf_counter()
+            result = finder.query(pts, args.k)
+            times.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            d = np.min(np.linalg.norm(index.points[None, :, :] - pts[:, None, :], axis=2), axis=0)
+            d[~available] = np.inf
+            best = np.sort(np.partition(d, args.k - 1)[:args.k])
+            brute.append(time.perf_counter() - t0)
+            got = np.array([e['distancia'] for e in result['espacios']])
+            mismatches += not np.allclose(got, np.round(best, 2), atol=0.011)
+        print(f'{count} entrada(s): índice {percentiles(times)}; fuerza bruta {percentiles(brute)}; '
+              f'{mismatches} discrepancias en {args.queries} consultas')
+
+    full = len(json.dumps(lot.lot_espacios())) + len(json.dumps(lot.lot_estado()))
+    answer = len(json.dumps(finder.query(entries[0, :1], args.k)))
+    print(f'respuesta: {answer} bytes frente a {full} bytes de /api/lote/espacios + /api/lote/estado')
+
+
+if __name__ == '__main__':
+    main()
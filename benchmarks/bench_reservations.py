@@ -0,0 +1,116 @@
+"""
+Benchmark: latencia de las consultas de reservas a medida que crece el histórico.
+
+Rellena una base temporal con N reservas históricas (terminadas, canceladas o expiradas,
+como las que se acumulan con el uso) más unas pocas vigentes y futuras, y mide:
+  - create_reservation que reserva: comprobación de solape + INSERT en la misma
+    transacción BEGIN IMMEDIATE (cada llamada usa una hora futura distinta, así que
+    siempre encuentra el espacio libre e inserta)
+  - create_reservation rechazada: solape con una reserva existente (solo la comprobación)
+  - get_active_reservations: espacios reservados ahora
+  - get_free_spaces: espacios libres en una ventana futura de 2 horas
+con los índices de database.py y, con --no-index, sin ellos. Las dos variantes ejecutan
+los mismos métodos de Database con las mismas operaciones (misma semilla): sin índices,
+los de database.py se reemplazan por índices con el mismo nombre sobre created_at, que
+los INDEXED BY aceptan pero solo permiten recorrer la tabla entera.
+
+Uso (desde la raíz del proyecto):
+  python benchmarks/bench_reservations.py
+  python benchmarks/bench_reservations.py --rows 10000,100000,1000000 --spaces 200
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import Database  # noqa: E402
+
+
+def populate(db, rows, spaces, rng):
+    """rows reservas pasadas + ~1 reserva vigente o futura por cada 4 espacios"""
+    now = datetime.now()
+    batch = []
+    for i in range(rows):
+        start = now - timedelta(hours=rng.uniform(2, 24 * 365))
+        status = rng.choice(('expired', 'expired', 'cancelled', 'active'))
+        end = start + timedelta(hours=rng.choice((1, 2, 4)))
+        # las 'active' del histórico ya terminaron (bases sin ExpiryScheduler)
+        batch.append((1, rng.randint(1, spaces), start, end, status))
+        if len(batch) == 50000 or i == rows - 1:
+            db._write('populate', lambda c: c.executemany(
+                'INSERT INTO reservations (user_id, space_number, start_time, end_time, status) VALUES (?, ?, ?, ?, ?)',
+                batch))
+            batch = []
+    for space in range(1, spaces + 1, 4):
+        db.create_reservation(1, space, 1, now + timedelta(hours=rng.choice((0, 3, 6))))
+
+
+def drop_indexes(db):
+    """Dejar los INDEXED BY de database.py sin índice útil (escaneo completo de la tabla)"""
+    def replace(cursor):
+        for name in ('idx_reservations_space_end', 'idx_reservations_active_end'):
+            cursor.execute(f'DROP INDEX {name}')
+            cursor.execute(f'CREATE INDEX {name} ON reservations (created_at)')
+    db._write('drop', replace)
+
+
+def timeit(fn, repeat):
+    """(p50 ms, p99 ms, resultados de cada llamada)"""
+    samples, results = [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        results.append(fn())
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1], results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='1000,10000,100000,1000000')
+    parser.add_argument('--spaces', type=int, default=69)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--no-index', action='store_true', help='comparar también sin índices')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    variants = [True, False] if args.no_index else [True]
+    print(f"{'filas':>9} {'índices':>7} {'reservar p50/p99 (ms)':>22} {'rechazo p50/p99':>16} "
+          f"{'activas p50/p99':>16} {'libres p50/p99':>15}")
+    for rows in (int(r) for r in args.rows.split(',')):
+        for indexed in variants:
+            with tempfile.TemporaryDirectory() as tmp:
+                db = Database(os.path.join(tmp, 'bench.db'))
+                if not indexed:
+                    drop_indexes(db)
+                rng = random.Random(args.seed)
+                populate(db, rows, args.spaces, rng)
+                db.conn.execute('ANALYZE')
+
+                now = datetime.now()
+                window = now + timedelta(hours=2)
+                spaces = range(1, args.spaces + 1)
+                # Reservas que se crean: una hora futura distinta en cada llamada (nunca se solapan)
+                slots = iter(range(10 ** 9))
+                created = lambda: db.create_reservation(1, rng.randint(1, args.spaces), 1,
+                                                        now + timedelta(days=30, hours=next(slots)))
+                c50, c99, ok = timeit(created, args.repeat)
+                # Reservas sobre espacios reservados ahora (populate): solo la comprobación de solape
+                reserved = db.get_active_reservations()
+                busy = lambda: db.create_reservation(1, rng.choice(reserved), 1)
+                r50, r99, rejected = timeit(busy, args.repeat)
+                a50, a99, _ = timeit(db.get_active_reservations, args.repeat)
+                f50, f99, _ = timeit(lambda: db.get_free_spaces(window, window + timedelta(hours=2), spaces), args.repeat)
+                db.close()
+            if sum(map(bool, ok)) != args.repeat or any(rejected):
+                raise SystemExit(f'resultado inesperado: {sum(map(bool, ok))} reservas creadas de {args.repeat}, '
+                                 f'{sum(map(bool, rejected))} solapes aceptados')
+            print(f"{rows:>9} {'sí' if indexed else 'no':>7} {c50:>10.3f} / {c99:<9.3f} {r50:>7.3f} / {r99:<6.3f} "
+                  f"{a50:>7.3f} / {a99:<6.3f} {f50:>6.3f} / {f99:<6.3f}")
+
+if __name__ == '__main__':
+    main()
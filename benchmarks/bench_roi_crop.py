@@ -0,0 +1,100 @@
+"""
+Benchmark: coste por frame del análisis (gris + detector + ocupación) sobre el frame
+completo frente al análisis recortado a las ROI (RoiCrop 'bbox' / 'tiles') y a menor
+resolución interna (ANALYSIS_SCALE). Comprueba además que, a escala 1, el resultado por
+ROI es idéntico al del frame completo.
+
+Uso (desde la raíz del proyecto):
+  python benchmarks/bench_roi_crop.py --video video.mp4
+  python benchmarks/bench_roi_crop.py --video video.mp4 --espacios espacios.pkl --detector reference
+  python benchmarks/bench_roi_crop.py            # frames sintéticos y dos filas de ROI separadas
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app_camera import RoiCrop, RoiLayout, FRAME_WIDTH, FRAME_HEIGHT  # noqa: E402
+from detectors import create_detector  # noqa: E402
+
+
+def read_frames(path, n):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < n:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT)))
+    cap.release()
+    return frames
+
+
+def synthetic_frames(n, rng):
+    """Fondo con ruido y rectángulos que se mueven (coches)"""
+    base = rng.integers(60, 120, (FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+    frames = []
+    for i in range(n):
+        frame = base.copy()
+        for k in range(6):
+            x = (i * 7 + k * 200) % FRAME_WIDTH
+            cv2.rectangle(frame, (x, 60 + k * 100), (x + 90, 110 + k * 100), (20 * k, 200, 255 - 30 * k), -1)
+        frames.append(frame)
+    return frames
+
+
+def wide_angle_layout():
+    """Dos filas de espacios separadas por la calzada, como en una cámara gran angular"""
+    return ([(x, 80, 60, 40) for x in range(100, 1200, 70)] +
+            [(x, 600, 60, 40) for x in range(50, 700, 70)])
+
+
+def run(frames, crop, detector_name):
+    detector = create_detector(detector_name) if detector_name != 'reference' else \
+        create_detector('reference', reference=frames[0])
+    out = []
+    t0 = time.perf_counter()
+    for frame in frames:
+        gray = cv2.cvtColor(crop.extract(frame), cv2.COLOR_BGR2GRAY)
+        out.append(detector.score(gray, crop.layout))
+    return (time.perf_counter() - t0) / len(frames) * 1000.0, np.array(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='vídeo grabado (por defecto frames sintéticos)')
+    parser.add_argument('--espacios', help='pickle de ROI (por defecto un layout gran angular de ejemplo)')
+    parser.add_argument('--detector', default='mog2')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--scales', default='1,0.75,0.5')
+    args = parser.parse_args()
+
+    frames = read_frames(args.video, args.frames) if args.video else synthetic_frames(args.frames, np.random.default_rng(0))
+    if not frames:
+        sys.exit('no se pudieron leer frames')
+    if args.espacios:
+        with open(args.espacios, 'rb') as f:
+            espacios = pickle.load(f)
+    else:
+        espacios = wide_angle_layout()
+    layout = RoiLayout(espacios)
+
+    base_ms, base = run(frames, RoiCrop(layout, 'off', 1.0), args.detector)
+    print(f"{'modo':>6} {'escala':>6} {'bandas':>6} {'cobertura':>9} {'ms/frame':>9} {'ahorro':>7}  máx. dif.")
+    print(f"{'off':>6} {1.0:>6.2f} {1:>6} {1.0:>9.3f} {base_ms:>9.3f} {'':>7}  -")
+    for mode in ('bbox', 'tiles'):
+        for scale in (float(s) for s in args.scales.split(',')):
+            crop = RoiCrop(layout, mode, scale)
+            ms, ratios = run(frames, crop, args.detector)
+            diff = float(np.abs(ratios - base).max())
+            print(f"{mode:>6} {scale:>6.2f} {len(crop.bands):>6} {crop.coverage:>9.3f} {ms:>9.3f} "
+                  f"{1 - ms / base_ms:>6.0%}  {diff:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark: ocupación por ROI con bucle Python + cv2.countNonZero (implementación
+original de VideoProcessor._reader_worker) frente a RoiLayout (imagen integral).
+
+Uso (desde la raíz del proyecto):
+  python benchmarks/bench_roi_scoring.py
+  python benchmarks/bench_roi_scoring.py --counts 69,500,2000 --repeat 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app_camera import RoiLayout, FRAME_WIDTH, FRAME_HEIGHT, AREA_OCCUPIED_RATIO  # noqa: E402
+
+
+def legacy_occupied(fgmask, espacios, ratio=AREA_OCCUPIED_RATIO):
+    """Bucle original, una ROI a la vez"""
+    new_estado = []
+    for (x, y, w, h) in espacios:
+        x2 = max(0, x)
+        y2 = max(0, y)
+        xw = min(FRAME_WIDTH, x + w)
+        yh = min(FRAME_HEIGHT, y + h)
+        if x2 >= xw or y2 >= yh:
+            new_estado.append(False)
+            continue
+        non_zero = int(cv2.countNonZero(fgmask[y2:yh, x2:xw]))
+        area = (xw - x2) * (yh - y2)
+        new_estado.append(bool((non_zero / float(area + 1e-6)) > ratio))
+    return new_estado
+
+
+def random_layout(n, rng):
+    """n ROI de tamaño similar a las de obtener_espacios.py (algunas fuera del frame)"""
+    w = rng.integers(30, 110, n)
+    h = rng.integers(25, 60, n)
+    x = rng.integers(-20, FRAME_WIDTH, n)
+    y = rng.integers(-20, FRAME_HEIGHT, n)
+    return [tuple(int(v) for v in r) for r in zip(x, y, w, h)]
+
+
+def random_mask(rng, density=0.03):
+    """Máscara tipo MOG2 (0/255) con manchas de movimiento"""
+    mask = np.zeros((FRAME_HEIGHT, FRAME_WIDTH), np.uint8)
+    mask[rng.random(mask.shape) < density] = 255
+    for _ in range(40):
+        x, y = int(rng.integers(0, FRAME_WIDTH)), int(rng.integers(0, FRAME_HEIGHT))
+        cv2.rectangle(mask, (x, y), (x + 60, y + 40), 255, -1)
+    return mask
+
+
+def timeit(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='69,200,500,1000,2000')
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    masks = [random_mask(rng, d) for d in (0.0, 0.01, 0.05, 0.3)]
+
+    print(f"{'ROIs':>6} {'bucle (ms)':>11} {'integral (ms)':>14} {'speedup':>8}  idéntico")
+    for n in (int(c) for c in args.counts.split(',')):
+        espacios = random_layout(n, rng)
+        layout = RoiLayout(espacios)
+        identical = all(layout.occupied(m).tolist() == legacy_occupied(m, espacios) for m in masks)
+        mask = masks[2]
+        t_loop = timeit(lambda: legacy_occupied(mask, espacios), args.repeat)
+        t_int = timeit(lambda: layout.occupied(mask), args.repeat)
+        print(f"{n:>6} {t_loop:>11.3f} {t_int:>14.3f} {t_loop / t_int:>7.1f}x  {'sí' if identical else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark: FPS de análisis con N lectores HTTP concurrentes del estado del procesador.
+
+Un VideoProcessor (modo clásico, cámara sintética sin esperas: analiza tan rápido como
+puede) y N hilos que imitan a los clientes de /api/estado y /snapshot: cada uno pide el
+ETag y el estado (estado_etag + get_estado_espacios), cada --snapshot-every peticiones
+también /snapshot (get_snapshot_bytes), y espera --think ms entre peticiones.
+
+Para cada N informa los frames analizados por segundo, las peticiones atendidas, la
+latencia de lectura (p50 / p99 / máx) y la espera del análisis por self.lock
+(etapa lock_wait). Con el estado publicado como objeto inmutable (ProcessorState) los
+lectores no toman el lock: la espera del análisis no crece con N y los FPS solo bajan
+por la CPU que consumen los propios lectores (con un solo núcleo, el GIL).
+
+--locked repite la medida con los lectores de antes (estado copiado bajo self.lock y
+/snapshot codificado con el lock tomado) como referencia.
+
+Uso (desde la raíz del proyecto):
+  python benchmarks/bench_state_readers.py
+  python benchmarks/bench_state_readers.py --readers 0,8,64 --seconds 5 --locked
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app_camera import FRAME_HEIGHT, FRAME_WIDTH, VideoProcessor  # noqa: E402
+from frame_sources import FrameSource  # noqa: E402
+from synthetic_lot import SyntheticLot  # noqa: E402
+
+
+class LockedReaders(VideoProcessor):
+    """Lectores como antes de ProcessorState: toman self.lock (y codifican /snapshot con él)"""
+
+    def get_estado_espacios(self):
+        self.touch()
+        with self.lock:
+            return list(self.state.estado)
+
+    def get_snapshot_bytes(self, tier=None):
+        self.touch()
+        with self.lock:
+            frame = self.state.frame
+            if frame is None:
+                return None
+            ret, jpeg = cv2.imencode('.jpg', frame)
+        return jpeg.tobytes() if ret else None
+
+
+def reader(vp, args, stop, latencies, counts, idx):
+    n = 0
+    for i in itertools.count():
+        if stop.is_set():
+            break
+        t0 = time.perf_counter()
+        vp.estado_etag()
+        vp.get_estado_espacios()
+        if args.snapshot_every and i % args.snapshot_every == 0:
+            vp.get_snapshot_bytes()
+        latencies.append(time.perf_counter() - t0)
+        n += 1
+        if args.think > 0:
+            time.sleep(args.think / 1000.0)
+    counts[idx] = n
+
+
+def run(cls, readers, args, bank, espacios):
+    source = FrameSource(itertools.cycle(bank), fps=30, pacing='fast')
+    vp = cls(source, espacios, pipeline=False, target_fps=0, detector=args.detector)
+    time.sleep(args.warmup)
+    stop = threading.Event()
+    latencies, counts = [], [0] * readers
+    threads = [threading.Thread(target=reader, args=(vp, args, stop, latencies, counts, i), daemon=True)
+               for i in range(readers)]
+    # Medir desde que todos los lectores están en marcha
+    for t in threads:
+        t.start()
+    before = vp.get_pipeline_stats()['stages']
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    frames0 = before['analysis']['count']
+    time.sleep(args.seconds)
+    stages = vp.get_pipeline_stats()['stages']
+    elapsed, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+    frames = stages['analysis']['count'] - frames0
+    stop.set()
+    for t in threads:
+        t.join(timeout=2.0)
+    vp.stop()
+
+    lat = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    wait = stages.get('lock_wait', {})
+    label = 'lock' if cls is LockedReaders else 'estado'
+    print(f'{label:>7} {readers:>7} {frames / elapsed:>8.1f} {sum(counts) / elapsed:>9.0f} '
+          f'{np.percentile(lat, 50):>8.3f} {np.percentile(lat, 99):>8.3f} {lat.max():>8.2f} '
+          f"{wait.get('avg_ms', 0.0):>9.3f} {wait.get('max_ms', 0.0):>9.2f} {cpu / elapsed * 100:>5.0f}%")
+    return frames / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', default='0,1,4,16,64', help='lectores concurrentes (lista separada por comas)')
+    parser.add_argument('--seconds', type=float, default=4.0)
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--think', type=float, default=20.0, help='ms entre peticiones de cada lector')
+    parser.add_argument('--snapshot-every', type=int, default=10, help='una petición de /snapshot cada N (0 = nunca)')
+    parser.add_argument('--spaces', type=int, default=69)
+    parser.add_argument('--detector', default='adaptive')
+    parser.add_argument('--locked', action='store_true', help='medir también los lectores con lock (referencia)')
+    args = parser.parse_args()
+
+    lot = SyntheticLot(args.spaces, FRAME_WIDTH, FRAME_HEIGHT, seed=0)
+    bank = [frame for frame, _ in lot.frames(16)]
+    print(f'{args.spaces} plazas, detector {args.detector}, lectores con {args.think:g} ms entre peticiones '
+          f'(/snapshot cada {args.snapshot_every}), {args.seconds:g} s por medida')
+    print(f"{'lectura':>7} {'lectores':>7} {'fps':>8} {'peticiones/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'máx ms':>8} "
+          f"{'espera ms':>9} {'esp. máx':>9} {'CPU':>6}")
+    for cls in ([VideoProcessor, LockedReaders] if args.locked else [VideoProcessor]):
+        base = None
+        for readers in (int(n) for n in args.readers.split(',')):
+            fps = run(cls, readers, args, bank, lot.espacios)
+            base = fps if base is None else base
+        if base:
+            print(f'        FPS con el máximo de lectores: {fps / base * 100:.0f}% del primero')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+Suite de rendimiento reproducible: procesamiento de vídeo sobre lotes sintéticos y
+consultas de reservas, con comparación contra una línea base.
+
+Procesamiento: por cada detector y tamaño de layout (69 plazas como espacios.pkl y
+layouts sintéticos de cientos o miles) se genera un lote con benchmarks/synthetic_lot.py
+y se alimenta un VideoProcessor real a través de una FrameSource (frame_sources.py),
+sin cámara:
+  --pacing fast       cada frame se entrega en cuanto se termina el anterior (throughput)
+  --pacing realtime   al fps del lote, como una cámara (con retraso se saltan frames)
+Se mide:
+  - throughput (frames analizados por segundo) y frames saltados
+  - latencia por frame p50/p95/p99/máx: desde que read() entrega un frame hasta que el
+    procesador pide el siguiente (análisis + anotación, sin la espera de la cámara)
+  - pico de memoria (ru_maxrss del proceso; cada combinación corre en un proceso nuevo)
+  - exactitud, precisión y recall del estado publicado frente a la verdad del generador.
+    Tras un cambio real de una plaza hay un margen en que el estado aún no puede
+    coincidir (maniobra del coche + permanencia del tracker); esas plazas no se cuentan
+    hasta pasado el margen (`coverage` = fracción de plaza-muestras evaluadas). Con
+    --pacing fast la permanencia del tracker se pone a 0 (OCCUPANCY_*_DWELL están en
+    segundos de reloj y el vídeo va más rápido que el reloj), salvo con --keep-dwell.
+
+Base de datos: create_reservation y get_active_reservations con N reservas históricas
+(mismo relleno que bench_reservations.py).
+
+Resultados en JSON (--out). Con --baseline se compara contra un JSON anterior y el
+proceso termina con código 1 si alguna métrica empeora más de --tolerance (relativa;
+la exactitud usa --accuracy-tolerance absoluta).
+
+Uso (desde la raíz del proyecto):
+  python benchmarks/bench_suite.py --out base.json
+  python benchmarks/bench_suite.py --baseline base.json --out nuevo.json
+  python benchmarks/bench_suite.py --detectors adaptive --spaces 69,2000 --frames 600 --no-db
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_sources import FrameSource  # noqa: E402
+from synthetic_lot import TRANSIT_SECONDS, SyntheticLot  # noqa: E402
+
+# (métrica, True si más alto es mejor, tolerancia absoluta en vez de relativa)
+COMPARED = {
+    'pipeline': [('throughput_fps', True, False), ('latency_ms.p99', False, False),
+                 ('peak_rss_mb', False, False), ('accuracy', True, True)],
+    'database': [('create_p99_ms', False, False), ('active_p99_ms', False, False)],
+}
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    a = np.array(samples) * 1000.0
+    return {'p50': round(float(np.percentile(a, 50)), 3), 'p95': round(float(np.percentile(a, 95)), 3),
+            'p99': round(float(np.percentile(a, 99)), 3), 'max': round(float(a.max()), 3)}
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+# ----------------- Procesamiento de vídeo -----------------
+class ProbedSource(FrameSource):
+    """FrameSource que mide el tiempo entre lecturas y compara el estado publicado con la verdad"""
+
+    def __init__(self, lot, n, pacing, grace_seconds, grace_frames, warmup):
+        self.processor = None
+        self.grace_seconds = grace_seconds
+        self.grace_frames = grace_frames
+        self.warmup = warmup
+        self.truth = None
+        self._changed_at = np.full(lot.n, -np.inf)       # reloj del último cambio real por plaza
+        self._changed_frame = np.full(lot.n, -10 ** 9)   # y su índice de frame
+        self.latencies = []
+        self.counts = np.zeros(4, dtype=np.int64)        # tp, fp, tn, fn
+        self.evaluated = 0
+        self.samples = 0
+        self.first_read = self.last_read = None
+        self._returned = None
+        super().__init__(self._frames(lot, n), lot.fps, pacing)
+
+    def _frames(self, lot, n):
+        previous = None
+        for frame, truth in lot.frames(n):
+            if previous is not None:
+                changed = truth != previous
+                self._changed_at[changed] = time.perf_counter()
+                self._changed_frame[changed] = self.index + 1
+            previous = self.truth = truth.copy()
+            yield frame
+
+    def read(self, image=None):
+        now = time.perf_counter()
+        if self.index >= self.warmup:
+            if self._returned is not None:
+                self.latencies.append(now - self._returned)
+            self._sample(now)
+        ok, frame = super().read(image)
+        self._returned = time.perf_counter()
+        if ok:
+            if self.first_read is None and self.index >= self.warmup:
+                self.first_read = (self.index, self._returned)
+            self.last_read = (self.index, self._returned)
+        return ok, frame
+
+    def _sample(self, now):
+        """Estado publicado tras analizar el último frame entregado frente a su verdad"""
+        if self.processor is None or self.truth is None:
+            return
+        estado = np.array(self.processor.estado_espacios, dtype=bool)
+        if len(estado) != len(self.truth):
+            return
+        settled = ((now - self._changed_at) >= self.grace_seconds) & \
+                  ((self.index - self._changed_frame) >= self.grace_frames)
+        truth, pred = self.truth[settled], estado[settled]
+        self.counts += [np.sum(pred & truth), np.sum(pred & ~truth), np.sum(~pred & ~truth), np.sum(~pred & truth)]
+        self.evaluated += int(settled.sum())
+        self.samples += len(settled)
+
+
+def run_pipeline(cfg, results):
+    """Proceso hijo: una combinación detector x layout (las variables de entorno antes de importar)"""
+    os.environ.update(cfg['env'])
+    from app_camera import VideoProcessor
+    from occupancy import OCCUPANCY_ENTER_DWELL, OCCUPANCY_EXIT_DWELL
+
+    lot = SyntheticLot(cfg['spaces'], cfg['width'], cfg['height'], cfg['fps'], cfg['seed'])
+    grace_seconds = max(OCCUPANCY_ENTER_DWELL, OCCUPANCY_EXIT_DWELL) + cfg['slack']
+    grace_frames = int(TRANSIT_SECONDS * cfg['fps']) + 2
+    source = ProbedSource(lot, cfg['frames'] + cfg['warmup'], cfg['pacing'], grace_seconds, grace_frames,
+                          cfg['warmup'])
+    options = {'reference': lot.empty_frame()} if cfg['detector'] == 'reference' else None
+    vp = VideoProcessor(source, lot.espacios, target_fps=0, detector=cfg['detector'], detector_options=options)
+    source.processor = vp
+    if cfg['key']['annotate']:
+        # Un cliente de /video_feed: la anotación y el JPEG solo se hacen si alguien mira
+        threading.Thread(target=lambda: all(True for _ in vp.broadcaster.stream()), daemon=True).start()
+    deadline = time.monotonic() + cfg['timeout']
+    while not source.exhausted and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stats = vp.get_pipeline_stats()
+    vp.stop()
+
+    tp, fp, tn, fn = (int(v) for v in source.counts)
+    (i0, t0), (i1, t1) = source.first_read or (0, 0), source.last_read or (0, 0)
+    delivered = i1 - i0
+    result = dict(cfg['key'], kind='pipeline', frames=delivered, skipped=source.skipped,
+                  completed=source.exhausted,
+                  throughput_fps=round(delivered / (t1 - t0), 2) if t1 > t0 else 0.0,
+                  latency_ms=percentiles(source.latencies), peak_rss_mb=round(peak_rss_mb(), 1),
+                  accuracy=round((tp + tn) / max(1, tp + fp + tn + fn), 4),
+                  precision=round(tp / max(1, tp + fp), 4), recall=round(tp / max(1, tp + fn), 4),
+                  coverage=round(source.evaluated / max(1, source.samples), 4),
+                  stages_avg_ms={name: s['avg_ms'] for name, s in stats['stages'].items()})
+    results.put(result)
+
+
+# ----------------- Base de datos -----------------
+def run_database(cfg, results):
+    """Proceso hijo: reservas con `rows` filas históricas en una base temporal"""
+    tmp = tempfile.mkdtemp(prefix='bench-db-')
+    os.environ['DB_PATH'] = os.path.join(tmp, 'parking.db')  # database.py abre su base al importarse
+    try:
+        from bench_reservations import populate, timeit
+        from database import Database
+
+        db = Database(os.path.join(tmp, 'bench.db'))
+        rng = random.Random(cfg['seed'])
+        populate(db, cfg['rows'], cfg['spaces'], rng)
+        db.conn.execute('ANALYZE')
+        busy = lambda: db.create_reservation(1, rng.randrange(1, cfg['spaces'] + 1, 4), 1)
+        c50, c99 = timeit(busy, cfg['repeat'])
+        a50, a99 = timeit(db.get_active_reservations, cfg['repeat'])
+        db.close()
+        results.put(dict(cfg['key'], kind='database', create_p50_ms=round(c50, 3), create_p99_ms=round(c99, 3),
+                         active_p50_ms=round(a50, 3), active_p99_ms=round(a99, 3)))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def spawn(target, cfg, timeout):
+    """Ejecutar `target(cfg)` en un proceso nuevo (memoria y entorno aislados)"""
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=target, args=(cfg, results), daemon=True)
+    proc.start()
+    try:
+        result = results.get(timeout=timeout)
+    except queue.Empty:
+        result = dict(cfg['key'], error=f'sin resultado (código de salida {proc.exitcode})')
+    proc.join(5)
+    if proc.is_alive():
+        proc.kill()
+    return result
+
+
+def entry_id(r):
+    if r['kind'] == 'database':
+        return f"database/rows={r['rows']}"
+    return f"pipeline/{r['detector']}/spaces={r['spaces']}/{r['pacing']}/{'annotate' if r['annotate'] else 'no-annotate'}"
+
+
+# ----------------- Comparación -----------------
+def lookup(d, dotted):
+    for part in dotted.split('.'):
+        if not isinstance(d, dict) or part not in d:
+            return None
+        d = d[part]
+    return d
+
+
+def compare(results, baseline, tolerance, accuracy_tolerance):
+    """Líneas de comparación y número de regresiones"""
+    base = {entry_id(r): r for r in baseline.get('results', []) if 'error' not in r}
+    lines, regressions = [], 0
+    for r in results:
+        old = base.get(entry_id(r))
+        if old is None or 'error' in r:
+            continue
+        for metric, higher_better, absolute in COMPARED[r['kind']]:
+            new_v, old_v = lookup(r, metric), lookup(old, metric)
+            if new_v is None or old_v is None:
+                continue
+            delta = new_v - old_v
+            worse = -delta if higher_better else delta
+            if absolute:
+                regressed = worse > accuracy_tolerance
+                change = f'{delta:+.4f}'
+            else:
+                regressed = old_v > 0 and worse / old_v > tolerance
+                change = f'{delta / old_v * 100:+.1f}%' if old_v else 'n/a'
+            regressions += regressed
+            lines.append(f"{entry_id(r):<58} {metric:<16} {old_v:>10g} -> {new_v:<10g} {change:>8}"
+                         f"{'  REGRESIÓN' if regressed else ''}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--detectors', default='mog2,adaptive,reference')
+    parser.add_argument('--spaces', default='69,500,2000', help='tamaños de layout (plazas)')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=float, default=15.0, help='fps del lote sintético')
+    parser.add_argument('--frames', type=int, default=300, help='frames medidos por combinación')
+    parser.add_argument('--warmup', type=int, default=30, help='frames iniciales sin medir')
+    parser.add_argument('--pacing', choices=('fast', 'realtime'), default='fast')
+    parser.add_argument('--no-annotate', action='store_true', help='sin anotación ni JPEG (solo análisis)')
+    parser.add_argument('--keep-dwell', action='store_true', help='mantener OCCUPANCY_*_DWELL con --pacing fast')
+    parser.add_argument('--slack', type=float, default=0.5, help='segundos extra de margen tras un cambio real')
+    parser.add_argument('--timeout', type=float, default=600.0, help='segundos máximos por combinación')
+    parser.add_argument('--db-rows', default='10000,100000', help="filas históricas ('' = sin base de datos)")
+    parser.add_argument('--db-spaces', type=int, default=69)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--no-db', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='guardar los resultados en este JSON')
+    parser.add_argument('--baseline', help='JSON de una ejecución anterior con el que comparar')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='empeoramiento relativo tolerado')
+    parser.add_argument('--accuracy-tolerance', type=float, default=0.02, help='pérdida de exactitud tolerada')
+    args = parser.parse_args()
+
+    env = {'FRAME_WIDTH': str(args.width), 'FRAME_HEIGHT': str(args.height), 'IDLE_SHUTDOWN_SECONDS': '0'}
+    # Planificador siempre en 'full' (sin límite de fps con target_fps=0)
+    env['IDLE_AFTER_SECONDS'] = '1e9'
+    if args.pacing == 'fast' and not args.keep_dwell:
+        env.update({'OCCUPANCY_ENTER_DWELL': '0', 'OCCUPANCY_EXIT_DWELL': '0'})
+
+    results = []
+    print(f"{'combinación':<58} {'fps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>7} "
+          f"{'exact.':>6} {'prec.':>6} {'recall':>6} {'cobert.':>7}")
+    for spaces in (int(s) for s in args.spaces.split(',')):
+        for detector in args.detectors.split(','):
+            key = {'detector': detector, 'spaces': spaces, 'pacing': args.pacing, 'annotate': not args.no_annotate}
+            cfg = dict(key=key, env=env, detector=detector, spaces=spaces, width=args.width, height=args.height,
+                       fps=args.fps, frames=args.frames, warmup=args.warmup, pacing=args.pacing,
+                       slack=args.slack, seed=args.seed, timeout=args.timeout)
+            r = spawn(run_pipeline, cfg, args.timeout + 60)
+            r.setdefault('kind', 'pipeline')
+            results.append(r)
+            if 'error' in r:
+                print(f"{entry_id(r):<58} ERROR: {r['error']}")
+                continue
+            lat = r['latency_ms']
+            print(f"{entry_id(r):<58} {r['throughput_fps']:>8.1f} {lat.get('p50', 0):>8.2f} {lat.get('p95', 0):>8.2f} "
+                  f"{lat.get('p99', 0):>8.2f} {r['peak_rss_mb']:>7.0f} {r['accuracy']:>6.3f} {r['precision']:>6.3f} "
+                  f"{r['recall']:>6.3f} {r['coverage']:>7.2f}")
+
+    if not args.no_db and args.db_rows:
+        print(f"\n{'combinación':<58} {'reservar p50/p99 (ms)':>22} {'activas p50/p99 (ms)':>22}")
+        for rows in (int(r) for r in args.db_rows.split(',')):
+            key = {'rows': rows, 'spaces': args.db_spaces}
+            cfg = dict(key=key, rows=rows, spaces=args.db_spaces, repeat=args.repeat, seed=args.seed)
+            r = spawn(run_database, cfg, args.timeout)
+            r.setdefault('kind', 'database')
+            results.append(r)
+            if 'error' in r:
+                print(f"{entry_id(r):<58} ERROR: {r['error']}")
+                continue
+            print(f"{entry_id(r):<58} {r['create_p50_ms']:>10.3f} / {r['create_p99_ms']:<9.3f} "
+                  f"{r['active_p50_ms']:>10.3f} / {r['active_p99_ms']:<9.3f}")
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'host': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'args': vars(args),
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f'\nResultados en {args.out}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.tolerance, args.accuracy_tolerance)
+        print(f'\nComparación con {args.baseline} (tolerancia {args.tolerance:.0%}, '
+              f'exactitud {args.accuracy_tolerance:g}):')
+        print('\n'.join(lines) if lines else '  (ninguna combinación en común)')
+        if regressions:
+            print(f'{regressions} regresiones')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Prueba de carga: latencia de /api/estado con N streams abiertos.
+
+Abre N conexiones de streaming (/video_feed o /api/stream/estado) que se quedan
+leyendo y descartando lo que llega, y con ellas abiertas lanza --requests peticiones a
+/api/estado desde --concurrency clientes (conexiones keep-alive cuando el servidor lo
+permite). Por cada N informa de las conexiones que llegaron a abrirse, p50/p99/máximo
+de /api/estado, errores, y con --pid la memoria y los hilos del proceso servidor.
+
+Solo biblioteca estándar (asyncio). Uso, con el servidor ya arrancado:
+  SERVER_MODE=async python app.py          # o: python app.py (modo threaded)
+  python benchmarks/load_estado.py --streams 0,100,1000 --pid $(pgrep -f "python app.py")
+  python benchmarks/load_estado.py --stream-path /api/stream/estado --streams 5000
+"""
+import argparse
+import asyncio
+import resource
+import time
+from urllib.parse import urlsplit
+
+
+class Stream:
+    """Conexión de streaming que lee y descarta hasta que se cierra"""
+
+    def __init__(self):
+        self.open = False
+        self.failed = False
+        self.bytes = 0
+        self.writer = None
+
+    async def run(self, host, port, path):
+        try:
+            reader, self.writer = await asyncio.open_connection(host, port)
+            self.writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+            status = await reader.readline()
+            if b' 200 ' not in status:
+                raise ConnectionError(status.decode(errors='replace').strip())
+            self.open = True
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                self.bytes += len(chunk)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError):
+            self.failed = True
+        finally:
+            self.open = False
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def get(conn, host, port, path):
+    """GET sobre `conn` ([reader, writer] o [None, None]); reabre la conexión si el servidor la cerró"""
+    for attempt in range(2):
+        if conn[0] is None:
+            conn[0], conn[1] = await asyncio.open_connection(host, port)
+        reader, writer = conn
+        try:
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+            status = await reader.readline()
+            if not status:
+                raise ConnectionResetError
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length:
+                await reader.readexactly(length)
+            if status.startswith(b'HTTP/1.0') or headers.get('connection', '').lower() == 'close':
+                writer.close()
+                conn[0] = conn[1] = None
+            return int(status.split()[1])
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            conn[0] = conn[1] = None
+            if attempt:
+                raise
+
+
+def server_usage(pid):
+    """(RSS en MB, hilos) del proceso servidor según /proc"""
+    if pid is None:
+        return None, None
+    values = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            values[key] = value.split()
+    return int(values['VmRSS'][0]) / 1024.0, int(values['Threads'][0])
+
+
+async def run_level(args, host, port, n_streams):
+    streams = [Stream() for _ in range(n_streams)]
+    tasks = []
+    for i, stream in enumerate(streams):
+        tasks.append(asyncio.ensure_future(stream.run(host, port, args.stream_path)))
+        if i % 100 == 99:
+            await asyncio.sleep(0.05)   # no saturar el backlog del servidor
+    deadline = time.monotonic() + args.settle
+    while time.monotonic() < deadline and sum(s.open or s.failed for s in streams) < n_streams:
+        await asyncio.sleep(0.1)
+    opened = sum(s.open for s in streams)
+
+    latencies, errors = [], 0
+    remaining = [args.requests]
+
+    async def client():
+        nonlocal errors
+        conn = [None, None]
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            t0 = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(get(conn, host, port, args.estado_path), args.timeout)
+                if status not in (200, 304):
+                    errors += 1
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                errors += 1
+                conn = [None, None]
+                continue
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+        if conn[1] is not None:
+            conn[1].close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - t0
+    rss, threads = server_usage(args.pid)
+    still_open = sum(s.open for s in streams)
+
+    for stream in streams:
+        stream.close()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else float('nan')
+    return {
+        'streams': n_streams, 'opened': opened, 'still_open': still_open,
+        'p50': pct(0.50), 'p99': pct(0.99), 'max': latencies[-1] if latencies else float('nan'),
+        'rps': len(latencies) / elapsed if elapsed else 0.0, 'errors': errors, 'rss': rss, 'threads': threads,
+    }
+
+
+async def main_async(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    print(f"{'streams':>8} {'abiertos':>8} {'p50 ms':>8} {'p99 ms':>8} {'máx ms':>8} {'req/s':>8} "
+          f"{'errores':>7} {'RSS MB':>7} {'hilos':>6}")
+    for n in (int(v) for v in args.streams.split(',')):
+        r = await run_level(args, host, port, n)
+        rss = f"{r['rss']:.0f}" if r['rss'] is not None else '-'
+        threads = r['threads'] if r['threads'] is not None else '-'
+        print(f"{r['streams']:>8} {r['opened']:>8} {r['p50']:>8.2f} {r['p99']:>8.2f} {r['max']:>8.2f} "
+              f"{r['rps']:>8.0f} {r['errors']:>7} {rss:>7} {threads:>6}")
+        await asyncio.sleep(args.pause)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--streams', default='0,100,1000', help='niveles de streams abiertos (separados por comas)')
+    parser.add_argument('--stream-path', default='/video_feed')
+    parser.add_argument('--estado-path', default='/api/estado')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--settle', type=float, default=10.0, help='segundos máximos para abrir los streams')
+    parser.add_argument('--pause', type=float, default=2.0, help='pausa entre niveles (cierre de conexiones)')
+    parser.add_argument('--pid', type=int, help='pid del servidor para medir RSS e hilos')
+    args = parser.parse_args()
+
+    # Cada stream es un descriptor de archivo: subir el límite blando hasta el duro
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
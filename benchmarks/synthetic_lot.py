@@ -0,0 +1,183 @@
+"""
+Generador de estacionamientos sintéticos: layout de ROI, frames y verdad de terreno.
+
+SyntheticLot dibuja un lote visto desde arriba a la resolución pedida: asfalto con
+textura, filas de plazas separadas por calles y líneas blancas, y N plazas (69 como el
+espacios.pkl del proyecto, hasta miles). Cada plaza alterna libre/ocupada con duraciones
+exponenciales (media --stay / --gap segundos); un coche entra deslizándose desde la calle
+durante unos frames y sale igual. Encima se añade una deriva lenta de iluminación y ruido
+de sensor. Todo depende solo de `seed`, así que dos ejecuciones generan los mismos frames.
+
+frames(n) produce (frame BGR, ocupación real por plaza) sin guardar nada en memoria; la
+ocupación real cambia cuando el coche empieza a entrar o termina de salir.
+
+Uso como script (genera un vídeo y su verdad de terreno para reanalisis.py, etc.):
+  python benchmarks/synthetic_lot.py --spaces 69 --seconds 60 --out lote69.mp4
+  -> lote69.mp4, lote69.npz (layout de ROI para layout_store) y lote69.truth.npy
+"""
+import argparse
+import math
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from layout_store import LayoutStore  # noqa: E402
+
+ASPHALT = 92          # gris medio del asfalto
+NOISE_BANK = 8        # frames de ruido precalculados que se van alternando
+TRANSIT_SECONDS = 0.6  # duración de la maniobra de entrada / salida
+
+
+class SyntheticLot:
+    def __init__(self, spaces=69, width=1280, height=720, fps=15.0, seed=0, stay=12.0, gap=8.0,
+                 noise=3.0, light=12.0):
+        self.n = int(spaces)
+        self.width, self.height = int(width), int(height)
+        self.fps = float(fps)
+        self.stay, self.gap = stay, gap
+        self.light = light
+        self.rng = np.random.default_rng(seed)
+        self.espacios = self._layout()
+        self.background = self._background()
+        self._noise = [self.rng.normal(0, noise, (self.height, self.width, 1)).astype(np.int16)
+                       for _ in range(NOISE_BANK)] if noise > 0 else None
+        self._cars = [self._car(w, h) for _, _, w, h in self.espacios]
+
+    # ----------------- Escena -----------------
+    def _layout(self):
+        """Filas dobles de plazas (morro contra morro) separadas por calles"""
+        n, W, H = self.n, self.width, self.height
+        margin = 8
+        # Tamaño de plaza con proporción ~1:2.2 (como las de espacios.pkl) que llene el frame
+        aisle_ratio = 0.6  # ancho de la calle respecto al fondo de una plaza
+        for depth in range(H, 4, -1):
+            w = max(4, int(depth / 2.2))
+            per_row = (W - 2 * margin) // w
+            band = 2 * depth + int(depth * aisle_ratio)
+            pairs = (H - 2 * margin) // band
+            if per_row * pairs * 2 >= n:
+                break
+        rows = math.ceil(n / per_row)
+        espacios, self._from_below = [], []
+        for r in range(rows):
+            pair, side = divmod(r, 2)
+            y = margin + pair * band + side * depth
+            for c in range(per_row):
+                if len(espacios) == n:
+                    break
+                espacios.append((margin + c * w + 1, y + 1, w - 2, depth - 2))
+                # la fila de arriba de cada pareja da a la calle superior, la de abajo a la inferior
+                self._from_below.append(bool(side))
+        return espacios
+
+    def _background(self):
+        """Asfalto con textura suave y líneas de las plazas"""
+        tex = self.rng.normal(0, 6, (self.height // 4 + 1, self.width // 4 + 1)).astype(np.float32)
+        tex = cv2.resize(cv2.GaussianBlur(tex, (0, 0), 1.5), (self.width, self.height))
+        gray = np.clip(ASPHALT + tex, 0, 255).astype(np.uint8)
+        bg = cv2.merge([gray, gray, gray])
+        for x, y, w, h in self.espacios:
+            cv2.rectangle(bg, (x - 1, y - 1), (x + w, y + h), (225, 225, 225), 1)
+        return bg
+
+    def _car(self, w, h):
+        """Parche BGR de un coche visto desde arriba para una plaza de w x h"""
+        cw, ch = max(2, int(w * 0.8)), max(2, int(h * 0.86))
+        color = self.rng.integers(20, 235, 3).tolist()
+        car = np.full((ch, cw, 3), color, np.uint8)
+        # parabrisas y luna trasera más oscuros, techo algo más claro
+        dark = [int(c * 0.35) for c in color]
+        cv2.rectangle(car, (cw // 8, ch // 5), (cw - cw // 8 - 1, ch // 5 + max(1, ch // 7)), dark, -1)
+        cv2.rectangle(car, (cw // 8, ch - ch // 5 - max(1, ch // 9)), (cw - cw // 8 - 1, ch - ch // 5), dark, -1)
+        light = [min(255, int(c * 1.2) + 10) for c in color]
+        cv2.rectangle(car, (cw // 5, ch // 5 + ch // 7 + 2), (cw - cw // 5 - 1, ch - ch // 5 - ch // 9 - 2), light, -1)
+        return car
+
+    # ----------------- Secuencia -----------------
+    def _duration(self, mean):
+        return max(1, int(self.rng.exponential(mean) * self.fps))
+
+    def frames(self, n):
+        """Generador de (frame, ocupación real bool[N]) para n frames"""
+        transit = max(1, int(TRANSIT_SECONDS * self.fps))
+        occupied = self.rng.random(self.n) < self.stay / (self.stay + self.gap)
+        # frames hasta el próximo cambio de cada plaza
+        remaining = np.array([self._duration(self.stay if o else self.gap) for o in occupied])
+        # progreso de la maniobra: 0 = fuera, transit = aparcado
+        progress = np.where(occupied, transit, 0)
+        canvas = self.background.copy()
+        dirty = set(np.flatnonzero(occupied).tolist())
+        for i in range(n):
+            remaining -= 1
+            for k in np.flatnonzero(remaining <= 0).tolist():
+                occupied[k] = not occupied[k]
+                remaining[k] = self._duration(self.stay if occupied[k] else self.gap)
+            moving = np.flatnonzero(np.where(occupied, progress < transit, progress > 0)).tolist()
+            for k in moving:
+                progress[k] += 1 if occupied[k] else -1
+            dirty.update(moving)
+            for k in dirty:
+                self._draw(canvas, k, progress[k] / transit)
+            dirty = set(moving)
+
+            frame = canvas
+            if self.light:
+                shift = self.light * math.sin(2 * math.pi * i / (self.fps * 60))
+                frame = cv2.add(frame, (shift,) * 3) if shift >= 0 else cv2.subtract(frame, (-shift,) * 3)
+            if self._noise is not None:
+                frame = np.clip(frame + self._noise[i % NOISE_BANK], 0, 255).astype(np.uint8)
+            elif frame is canvas:
+                frame = canvas.copy()
+            # verdad: ocupado mientras el coche esté (aunque sea en parte) dentro de la plaza
+            yield frame, (progress > 0)
+
+    def _draw(self, canvas, k, fraction):
+        x, y, w, h = self.espacios[k]
+        canvas[y:y + h, x:x + w] = self.background[y:y + h, x:x + w]
+        if fraction <= 0:
+            return
+        car = self._cars[k]
+        ch, cw = car.shape[:2]
+        from_below = self._from_below[k]
+        offset = int(round((1 - fraction) * ch))
+        cx = x + (w - cw) // 2
+        cy = y + (h - ch) // 2 + (offset if from_below else -offset)
+        y1, y2 = max(y, cy), min(y + h, cy + ch)
+        if y1 < y2:
+            canvas[y1:y2, cx:cx + cw] = car[y1 - cy:y2 - cy]
+
+    def empty_frame(self):
+        """Lote vacío (referencia para el detector 'reference')"""
+        return self.background.copy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--spaces', type=int, default=69)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=float, default=15.0)
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='lote_sintetico.mp4')
+    args = parser.parse_args()
+
+    lot = SyntheticLot(args.spaces, args.width, args.height, args.fps, args.seed)
+    base = os.path.splitext(args.out)[0]
+    writer = cv2.VideoWriter(args.out, cv2.VideoWriter_fourcc(*'mp4v'), args.fps, (args.width, args.height))
+    truth = []
+    for frame, occupied in lot.frames(int(args.seconds * args.fps)):
+        writer.write(frame)
+        truth.append(occupied.copy())
+    writer.release()
+    LayoutStore(base + '.npz').save(lot.espacios)
+    np.save(base + '.truth.npy', np.packbits(np.array(truth, bool), axis=1))
+    cv2.imwrite(base + '.vacio.png', lot.empty_frame())
+    print(f'{args.out}: {len(truth)} frames, {lot.n} plazas; {base}.npz, {base}.truth.npy, {base}.vacio.png')
+
+
+if __name__ == '__main__':
+    main()
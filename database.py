@@ -1,67 +1,248 @@
+"""
+Acceso a SQLite (usuarios y reservas) seguro entre hilos.
+
+Cada hilo (petición de Flask, feed SSE, hilo de fondo) usa su propia conexión, creada la
+primera vez que la pide (`db.conn`). La base está en modo WAL: los lectores (p. ej. el
+sondeo de /api/reservas_activas) leen la última versión confirmada sin esperar a que
+termine una escritura, y solo las escrituras se serializan entre sí. Las escrituras van
+en transacciones BEGIN IMMEDIATE y, si la base sigue ocupada tras DB_BUSY_TIMEOUT, se
+reintentan hasta DB_BUSY_RETRIES veces con espera exponencial. Cada consulta se mide por
+nombre (db.get_query_stats()).
+
+Las reservas son intervalos [start_time, end_time) que pueden empezar en el futuro. Dos
+reservas activas del mismo espacio no pueden solaparse (start < otro.end y end > otro.start);
+la comprobación y la inserción van en la misma transacción. Los índices mantienen la
+latencia plana aunque la tabla acumule millones de reservas históricas:
+  - idx_reservations_space_end (space_number, status, end_time, start_time): solapes de
+    un espacio concreto (create_reservation). El predicado exacto end_time > start es un
+    rango del índice que deja fuera todo el histórico del espacio (ya terminado), sin
+    suponer nada sobre la duración de las reservas existentes
+  - idx_reservations_active_end (end_time, start_time, space_number) WHERE status='active':
+    reservas vigentes o futuras de todo el lote; las terminadas quedan fuera del rango
+
+Los espacios reservados *ahora* se sirven desde un índice en memoria
+(reservation_index.ActiveReservationIndex) que se carga al arrancar y se actualiza en
+create_reservation / cancel_reservation: get_active_reservations no ejecuta SQL.
+ExpiryScheduler pasa a 'expired' las reservas terminadas en cuanto vencen, así el índice
+parcial de reservas activas solo contiene las vigentes o futuras.
+
+Nota: con ':memory:' cada hilo vería una base distinta; usar siempre un archivo.
+"""
+
+import os
+import random
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from metrics import Histogram
+from reservation_index import ActiveReservationIndex
+
+DB_PATH = os.environ.get('DB_PATH', 'parking.db')
+DB_BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', 2.0))        # segundos que SQLite espera un lock
+DB_BUSY_RETRIES = int(os.environ.get('DB_BUSY_RETRIES', 5))            # reintentos tras agotar el timeout
+DB_RETRY_DELAY = float(os.environ.get('DB_RETRY_DELAY', 0.02))         # espera inicial entre reintentos (se duplica)
+DB_RETRY_MAX_DELAY = float(os.environ.get('DB_RETRY_MAX_DELAY', 0.5))
+DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'NORMAL')           # NORMAL es seguro en WAL (solo fsync en checkpoint)
+DB_CACHE_KB = int(os.environ.get('DB_CACHE_KB', 8192))                 # caché de páginas por conexión
+RESERVATION_MAX_HOURS = float(os.environ.get('RESERVATION_MAX_HOURS', 24))  # duración máxima de una reserva
+EXPIRY_BATCH = int(os.environ.get('EXPIRY_BATCH', 500))               # reservas expiradas por transacción
+EXPIRY_MAX_SLEEP = float(os.environ.get('EXPIRY_MAX_SLEEP', 30.0))    # segundos máximos entre comprobaciones
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class QueryStats:
+    """Tiempos por consulta (por nombre): número, media, máximo, reintentos, errores e histograma"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._histograms = {}
+
+    def record(self, name, seconds, retries=0, error=False):
+        ms = seconds * 1000.0
+        with self._lock:
+            s = self._stats.get(name)
+            if s is None:
+                s = self._stats[name] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'retries': 0, 'errors': 0}
+                self._histograms[name] = Histogram()
+            self._histograms[name].observe(seconds)
+            s['count'] += 1
+            s['total_ms'] += ms
+            s['max_ms'] = max(s['max_ms'], ms)
+            s['retries'] += retries
+            s['errors'] += int(error)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                name: {'count': s['count'], 'avg_ms': round(s['total_ms'] / s['count'], 3) if s['count'] else 0.0,
+                       'max_ms': round(s['max_ms'], 3), 'retries': s['retries'], 'errors': s['errors']}
+                for name, s in self._stats.items()
+            }
+
+    def histograms(self):
+        """Histogramas de latencia por consulta (para /metrics)"""
+        with self._lock:
+            return {name: h.snapshot() for name, h in self._histograms.items()}
+
+
 class Database:
-    def __init__(self, db_path='parking.db'):
+    def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._listeners = []
+        self.query_stats = QueryStats()
+        self.active_index = ActiveReservationIndex()
+        # WAL es persistente en el archivo: basta con activarlo una vez
+        self.conn.execute('PRAGMA journal_mode=WAL')
         self.create_tables()
+        self.reload_active_index()
+
+    # ----------------- Conexiones -----------------
+    @property
+    def conn(self):
+        """Conexión del hilo actual (se crea y configura la primera vez)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT, isolation_level=None)
+            conn.execute(f'PRAGMA synchronous={DB_SYNCHRONOUS}')
+            conn.execute(f'PRAGMA cache_size={-DB_CACHE_KB}')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Cerrar todas las conexiones abiertas (cada hilo abrirá una nueva si vuelve a usar la base)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass  # conexión de otro hilo: SQLite la cierra al terminar ese hilo
+        self._local = threading.local()
+
+    def _run(self, name, work):
+        """Ejecutar work(conn) midiendo el tiempo y reintentando si la base está ocupada"""
+        delay = DB_RETRY_DELAY
+        t0 = time.perf_counter()
+        for attempt in range(DB_BUSY_RETRIES + 1):
+            try:
+                result = work(self.conn)
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == DB_BUSY_RETRIES:
+                    self.query_stats.record(name, time.perf_counter() - t0, attempt, error=True)
+                    raise
+                time.sleep(delay * (1 + random.random()))
+                delay = min(delay * 2, DB_RETRY_MAX_DELAY)
+                continue
+            self.query_stats.record(name, time.perf_counter() - t0, attempt)
+            return result
+
+    def _read(self, name, sql, params=()):
+        """Consulta de solo lectura (autocommit: en WAL nunca espera a un escritor)"""
+        return self._run(name, lambda conn: conn.execute(sql, params).fetchall())
+
+    def _write(self, name, work):
+        """Ejecutar work(cursor) dentro de una transacción BEGIN IMMEDIATE"""
+        def transaction(conn):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(conn.cursor())
+                conn.execute('COMMIT')
+                return result
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return self._run(name, transaction)
+
+    def get_query_stats(self):
+        return self.query_stats.as_dict()
+
+    # ----------------- Listeners -----------------
+    def add_listener(self, callback):
+        """Registrar callback(evento) que se llama tras cada cambio en las reservas"""
+        self._listeners.append(callback)
+
+    def _notify(self, event):
+        for callback in list(self._listeners):
+            try:
+                callback(event)
+            except Exception:
+                pass
     
     def create_tables(self):
         """Crear tablas de usuarios y reservas si no existen"""
-        cursor = self.conn.cursor()
-        
-        # Tabla de usuarios
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabla de reservas
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS reservations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                space_number INTEGER NOT NULL,
-                start_time TIMESTAMP NOT NULL,
-                end_time TIMESTAMP NOT NULL,
-                status TEXT DEFAULT 'active',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        self.conn.commit()
+        def create(cursor):
+            # Tabla de usuarios
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Tabla de reservas
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS reservations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    space_number INTEGER NOT NULL,
+                    start_time TIMESTAMP NOT NULL,
+                    end_time TIMESTAMP NOT NULL,
+                    status TEXT DEFAULT 'active',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+
+            # Índices para la detección de solapes y las consultas de reservas vigentes
+            # (idx_reservations_space_window, ordenado por start_time, lo reemplaza space_end)
+            cursor.execute('DROP INDEX IF EXISTS idx_reservations_space_window')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_reservations_space_end
+                ON reservations (space_number, status, end_time, start_time)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_reservations_active_end
+                ON reservations (end_time, start_time, space_number) WHERE status = 'active'
+            ''')
+        self._write('create_tables', create)
     
     # ==================== USUARIOS ====================
     
     def create_user(self, username, password):
         """Crear nuevo usuario en la base de datos"""
+        hashed_pw = generate_password_hash(password)
         try:
-            cursor = self.conn.cursor()
-            hashed_pw = generate_password_hash(password)
-            cursor.execute(
+            self._write('create_user', lambda cursor: cursor.execute(
                 'INSERT INTO users (username, password) VALUES (?, ?)', 
                 (username, hashed_pw)
-            )
-            self.conn.commit()
+            ))
             return True
         except sqlite3.IntegrityError:
             return False
     
     def authenticate_user(self, username, password):
         """Verificar credenciales de usuario"""
-        cursor = self.conn.cursor()
-        cursor.execute(
+        rows = self._read('authenticate_user',
             'SELECT id, password FROM users WHERE username = ?', 
             (username,)
         )
-        user = cursor.fetchone()
+        user = rows[0] if rows else None
         
         if user and check_password_hash(user[1], password):
             return user[0]  # user_id
@@ -69,54 +250,97 @@ class Database:
     
     def get_user_by_id(self, user_id):
         """Obtener información de usuario por ID"""
-        cursor = self.conn.cursor()
-        cursor.execute(
+        rows = self._read('get_user_by_id',
             'SELECT id, username FROM users WHERE id = ?', 
             (user_id,)
         )
-        user = cursor.fetchone()
-        return {'id': user[0], 'username': user[1]} if user else None
+        return {'id': rows[0][0], 'username': rows[0][1]} if rows else None
     
     # ==================== RESERVAS ====================
     
-    def create_reservation(self, user_id, space_number, duration_hours=1):
-        """Crear nueva reserva de espacio"""
-        cursor = self.conn.cursor()
-        start_time = datetime.now()
+    def create_reservation(self, user_id, space_number, duration_hours=1, start_time=None):
+        """Crear nueva reserva de espacio desde start_time (por defecto ahora) durante duration_hours.
+
+        Devuelve False si el espacio tiene otra reserva activa que se solapa con el intervalo.
+        """
+        if not 0 < duration_hours <= RESERVATION_MAX_HOURS:
+            raise ValueError(f'la duración debe estar entre 0 y {RESERVATION_MAX_HOURS:g} horas')
+        if isinstance(space_number, bool) or not isinstance(space_number, int) or space_number < 1:
+            raise ValueError(f'número de espacio inválido: {space_number!r}')
+        start_time = start_time or datetime.now()
         end_time = start_time + timedelta(hours=duration_hours)
-        
-        # Verificar si el espacio ya está reservado
-        cursor.execute('''
-            SELECT id FROM reservations 
-            WHERE space_number = ? AND status = 'active' AND end_time > ?
-        ''', (space_number, start_time))
-        
-        if cursor.fetchone():
-            return False  # Espacio ya reservado
-        
-        # Crear la reserva
-        cursor.execute('''
-            INSERT INTO reservations (user_id, space_number, start_time, end_time)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, space_number, start_time, end_time))
-        
-        self.conn.commit()
+
+        # Comprobación + inserción en la misma transacción (BEGIN IMMEDIATE): dos peticiones
+        # simultáneas no pueden reservar el mismo espacio en intervalos que se solapan
+        def reserve(cursor):
+            # ¿Alguna reserva activa del espacio se solapa con [start_time, end_time)?
+            cursor.execute('''
+                SELECT 1 FROM reservations INDEXED BY idx_reservations_space_end
+                WHERE space_number = ? AND status = 'active'
+                  AND end_time > ? AND start_time < ?
+                LIMIT 1
+            ''', (space_number, start_time, end_time))
+            
+            if cursor.fetchone():
+                return False  # Espacio ya reservado
+            
+            # Crear la reserva
+            cursor.execute('''
+                INSERT INTO reservations (user_id, space_number, start_time, end_time)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, space_number, start_time, end_time))
+            return cursor.lastrowid
+
+        reservation_id = self._write('create_reservation', reserve)
+        if not reservation_id:
+            return False
+        self.active_index.add(reservation_id, space_number, start_time, end_time)
+        self._notify('created')
         return True
     
     def get_active_reservations(self):
-        """Obtener lista de espacios actualmente reservados"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT space_number FROM reservations 
+        """Obtener lista de espacios actualmente reservados (desde el índice en memoria)"""
+        return list(self.active_index.snapshot()[1])
+
+    def get_active_snapshot(self):
+        """(versión, tupla de espacios reservados ahora); la versión cambia con cada cambio"""
+        return self.active_index.snapshot()
+
+    def reload_active_index(self):
+        """Cargar en memoria las reservas activas vigentes o futuras"""
+        rows = self._read('load_active_index', '''
+            SELECT id, space_number, start_time, end_time FROM reservations INDEXED BY idx_reservations_active_end
             WHERE status = 'active' AND end_time > ?
         ''', (datetime.now(),))
+        self.active_index.load(rows)
+
+    def get_reserved_spaces(self, start_time, end_time=None):
+        """Espacios con alguna reserva activa que se solapa con [start_time, end_time).
+
+        Sin end_time se consulta el instante start_time.
+        """
+        if end_time is None:
+            # Un instante: reservas con start_time <= t < end_time
+            rows = self._read('get_reserved_spaces', '''
+                SELECT DISTINCT space_number FROM reservations INDEXED BY idx_reservations_active_end
+                WHERE status = 'active' AND end_time > ? AND start_time <= ?
+            ''', (start_time, start_time))
+        else:
+            rows = self._read('get_reserved_spaces', '''
+                SELECT DISTINCT space_number FROM reservations INDEXED BY idx_reservations_active_end
+                WHERE status = 'active' AND end_time > ? AND start_time < ?
+            ''', (start_time, end_time))
         
-        return [row[0] for row in cursor.fetchall()]
+        return [row[0] for row in rows]
+
+    def get_free_spaces(self, start_time, end_time, space_numbers):
+        """De `space_numbers`, los que no tienen ninguna reserva activa en [start_time, end_time)"""
+        reserved = set(self.get_reserved_spaces(start_time, end_time))
+        return [n for n in space_numbers if n not in reserved]
     
     def get_user_reservations(self, user_id):
         """Obtener todas las reservas de un usuario"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
+        rows = self._read('get_user_reservations', '''
             SELECT id, space_number, start_time, end_time, status 
             FROM reservations 
             WHERE user_id = ? 
@@ -124,7 +348,7 @@ class Database:
         ''', (user_id,))
         
         reservations = []
-        for res in cursor.fetchall():
+        for res in rows:
             reservations.append({
                 'id': res[0],
                 'space_number': res[1],
@@ -137,25 +361,120 @@ class Database:
     
     def cancel_reservation(self, reservation_id, user_id):
         """Cancelar una reserva (solo si pertenece al usuario)"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
+        rowcount = self._write('cancel_reservation', lambda cursor: cursor.execute('''
             UPDATE reservations SET status = 'cancelled' 
             WHERE id = ? AND user_id = ?
-        ''', (reservation_id, user_id))
+        ''', (reservation_id, user_id)).rowcount)
         
-        self.conn.commit()
-        return cursor.rowcount > 0
+        if rowcount > 0:
+            self.active_index.remove(reservation_id)
+            self._notify('cancelled')
+        return rowcount > 0
+    
+    def expire_due(self, now=None, batch=None):
+        """Marcar como 'expired' las reservas activas con end_time <= now, en lotes de `batch`.
+
+        Cada lote es una transacción corta (no bloquea a otros escritores durante una
+        puesta al día grande) y se notifica a los listeners. Devuelve el total expirado.
+        """
+        now = now or datetime.now()
+        batch = batch or EXPIRY_BATCH
+        total = 0
+        while True:
+            rowcount = self._write('expire_due', lambda cursor: cursor.execute('''
+                UPDATE reservations SET status = 'expired'
+                WHERE id IN (
+                    SELECT id FROM reservations INDEXED BY idx_reservations_active_end
+                    WHERE status = 'active' AND end_time <= ?
+                    LIMIT ?
+                )
+            ''', (now, batch)).rowcount)
+            total += rowcount
+            if rowcount > 0:
+                self._notify('expired')
+            if rowcount < batch:
+                return total
+
+    def next_expiry(self):
+        """end_time de la próxima reserva activa que termina (None si no hay)"""
+        rows = self._read('next_expiry', '''
+            SELECT end_time FROM reservations INDEXED BY idx_reservations_active_end
+            WHERE status = 'active' ORDER BY end_time LIMIT 1
+        ''')
+        return datetime.fromisoformat(rows[0][0]) if rows else None
     
     def cleanup_expired_reservations(self):
-        """Limpiar reservas expiradas (puede ejecutarse periódicamente)"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE reservations SET status = 'expired' 
-            WHERE status = 'active' AND end_time < ?
-        ''', (datetime.now(),))
-        
-        self.conn.commit()
-        return cursor.rowcount
+        """Limpiar reservas expiradas (lo hace ExpiryScheduler; se mantiene para uso manual)"""
+        return self.expire_due()
+
+
+class ExpiryScheduler:
+    """Hilo que expira las reservas en cuanto llega su end_time.
+
+    Duerme hasta la próxima end_time (o hasta el próximo inicio/fin del índice en memoria,
+    para avisar a los clientes en ese momento), como mucho EXPIRY_MAX_SLEEP segundos: si
+    el reloj salta o otro proceso añade reservas, se recalcula en la siguiente vuelta.
+    Una reserva nueva lo despierta. Al arrancar hace una pasada de puesta al día
+    (reservas que vencieron con la aplicación parada).
+    """
+
+    def __init__(self, database, max_sleep=None):
+        self.db = database
+        self.max_sleep = max_sleep or EXPIRY_MAX_SLEEP
+        self.expired = 0
+        self.next_due = None
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+        # Una sola vez: start() puede llamarse de nuevo tras stop()
+        self.db.add_listener(self._on_change)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop = False
+        self.expired += self.db.expire_due()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def _on_change(self, event):
+        if event == 'created':
+            self._wake.set()  # puede terminar antes que la próxima prevista
+
+    def _run(self):
+        index = self.db.active_index
+        while not self._stop:
+            try:
+                self.expired += self.db.expire_due()
+                # Avanzar el índice en memoria (inicios de reservas futuras, fines) y avisar
+                version = index.version
+                index.snapshot()
+                if index.version != version:
+                    self.db._notify('advanced')
+                due = [t for t in (self.db.next_expiry(), index.next_event()) if t is not None]
+                self.next_due = min(due) if due else None
+            except sqlite3.Error:
+                self.next_due = None
+            timeout = self.max_sleep
+            if self.next_due is not None:
+                # margen de 10 ms para no despertar justo antes del instante
+                timeout = min(timeout, max(0.0, (self.next_due - datetime.now()).total_seconds()) + 0.01)
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def get_status(self):
+        return {
+            'running': self._thread is not None,
+            'expired': self.expired,
+            'next_due': self.next_due.isoformat(' ') if self.next_due else None,
+        }
 
 # Instancia global de la base de datos
-db = Database()
\ No newline at end of file
+db = Database()
@@ -0,0 +1,232 @@
+"""
+Motores de detección de ocupación intercambiables para VideoProcessor.
+
+Todos reciben el frame en gris y devuelven, para cada ROI del layout, la fracción de
+píxeles "activos" (0..1). Qué significa activo depende del motor:
+
+  - 'mog2':      movimiento según el background subtractor MOG2 (comportamiento original).
+                 Rápido, pero un coche quieto termina absorbido en el fondo.
+  - 'adaptive':  bordes/textura con umbral adaptativo + mediana + dilatación (la lógica de
+                 main.py). No necesita modelo de fondo; el umbral fijo `count < 900` de main.py
+                 se expresa como fracción del área (ADAPTIVE_OCCUPIED_RATIO) para que no
+                 dependa del tamaño de la ROI.
+  - 'reference': diferencia contra una imagen del estacionamiento vacío (REFERENCE_IMAGE,
+                 por defecto estacionamiento.png). Las medias por ROI de la referencia se
+                 precalculan una vez por layout; en cada frame se compensa el cambio global
+                 de iluminación con la mediana de las diferencias de media por ROI y se cuenta,
+                 con una sola imagen integral, qué fracción de cada ROI difiere de la referencia.
+                 Un coche estacionado sigue 'ocupado' aunque no se mueva.
+
+Cada motor define sus umbrales enter/exit para OccupancyTracker y mide su coste por frame;
+con un metrics.StageTimer, score() desglosa además blur, el motor y el conteo por ROI.
+Los resultados intermedios (blur, máscaras, diferencias) se escriben en buffers propios
+del motor (_buffer) que se reutilizan en cada frame del mismo tamaño.
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+from occupancy import OCCUPANCY_ENTER_RATIO, OCCUPANCY_EXIT_RATIO
+
+DETECTOR = os.environ.get('DETECTOR', 'mog2')
+MOG_HISTORY = int(os.environ.get('MOG_HISTORY', 300))
+MOG_VAR_THRESHOLD = float(os.environ.get('MOG_VAR_THRESHOLD', 25.0))
+ADAPTIVE_OCCUPIED_RATIO = float(os.environ.get('ADAPTIVE_OCCUPIED_RATIO', 0.175))  # ~900 px en ROI de 107x48
+REFERENCE_IMAGE = os.environ.get('REFERENCE_IMAGE', 'estacionamiento.png')
+REFERENCE_DIFF_THRESHOLD = int(os.environ.get('REFERENCE_DIFF_THRESHOLD', 30))     # diferencia de intensidad por píxel
+REFERENCE_OCCUPIED_RATIO = float(os.environ.get('REFERENCE_OCCUPIED_RATIO', 0.25))
+
+
+class Detector:
+    """Interfaz común: score(gray, layout) -> array de fracciones por ROI"""
+
+    name = 'base'
+    # True si la fracción ya mide movimiento (MOG2); si no, el movimiento se estima por
+    # la variación de las fracciones entre frames
+    measures_motion = False
+
+    def __init__(self, enter_ratio, exit_ratio):
+        self.enter_ratio = enter_ratio
+        self.exit_ratio = exit_ratio
+        self.frames = 0
+        self.avg_ms = 0.0
+        self.last_ms = 0.0
+        self._layout = None
+        self._prev_ratios = None
+        self._timer = None
+        self._buffers = {}
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        """Buffer de trabajo `name` reutilizable (se reasigna solo si cambia la forma)"""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self._buffers[name] = np.empty(shape, dtype)
+        return buf
+
+    def _lap(self, name):
+        if self._timer is not None:
+            self._timer.lap(name)
+
+    def mask(self, gray):
+        """Máscara (distinto de cero = píxel activo) del frame completo"""
+        raise NotImplementedError
+
+    def prepare(self, layout):
+        """Precálculo por layout (se llama una sola vez por cada layout nuevo)"""
+
+    def score(self, gray, layout, timer=None):
+        t0 = time.perf_counter()
+        self._timer = timer
+        if layout is not self._layout:
+            self.prepare(layout)
+            self._layout = layout
+            self._prev_ratios = None
+            self._lap('prepare')
+        mask = self.mask(gray)
+        self._lap(self.name)
+        ratios = layout.ratios(layout.count_nonzero(mask))
+        self._lap('roi_scoring')
+        self._record(time.perf_counter() - t0)
+        return ratios
+
+    def motion(self, ratios, layout):
+        """Fracción de movimiento global (ponderada por área) para el planificador adaptativo"""
+        if self.measures_motion:
+            value = layout.mean_ratio(ratios)
+        elif self._prev_ratios is None or len(self._prev_ratios) != len(ratios):
+            value = 0.0
+        else:
+            value = layout.mean_ratio(np.abs(ratios - self._prev_ratios))
+        self._prev_ratios = ratios
+        return value
+
+    def reset(self):
+        """Olvidar el estado interno (p. ej. tras cambiar de layout o de cámara)"""
+        self._layout = None
+        self._prev_ratios = None
+
+    def _record(self, seconds):
+        ms = seconds * 1000.0
+        self.frames += 1
+        self.last_ms = ms
+        self.avg_ms = ms if self.frames == 1 else self.avg_ms * 0.9 + ms * 0.1
+
+    def get_info(self):
+        return {
+            'name': self.name,
+            'enter_ratio': self.enter_ratio,
+            'exit_ratio': self.exit_ratio,
+            'frames': self.frames,
+            'last_ms': round(self.last_ms, 3),
+            'avg_ms': round(self.avg_ms, 3),
+        }
+
+
+class Mog2Detector(Detector):
+    """Sustracción de fondo MOG2 sobre el frame suavizado (motor original)"""
+
+    name = 'mog2'
+    measures_motion = True
+
+    def __init__(self, enter_ratio=OCCUPANCY_ENTER_RATIO, exit_ratio=OCCUPANCY_EXIT_RATIO,
+                 history=MOG_HISTORY, var_threshold=MOG_VAR_THRESHOLD):
+        super().__init__(enter_ratio, exit_ratio)
+        self.history = history
+        self.var_threshold = var_threshold
+        self.backsub = self._new_backsub()
+
+    def _new_backsub(self):
+        return cv2.createBackgroundSubtractorMOG2(history=self.history, varThreshold=self.var_threshold, detectShadows=False)
+
+    def mask(self, gray):
+        blurred = cv2.GaussianBlur(gray, (5,5), 0, dst=self._buffer('blur', gray.shape))
+        self._lap('blur')
+        return self.backsub.apply(blurred, fgmask=self._buffer('fgmask', gray.shape))
+
+    def reset(self):
+        super().reset()
+        self.backsub = self._new_backsub()
+
+
+class AdaptiveThresholdDetector(Detector):
+    """Umbral adaptativo + mediana + dilatación (pipeline de main.py)"""
+
+    name = 'adaptive'
+
+    def __init__(self, enter_ratio=ADAPTIVE_OCCUPIED_RATIO, exit_ratio=None):
+        super().__init__(enter_ratio, enter_ratio * 0.8 if exit_ratio is None else exit_ratio)
+        self.kernel = np.ones((5,5), np.uint8)
+
+    def mask(self, gray):
+        th = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 25, 16,
+                                   dst=self._buffer('threshold', gray.shape))
+        median = cv2.medianBlur(th, 5, dst=self._buffer('median', gray.shape))
+        return cv2.dilate(median, self.kernel, dst=self._buffer('mask', gray.shape))
+
+
+class ReferenceDiffDetector(Detector):
+    """Diferencia contra una imagen de referencia del estacionamiento vacío"""
+
+    name = 'reference'
+
+    def __init__(self, reference=REFERENCE_IMAGE, enter_ratio=REFERENCE_OCCUPIED_RATIO, exit_ratio=None,
+                 diff_threshold=REFERENCE_DIFF_THRESHOLD):
+        super().__init__(enter_ratio, enter_ratio * 0.6 if exit_ratio is None else exit_ratio)
+        if isinstance(reference, str):
+            image = cv2.imread(reference)
+            if image is None:
+                raise FileNotFoundError(f'No se pudo leer la imagen de referencia {reference}')
+            reference = image
+        if reference.ndim == 3:
+            reference = cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY)
+        self._reference_src = reference
+        self.diff_threshold = diff_threshold
+        self.reference = None
+        self._ref_means = None
+
+    def prepare(self, layout):
+        # Referencia en las coordenadas del layout (recortada igual que el frame si el
+        # análisis usa un RoiCrop) y sus medias por ROI: una vez por layout
+        crop = getattr(layout, 'crop', None)
+        if crop is None:
+            ref = cv2.resize(self._reference_src, (layout.width, layout.height))
+        else:
+            full = cv2.resize(self._reference_src, (crop.source.width, crop.source.height))
+            ref = crop.extract(full).copy()
+        self.reference = cv2.GaussianBlur(ref, (5,5), 0)
+        self._ref_means = layout.means(self.reference)
+
+    def mask(self, gray):
+        blurred = cv2.GaussianBlur(gray, (5,5), 0, dst=self._buffer('blur', gray.shape))
+        self._lap('blur')
+        ref = self.reference
+        if ref is None or ref.shape != blurred.shape:
+            ref = cv2.GaussianBlur(cv2.resize(self._reference_src, (blurred.shape[1], blurred.shape[0])), (5,5), 0)
+        layout = self._layout
+        # Compensar la iluminación global: mediana de (media ROI frame - media ROI referencia);
+        # la mediana ignora los espacios ocupados mientras sean minoría
+        if layout is not None and layout.valid.any():
+            valid = layout.valid
+            shift = float(np.median(layout.means(blurred)[valid] - self._ref_means[valid]))
+            shifted = self._buffer('reference', ref.shape)
+            ref = cv2.add(ref, shift, dst=shifted) if shift >= 0 else cv2.subtract(ref, -shift, dst=shifted)
+        diff = cv2.absdiff(blurred, ref, dst=self._buffer('diff', gray.shape))
+        return cv2.threshold(diff, self.diff_threshold, 255, cv2.THRESH_BINARY, dst=diff)[1]
+
+
+DETECTORS = {
+    'mog2': Mog2Detector,
+    'adaptive': AdaptiveThresholdDetector,
+    'reference': ReferenceDiffDetector,
+}
+
+
+def create_detector(name=None, **kwargs):
+    """Crear un motor por nombre ('mog2', 'adaptive', 'reference')"""
+    name = (name or DETECTOR).lower()
+    if name not in DETECTORS:
+        raise ValueError(f"Detector desconocido {name!r}; opciones: {', '.join(DETECTORS)}")
+    return DETECTORS[name](**kwargs)
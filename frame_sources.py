@@ -0,0 +1,157 @@
+"""
+Fuentes de frames con la interfaz de cv2.VideoCapture (isOpened, read, grab, retrieve,
+release, set, get)
+para alimentar VideoProcessor sin cámara: un vídeo grabado o cualquier iterable de
+frames (p. ej. el generador sintético de benchmarks/synthetic_lot.py).
+
+Ritmo (`pacing`):
+  - 'realtime': se comporta como una cámara en vivo a `fps`: read() espera al instante
+    del siguiente frame y, si el consumidor va con retraso, entrega el frame que toca
+    ahora y descarta los intermedios (contados en `skipped`). Con buffered=True imita la
+    cola de un stream RTSP: con retraso no se descarta nada, los frames atrasados se
+    entregan en orden y al instante (cada vez más viejos)
+  - 'fast': cada read() entrega el siguiente frame sin esperar (tan rápido como se procese)
+
+grab() avanza al siguiente frame y retrieve() lo entrega (read() = grab() + retrieve());
+get(CAP_PROP_POS_MSEC) es la marca de tiempo del frame actual según `fps`.
+
+VideoProcessor acepta estas fuentes como `src` en lugar de un índice o una URL. Como en
+cv2.VideoCapture.read(image), si read() recibe un buffer de la misma forma el frame se
+copia en él en lugar de entregar el array del generador.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+
+class FrameSource:
+    def __init__(self, frames, fps=30.0, pacing='realtime', buffered=False):
+        if pacing not in ('realtime', 'fast'):
+            raise ValueError(f"pacing debe ser 'realtime' o 'fast', no {pacing!r}")
+        self._frames = iter(frames)
+        self.fps = float(fps)
+        self.pacing = pacing
+        self.buffered = buffered
+        self._grabbed = None
+        self.index = -1         # índice del último frame entregado
+        self.skipped = 0
+        self.exhausted = False
+        self._opened = True
+        self._start = None
+
+    def isOpened(self):
+        return self._opened and not self.exhausted
+
+    def _next(self):
+        try:
+            frame = next(self._frames)
+        except StopIteration:
+            self.exhausted = True
+            return None
+        self.index += 1
+        return frame
+
+    def grab(self):
+        """Avanzar al siguiente frame (esperando a que toque en 'realtime'). False al terminar"""
+        self._grabbed = None
+        if not self.isOpened():
+            return False
+        if self.pacing == 'fast':
+            frame = self._next()
+        else:
+            now = time.perf_counter()
+            if self._start is None:
+                self._start = now
+            due = self.index + 1
+            wait = self._start + due / self.fps - now
+            if wait > 0:
+                time.sleep(wait)
+            frame = self._next()
+            if not self.buffered:
+                # Con retraso: saltar hasta el frame que corresponde a este instante
+                target = max(due, int((time.perf_counter() - self._start) * self.fps))
+                while frame is not None and self.index < target:
+                    nxt = self._next()
+                    if nxt is None:
+                        break
+                    self.skipped += 1
+                    frame = nxt
+        self._grabbed = frame
+        return frame is not None
+
+    def retrieve(self, image=None):
+        """Entregar el frame del último grab() (copiado en `image` si tiene su forma)"""
+        frame = self._grabbed
+        if frame is None:
+            return False, None
+        if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def open(self):
+        """Reabrir tras release() (VideoProcessor al reconectar): continúa donde se quedó"""
+        self._opened = True
+        self._start = None if self.index < 0 else time.perf_counter() - (self.index + 1) / self.fps
+
+    def release(self):
+        self._opened = False
+
+    def set(self, prop, value):
+        return False
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.index + 1
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return max(0, self.index) * 1000.0 / self.fps
+        return 0.0
+
+
+def video_frames(path, loop=False):
+    """Frames de un archivo de vídeo (opcionalmente en bucle)"""
+    while True:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise FileNotFoundError(f'No se pudo abrir {path}')
+        try:
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield frame
+        finally:
+            cap.release()
+        if not loop:
+            return
+
+
+class VideoFileSource(FrameSource):
+    """Vídeo grabado con el ritmo de su propio fps ('realtime') o sin esperas ('fast')"""
+
+    def __init__(self, path, pacing='realtime', loop=False, fps=None, buffered=False):
+        if fps is None:
+            cap = cv2.VideoCapture(path)
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+            cap.release()
+        super().__init__(video_frames(path, loop), fps, pacing, buffered)
+        self.path = path
+
+
+def open_source(src):
+    """Captura para `src`: una fuente con interfaz de VideoCapture se usa tal cual"""
+    if isinstance(src, FrameSource):
+        src.open()
+        return src
+    if hasattr(src, 'read') and hasattr(src, 'isOpened'):
+        return src
+    return cv2.VideoCapture(src)
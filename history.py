@@ -0,0 +1,256 @@
+"""
+Historial de ocupación: transiciones por espacio y agregados por minuto / hora.
+
+No se guarda nada por frame. OccupancyHistory recibe cada estado publicado por las
+cámaras (CameraRegistry.add_listener), lo compara con el anterior y encola solo los
+espacios que cambiaron. Un hilo de fondo vacía la cola cada HISTORY_FLUSH_SECONDS (o
+antes si se llena) en una sola transacción que:
+
+  - inserta las transiciones en occupancy_events (espacio, instante, ocupado)
+  - suma los segundos ocupados de los intervalos cerrados, y de los que siguen abiertos
+    hasta el instante del vaciado, en occupancy_rollup (resolución 60 y 3600 s, por
+    espacio y para todo el lote con space_number = 0)
+
+Las consultas de utilización leen solo occupancy_rollup: un mes por horas son ~720 filas
+del lote, sin recorrer los eventos. Los agregados están al día hasta el último vaciado.
+Los eventos y los agregados por minuto se purgan tras HISTORY_EVENT_DAYS /
+HISTORY_MINUTE_DAYS; los agregados por hora se conservan.
+
+Los instantes se guardan como segundos Unix (REAL); los números de espacio son los
+globales del lote (base 1).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+HISTORY_FLUSH_SECONDS = float(os.environ.get('HISTORY_FLUSH_SECONDS', 5.0))
+HISTORY_MAX_BUFFER = int(os.environ.get('HISTORY_MAX_BUFFER', 5000))     # transiciones que fuerzan un vaciado
+HISTORY_EVENT_DAYS = float(os.environ.get('HISTORY_EVENT_DAYS', 90))
+HISTORY_MINUTE_DAYS = float(os.environ.get('HISTORY_MINUTE_DAYS', 14))
+HISTORY_PRUNE_SECONDS = 3600.0
+
+RESOLUTIONS = {'minute': 60, 'hour': 3600}
+LOT = 0  # space_number de las filas agregadas de todo el lote
+
+
+def _split(t0, t1, size):
+    """Repartir el intervalo [t0, t1) en cubos de `size` segundos: [(inicio_cubo, segundos)]"""
+    bucket = int(t0 // size) * size
+    while bucket < t1:
+        seconds = min(t1, bucket + size) - max(t0, bucket)
+        if seconds > 0:
+            yield bucket, seconds
+        bucket += size
+
+
+class OccupancyHistory:
+    def __init__(self, database, flush_seconds=HISTORY_FLUSH_SECONDS, max_buffer=HISTORY_MAX_BUFFER):
+        self.db = database
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self._lock = threading.Lock()
+        self._buffer = []       # (space_number, ts, ocupado) pendientes de escribir
+        self._last = {}         # origen (cámara) -> (offset, último estado)
+        self._open = {}         # space_number -> instante desde el que se cuenta como ocupado
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+        self._last_prune = 0.0
+        self.flushes = 0
+        self.events_written = 0
+        self.last_flush_ms = 0.0
+        self.create_tables()
+
+    def create_tables(self):
+        def create(cursor):
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS occupancy_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    space_number INTEGER NOT NULL,
+                    ts REAL NOT NULL,
+                    occupied INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_occupancy_events_space_ts
+                ON occupancy_events (space_number, ts)
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS occupancy_rollup (
+                    resolution INTEGER NOT NULL,
+                    space_number INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    occupied_seconds REAL NOT NULL,
+                    PRIMARY KEY (resolution, space_number, bucket)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_occupancy_rollup_bucket
+                ON occupancy_rollup (resolution, bucket, space_number, occupied_seconds)
+            ''')
+        self.db._write('history_create_tables', create)
+
+    # ----------------- Captura -----------------
+    def record(self, source, offset, estado, ts=None):
+        """Registrar el estado de una cámara (`offset` = primer espacio en base 0; None = parada)"""
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            prev_offset, prev = self._last.get(source, (offset, []))
+            if estado is None or prev_offset != offset or len(prev) != len(estado):
+                # Cámara parada o layout nuevo: se cierran los espacios que estaban ocupados
+                self._buffer.extend((prev_offset + i + 1, ts, False) for i, o in enumerate(prev) if o)
+                prev = [False] * (0 if estado is None else len(estado))
+            if estado is None:
+                self._last.pop(source, None)
+            else:
+                self._buffer.extend((offset + i + 1, ts, bool(new))
+                                    for i, (old, new) in enumerate(zip(prev, estado)) if old != new)
+                self._last[source] = (offset, list(estado))
+            if len(self._buffer) >= self.max_buffer:
+                self._wake.set()
+
+    # ----------------- Escritura -----------------
+    def flush(self, now=None):
+        """Escribir las transiciones pendientes y actualizar los agregados hasta `now`"""
+        with self._flush_lock:
+            now = time.time() if now is None else now
+            with self._lock:
+                events, self._buffer = self._buffer, []
+            events.sort(key=lambda e: e[1])
+
+            # Intervalos ocupados cerrados por las transiciones + los abiertos hasta ahora
+            acc = defaultdict(float)
+            open_ = dict(self._open)
+
+            def add(space, t0, t1):
+                for size in RESOLUTIONS.values():
+                    for bucket, seconds in _split(t0, t1, size):
+                        acc[(size, space, bucket)] += seconds
+                        acc[(size, LOT, bucket)] += seconds
+
+            for space, ts, occupied in events:
+                since = open_.pop(space, None)
+                if since is not None:
+                    add(space, since, ts)
+                if occupied:
+                    open_[space] = ts
+            for space, since in open_.items():
+                if now > since:
+                    add(space, since, now)
+                    open_[space] = now
+
+            if not events and not acc:
+                return 0
+
+            def write(cursor):
+                cursor.executemany(
+                    'INSERT INTO occupancy_events (space_number, ts, occupied) VALUES (?, ?, ?)',
+                    [(space, ts, int(occupied)) for space, ts, occupied in events])
+                cursor.executemany('''
+                    INSERT INTO occupancy_rollup (resolution, space_number, bucket, occupied_seconds)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (resolution, space_number, bucket)
+                    DO UPDATE SET occupied_seconds = occupied_seconds + excluded.occupied_seconds
+                ''', [key + (seconds,) for key, seconds in acc.items()])
+
+            t0 = time.perf_counter()
+            try:
+                self.db._write('history_flush', write)
+            except sqlite3.Error:
+                # No se pierde nada: las transiciones vuelven a la cola para el próximo intento
+                with self._lock:
+                    self._buffer[:0] = events
+                raise
+            self._open = open_
+            self.flushes += 1
+            self.events_written += len(events)
+            self.last_flush_ms = (time.perf_counter() - t0) * 1000.0
+            return len(events)
+
+    def prune(self, now=None):
+        """Borrar eventos y agregados por minuto más antiguos que su retención"""
+        now = time.time() if now is None else now
+
+        def delete(cursor):
+            cursor.execute('DELETE FROM occupancy_events WHERE ts < ?', (now - HISTORY_EVENT_DAYS * 86400,))
+            cursor.execute('DELETE FROM occupancy_rollup WHERE resolution = ? AND bucket < ?',
+                           (RESOLUTIONS['minute'], now - HISTORY_MINUTE_DAYS * 86400))
+        self.db._write('history_prune', delete)
+        self._last_prune = now
+
+    def _run(self):
+        while not self._stop:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+                if time.time() - self._last_prune >= HISTORY_PRUNE_SECONDS:
+                    self.prune()
+            except sqlite3.Error:
+                pass
+
+    def start(self):
+        if self._thread is None:
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Parar el hilo y escribir lo pendiente"""
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.flush()
+
+    def get_status(self):
+        with self._lock:
+            pending = len(self._buffer)
+        return {'pending': pending, 'flushes': self.flushes, 'events_written': self.events_written,
+                'last_flush_ms': round(self.last_flush_ms, 3), 'open_intervals': len(self._open)}
+
+    # ----------------- Consultas (sobre los agregados) -----------------
+    def utilization(self, start, end, resolution='hour', space=None, spaces=1):
+        """Serie de ocupación por cubo en [start, end) (segundos Unix).
+
+        space=None -> todo el lote (utilización = segundos ocupados / (spaces * cubo)).
+        """
+        size = RESOLUTIONS[resolution]
+        first = int(start // size) * size
+        rows = self.db._read('history_utilization', '''
+            SELECT bucket, occupied_seconds FROM occupancy_rollup
+            WHERE resolution = ? AND space_number = ? AND bucket >= ? AND bucket < ?
+        ''', (size, LOT if space is None else int(space), first, end))
+        seconds = dict(rows)
+        capacity = size * (spaces if space is None else 1)
+        return [
+            {'bucket': bucket, 'ocupado_s': round(seconds.get(bucket, 0.0), 3),
+             'utilizacion': round(seconds.get(bucket, 0.0) / capacity, 4) if capacity else None}
+            for bucket in range(first, int(end), size)
+        ]
+
+    def space_summary(self, start, end, resolution='hour'):
+        """Segundos ocupados y utilización por espacio en [start, end)"""
+        size = RESOLUTIONS[resolution]
+        first = int(start // size) * size
+        rows = self.db._read('history_space_summary', '''
+            SELECT space_number, SUM(occupied_seconds) FROM occupancy_rollup INDEXED BY idx_occupancy_rollup_bucket
+            WHERE resolution = ? AND bucket >= ? AND bucket < ? AND space_number > 0
+            GROUP BY space_number ORDER BY space_number
+        ''', (size, first, end))
+        window = max(1.0, end - first)
+        return [{'espacio': space, 'ocupado_s': round(seconds, 3), 'utilizacion': round(seconds / window, 4)}
+                for space, seconds in rows]
+
+    def events(self, space, start, end, limit=1000):
+        """Transiciones de un espacio en [start, end) (tabla de eventos, acotada por índice)"""
+        rows = self.db._read('history_events', '''
+            SELECT ts, occupied FROM occupancy_events
+            WHERE space_number = ? AND ts >= ? AND ts < ? ORDER BY ts LIMIT ?
+        ''', (int(space), start, end, limit))
+        return [{'ts': ts, 'ocupado': bool(occupied)} for ts, occupied in rows]
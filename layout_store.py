@@ -0,0 +1,149 @@
+"""
+Almacén versionado de layouts de ROI (sin pickle).
+
+Formato en disco (<base>.npz, np.savez sin compresión, se lee con allow_pickle=False):
+  rois   int32 (N, 4) con (x, y, w, h) por espacio
+  meta   cadena JSON: {"format": 1, "version": n, "count": N, "saved_at": ISO 8601}
+
+La escritura es atómica: se escribe un temporal en el mismo directorio, se hace fsync y
+se reemplaza con os.replace, así que un lector nunca ve un archivo a medias. Cada
+guardado incrementa `version`.
+
+Compatibilidad: si existe <base>.pkl (obtener_espacios.py, main.py) y es más reciente
+que el .npz, se importa y se migra a un .npz nuevo. La carga es perezosa: un layout que
+no existe es una lista vacía, no un error al arrancar.
+
+changed() solo hace stat() de los dos archivos (mtime y tamaño), así que puede llamarse
+cada segundo para detectar ediciones externas (CameraRegistry.watch_layouts).
+"""
+
+import json
+import os
+import pickle
+import stat
+import tempfile
+import threading
+from datetime import datetime
+
+import numpy as np
+
+LAYOUT_FORMAT = 1
+
+# os.umask solo se puede leer cambiándola: se lee una vez al importar, no en cada guardado
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class LayoutStore:
+    def __init__(self, path):
+        base = os.path.splitext(path)[0]
+        self.path = base + '.npz'
+        self.legacy_path = base + '.pkl'
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._signatures = (None, None)
+        self.version = 0
+        self.espacios = []
+
+    # ----------------- Lectura -----------------
+    def get(self):
+        """(versión, lista de ROI), cargando del disco la primera vez"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return self.version, list(self.espacios)
+
+    def changed(self):
+        """True si alguno de los archivos cambió en disco desde la última carga o guardado"""
+        return (_signature(self.path), _signature(self.legacy_path)) != self._signatures
+
+    def reload(self):
+        """Releer del disco: (versión, ROI). FileNotFoundError si no hay ningún archivo"""
+        with self._lock:
+            if _signature(self.path) is None and _signature(self.legacy_path) is None:
+                raise FileNotFoundError(self.path)
+            self._load()
+            return self.version, list(self.espacios)
+
+    def _load(self):
+        npz, pkl = _signature(self.path), _signature(self.legacy_path)
+        if pkl is not None and (npz is None or pkl[0] > npz[0]):
+            # Pickle heredado más reciente (editado con obtener_espacios.py): se migra
+            with open(self.legacy_path, 'rb') as f:
+                espacios = [tuple(int(v) for v in r) for r in pickle.load(f)]
+            previous = read_layout(self.path)[0] if npz is not None else self.version
+            self.version, self.espacios = max(previous, self.version) + 1, espacios
+            try:
+                self._write(espacios, self.version)
+            except OSError:
+                pass  # directorio de solo lectura: se usa el layout en memoria
+        elif npz is not None:
+            self.version, self.espacios = read_layout(self.path)
+        else:
+            self.espacios = []
+        self._loaded = True
+        self._signatures = (_signature(self.path), _signature(self.legacy_path))
+
+    # ----------------- Escritura -----------------
+    def save(self, espacios):
+        """Guardar un layout nuevo de forma atómica. Devuelve la nueva versión"""
+        espacios = [tuple(int(v) for v in r) for r in espacios]
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            version = self.version + 1
+            self._write(espacios, version)
+            self.version, self.espacios = version, espacios
+            self._signatures = (_signature(self.path), _signature(self.legacy_path))
+            return version
+
+    def _write(self, espacios, version):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        meta = {'format': LAYOUT_FORMAT, 'version': version, 'count': len(espacios),
+                'saved_at': datetime.now().isoformat(timespec='seconds')}
+        fd, tmp = tempfile.mkstemp(prefix='.layout-', suffix='.npz', dir=directory)
+        try:
+            # mkstemp crea el archivo con 0600: dejarle los permisos que tendría uno normal
+            os.fchmod(fd, _file_mode(self.path))
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, rois=np.array(espacios, dtype=np.int32).reshape(-1, 4), meta=np.array(json.dumps(meta)))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+
+def _file_mode(path):
+    """Permisos del archivo existente o, si no existe, los de uno nuevo (0666 menos la umask)"""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def read_layout(path):
+    """(versión, lista de ROI) de un archivo .npz de layout"""
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['meta']))
+        if meta.get('format', 0) > LAYOUT_FORMAT:
+            raise ValueError(f'{path}: formato de layout {meta["format"]} no soportado')
+        rois = data['rois'].reshape(-1, 4)
+    return int(meta.get('version', 0)), [tuple(int(v) for v in r) for r in rois]
+
+
+def load_espacios(path):
+    """Lista de ROI de `path` (.npz o .pkl heredado); lista vacía si no existe"""
+    return LayoutStore(path).get()[1]
@@ -0,0 +1,225 @@
+"""
+Actualizaciones de ocupación en tiempo real (Server-Sent Events) con codificación por deltas.
+
+Un OccupancyFeed combina el estado de la cámara (ocupado) con las reservas activas
+(reservado) en una lista de tuplas (ocupado, reservado) por espacio, y numera cada
+cambio con una versión creciente. Los clientes reciben un snapshot inicial y luego solo
+los espacios que cambiaron:
+
+    id: 42
+    event: delta
+    data: {"version": 42, "changes": [[3, true, false], [17, false, true]]}
+
+Tras reconectar, el navegador envía Last-Event-ID (o el cliente puede pasar ?since=N) y
+se reenvían solo los deltas posteriores mientras sigan en el historial; si no, se manda
+un snapshot nuevo. El feed solo consulta a la cámara y a la base de datos mientras haya
+clientes conectados, una vez por intervalo para todos ellos.
+
+sse_stream_async() es la variante para el servidor asíncrono (asgi.py): cada cliente es
+una corrutina y todos los de un event loop esperan el mismo Future, resuelto desde el
+hilo de muestreo.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+FEED_INTERVAL = float(os.environ.get('FEED_INTERVAL', 0.25))  # segundos entre muestreos
+FEED_HISTORY = int(os.environ.get('FEED_HISTORY', 512))       # deltas guardados para reanudar
+FEED_HEARTBEAT = float(os.environ.get('FEED_HEARTBEAT', 15.0))  # comentario SSE para mantener viva la conexión
+
+
+class OccupancyFeed:
+    def __init__(self, get_estado, get_reserved, interval=FEED_INTERVAL, history=FEED_HISTORY):
+        """
+        get_estado: función que devuelve la lista de booleanos ocupado/libre
+        get_reserved: función que devuelve los índices (base 0) de espacios reservados
+        """
+        self._get_estado = get_estado
+        self._get_reserved = get_reserved
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._state = []
+        # Base temporal: las versiones de un proceso nuevo nunca coinciden con las de uno anterior
+        self.version = int(time.time() * 1000)
+        # (version, cambios) ; cambios None = cambió el número de espacios (hace falta snapshot)
+        self._history = deque(maxlen=history)
+        self._subscribers = 0
+        self._thread = None
+        self._kick = threading.Event()
+        self._loop_waiters = {}  # event loop -> Future compartido por sus clientes asyncio
+
+    # ----------------- Muestreo -----------------
+    def refresh(self):
+        """Leer estado + reservas y registrar los espacios que cambiaron"""
+        estado = self._get_estado()
+        reserved = set(self._get_reserved())
+        state = [(bool(o), i in reserved) for i, o in enumerate(estado)]
+        with self._cond:
+            if len(state) != len(self._state):
+                changes = None
+            else:
+                changes = [(i,) + new for i, (old, new) in enumerate(zip(self._state, state)) if old != new]
+                if not changes:
+                    return
+            self.version += 1
+            self._state = state
+            self._history.append((self.version, changes))
+            self._cond.notify_all()
+            waiters, self._loop_waiters = self._loop_waiters, {}
+        for loop, future in waiters.items():
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # loop ya cerrado
+
+    def kick(self):
+        """Forzar un muestreo inmediato (p. ej. tras crear o cancelar una reserva)"""
+        self._kick.set()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._subscribers == 0:
+                    self._thread = None
+                    return
+            try:
+                self.refresh()
+            except Exception:
+                pass
+            self._kick.wait(self.interval)
+            self._kick.clear()
+
+    def subscribe(self):
+        """Registrar un cliente; el primero hace un muestreo y arranca el hilo"""
+        with self._cond:
+            self._subscribers += 1
+            first = self._thread is None
+        if first:
+            self.refresh()
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    @contextmanager
+    def subscription(self):
+        """Registrar un cliente mientras dure el bloque (arranca/para el muestreo)"""
+        self.subscribe()
+        try:
+            yield self
+        finally:
+            self.unsubscribe()
+
+    # ----------------- Lectura -----------------
+    def snapshot(self):
+        with self._cond:
+            return self.version, list(self._state)
+
+    def _changes_since(self, since):
+        """Deltas con versión > since, o None si ya no están en el historial (hace falta snapshot)"""
+        if since == self.version:
+            return []
+        if since > self.version:
+            # versión de otro proceso (p. ej. el servidor se reinició)
+            return None
+        items = [item for item in self._history if item[0] > since]
+        if not items or items[0][0] != since + 1 or any(changes is None for _, changes in items):
+            return None
+        return items
+
+    def changes_since(self, since):
+        with self._cond:
+            return self._changes_since(since)
+
+    def wait_changes(self, since, timeout):
+        """Esperar deltas posteriores a `since` ([] si vence el timeout, None si hace falta snapshot)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > since, timeout)
+            return self._changes_since(since)
+
+    async def wait_changes_async(self, since, timeout):
+        """Como wait_changes() pero sin bloquear el event loop"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self.version > since:
+                return self._changes_since(since)
+            future = self._loop_waiters.get(loop)
+            if future is None:
+                future = self._loop_waiters[loop] = loop.create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.changes_since(since)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _sse(event, version, payload):
+    return f"id: {version}\nevent: {event}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+
+def _resume(feed, since):
+    """(since, deltas pendientes) al reanudar con Last-Event-ID; deltas None = snapshot"""
+    if since is None:
+        return None, None
+    try:
+        since = int(since)
+        return since, feed.changes_since(since)
+    except (TypeError, ValueError):
+        return None, None
+
+
+def _messages(feed, items):
+    """Mensajes SSE para `items` (ver sse_stream) y la última versión enviada"""
+    if items is None:
+        version, state = feed.snapshot()
+        return [_sse('snapshot', version, {'version': version, 'estado': [list(s) for s in state]})], version
+    if not items:
+        return [': ping\n\n'], None
+    return [_sse('delta', version, {'version': version, 'changes': [list(c) for c in changes]})
+            for version, changes in items], items[-1][0]
+
+
+def sse_stream(feed, since=None, heartbeat=FEED_HEARTBEAT):
+    """Generador SSE: snapshot (o deltas pendientes si se reanuda) y luego solo deltas"""
+    with feed.subscription():
+        since, items = _resume(feed, since)
+        while True:
+            messages, version = _messages(feed, items)
+            yield from messages
+            since = since if version is None else version
+            items = feed.wait_changes(since, heartbeat)
+
+
+async def sse_stream_async(feed, since=None, heartbeat=FEED_HEARTBEAT):
+    """Versión asíncrona de sse_stream() (generador asíncrono de str)"""
+    loop = asyncio.get_running_loop()
+    # El primer cliente muestrea la cámara (puede arrancarla): fuera del event loop
+    await loop.run_in_executor(None, feed.subscribe)
+    try:
+        since, items = _resume(feed, since)
+        while True:
+            messages, version = _messages(feed, items)
+            for message in messages:
+                yield message
+            since = since if version is None else version
+            items = await feed.wait_changes_async(since, heartbeat)
+    finally:
+        feed.unsubscribe()
@@ -0,0 +1,233 @@
+"""
+Métricas en formato de texto de Prometheus (/metrics) y perfilado por muestreo.
+
+No depende de prometheus_client: las latencias se acumulan en Histogram (cubos fijos,
+LATENCY_BUCKETS) dentro de los contadores que ya existen (app_camera.StageStats,
+database.QueryStats), y render_metrics() recorre, al hacer scrape, las estadísticas de
+cada cámara (get_pipeline_stats(), que también llega desde los procesos de cámara), las
+consultas de SQLite y los clientes de streaming. Medir cuesta dos perf_counter() y un
+bisect por etapa y frame.
+
+sample_stacks() es el perfilador: durante unos segundos toma, cada PROFILER_INTERVAL, la
+pila del hilo indicado (sys._current_frames) y devuelve las pilas agregadas en formato
+"collapsed" (una línea por pila: marcos separados por ';' y número de muestras), que
+leen directamente flamegraph.pl o speedscope. Solo se expone si PROFILER_ENABLED=1.
+"""
+
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0').lower() in ('1', 'true', 'yes')
+PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', 0.005))   # segundos entre muestras
+PROFILER_MAX_SECONDS = float(os.environ.get('PROFILER_MAX_SECONDS', 30.0))
+
+# Límites superiores (segundos) de los cubos de latencia; el último cubo es +Inf
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """Histograma acumulativo de latencias (no toma locks: lo protege quien lo contiene)"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def snapshot(self):
+        """{'buckets': cuentas acumuladas por límite (+Inf al final), 'sum': segundos, 'count'}"""
+        cumulative, total = [], 0
+        for n in self.counts:
+            total += n
+            cumulative.append(total)
+        return {'buckets': cumulative, 'sum': round(self.sum, 6), 'count': self.count}
+
+
+class StageTimer:
+    """Cronómetro por vueltas: lap(nombre) registra el tiempo desde la vuelta anterior"""
+
+    def __init__(self, record):
+        self._record = record  # record(nombre, segundos)
+        self._t = time.perf_counter()
+
+    def reset(self):
+        self._t = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self._record(name, now - self._t)
+        self._t = now
+
+
+class TimedLock:
+    """Lock con tiempos de espera y de retención (mismo uso que threading.Lock en `with`)"""
+
+    def __init__(self, record):
+        self._lock = threading.Lock()
+        self._record = record  # record(nombre, segundos) -> 'lock_wait' / 'lock_hold'
+        self._acquired = 0.0
+
+    def __enter__(self):
+        t0 = time.perf_counter()
+        self._lock.acquire()
+        self._acquired = now = time.perf_counter()
+        self._record('lock_wait', now - t0)
+        return self
+
+    def __exit__(self, *exc):
+        held = time.perf_counter() - self._acquired
+        self._lock.release()
+        self._record('lock_hold', held)
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+
+# ----------------- Exposición (formato de texto de Prometheus) -----------------
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+class Exposition:
+    """Acumula familias de métricas y las serializa en el formato de texto 0.0.4"""
+
+    def __init__(self):
+        self._families = {}  # nombre -> [tipo, ayuda, líneas]
+
+    def _family(self, name, kind, help_text):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = [kind, help_text, []]
+        return family[2]
+
+    def gauge(self, name, help_text, value, **labels):
+        self._family(name, 'gauge', help_text).append(f'{name}{_labels(labels)} {float(value):g}')
+
+    def counter(self, name, help_text, value, **labels):
+        self._family(name, 'counter', help_text).append(f'{name}{_labels(labels)} {float(value):g}')
+
+    def histogram(self, name, help_text, snap, bounds=LATENCY_BUCKETS, **labels):
+        lines = self._family(name, 'histogram', help_text)
+        for bound, n in zip(list(bounds) + ['+Inf'], snap['buckets']):
+            lines.append(f'{name}_bucket{_labels(dict(labels, le=bound))} {n}')
+        lines.append(f'{name}_sum{_labels(labels)} {snap["sum"]:g}')
+        lines.append(f'{name}_count{_labels(labels)} {snap["count"]}')
+
+    def render(self):
+        out = []
+        for name, (kind, help_text, lines) in self._families.items():
+            out.append(f'# HELP {name} {help_text}')
+            out.append(f'# TYPE {name} {kind}')
+            out.extend(lines)
+        return '\n'.join(out) + '\n'
+
+
+def render_metrics(registry, database, feeds=(), history=None):
+    """Texto de /metrics: cámaras en marcha, consultas SQLite, feeds SSE e historial"""
+    exp = Exposition()
+    running = registry.running()
+    for cam_id in registry.ids():
+        exp.gauge('parking_camera_running', 'Procesador de la cámara en marcha', cam_id in running, camera=cam_id)
+    for cam_id, processor in running.items():
+        try:
+            stats = processor.get_pipeline_stats(histograms=True)
+        except Exception:
+            continue
+        if not stats:
+            continue
+        exp.gauge('parking_achieved_fps', 'Frames analizados por segundo (media móvil)',
+                  stats.get('achieved_fps', 0.0), camera=cam_id)
+        exp.gauge('parking_target_fps', 'Frames por segundo objetivo', stats.get('target_fps', 0.0), camera=cam_id)
+        exp.gauge('parking_stream_clients', 'Clientes conectados a /video_feed',
+                  stats.get('stream_clients', 0), camera=cam_id)
+        for tier, info in stats.get('stream_tiers', {}).items():
+            exp.gauge('parking_stream_tier_clients', 'Clientes de /video_feed por nivel de calidad',
+                      info.get('subscribers', 0), camera=cam_id, tier=tier)
+            exp.counter('parking_stream_tier_encoded_frames_total', 'Frames codificados en JPEG por nivel de calidad',
+                        info.get('encoded', 0), camera=cam_id, tier=tier)
+            exp.gauge('parking_stream_tier_jpeg_bytes', 'Tamaño del último JPEG codificado por nivel de calidad',
+                      info.get('jpeg_bytes', 0), camera=cam_id, tier=tier)
+        counters = stats.get('counters', {})
+        exp.counter('parking_capture_reconnects_total', 'Reaperturas de la cámara tras perder la señal',
+                    counters.get('reconnects', 0), camera=cam_id)
+        exp.counter('parking_capture_failures_total', 'Lecturas fallidas de la cámara',
+                    counters.get('read_failures', 0), camera=cam_id)
+        exp.counter('parking_stream_skipped_frames_total', 'Frames que los clientes lentos de /video_feed se saltaron',
+                    counters.get('stream_skipped', 0), camera=cam_id)
+        exp.counter('parking_capture_grab_skipped_total', 'Frames descartados con grab() sin retrieve() (CAPTURE_MODE=grab)',
+                    counters.get('grab_skipped', 0), camera=cam_id)
+        for name, ring in stats.get('buffers', {}).items():
+            exp.counter('parking_frame_buffer_misses_total', 'Frames que no cupieron en el anillo de buffers preasignados',
+                        ring.get('misses', 0), camera=cam_id, ring=name)
+        stages = dict(stats.get('stages', {}))
+        age = stages.pop('frame_age', None)
+        if age is not None and 'histogram' in age:
+            exp.histogram('parking_frame_age_seconds', 'Edad del frame al publicar su análisis (desde su llegada)',
+                          age['histogram'], camera=cam_id)
+        for name, stage in stages.items():
+            exp.counter('parking_stage_dropped_frames_total', 'Frames descartados a la entrada de la etapa',
+                        stage.get('drops', 0), camera=cam_id, stage=name)
+            exp.gauge('parking_stage_queue_depth', 'Elementos pendientes a la entrada de la etapa',
+                      stage.get('queue_depth', 0), camera=cam_id, stage=name)
+            if 'histogram' in stage:
+                exp.histogram('parking_stage_seconds', 'Duración por etapa del procesamiento de un frame',
+                              stage['histogram'], camera=cam_id, stage=name)
+
+    for name, snap in database.query_stats.histograms().items():
+        exp.histogram('parking_sqlite_query_seconds', 'Latencia de las consultas SQLite (incluye reintentos)',
+                      snap, query=name)
+    for name, s in database.query_stats.as_dict().items():
+        exp.counter('parking_sqlite_busy_retries_total', 'Reintentos por base de datos ocupada', s['retries'], query=name)
+        exp.counter('parking_sqlite_errors_total', 'Consultas SQLite fallidas', s['errors'], query=name)
+
+    for key, feed in feeds:
+        exp.gauge('parking_sse_clients', 'Clientes conectados a /api/stream/estado', feed.subscribers, feed=key)
+    if history is not None:
+        status = history.get_status()
+        exp.gauge('parking_history_pending', 'Transiciones pendientes de escribir', status['pending'])
+        exp.counter('parking_history_events_written_total', 'Transiciones escritas en SQLite', status['events_written'])
+    return exp.render()
+
+
+# ----------------- Perfilador por muestreo -----------------
+def sample_stacks(thread_ids, seconds=3.0, interval=PROFILER_INTERVAL):
+    """Muestrear las pilas de `thread_ids` durante `seconds`. Devuelve texto collapsed (pila muestras)"""
+    seconds = min(float(seconds), PROFILER_MAX_SECONDS)
+    thread_ids = set(thread_ids)
+    counts = Counter()
+    deadline = time.perf_counter() + seconds
+    samples = 0
+    while time.perf_counter() < deadline:
+        frames = sys._current_frames()
+        for ident in thread_ids:
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            if stack:
+                counts[';'.join(reversed(stack))] += 1
+        samples += 1
+        del frames
+        time.sleep(interval)
+    lines = [f'{stack} {n}' for stack, n in counts.most_common()]
+    return f'# {samples} muestras en {seconds:g} s (cada {interval * 1000:g} ms)\n' + '\n'.join(lines) + '\n'
@@ -0,0 +1,72 @@
+"""
+Estado estable de ocupación por espacio (histéresis + tiempo mínimo de permanencia).
+
+El detector da, en cada frame, una fracción de píxeles activos por ROI. Usarla directamente
+(`ratio > umbral`) produce parpadeos: un peatón que cruza marca 'Ocupado' durante un frame,
+y un coche quieto que MOG2 absorbe en el fondo vuelve a 'Libre'. OccupancyTracker solo
+confirma un cambio cuando el dato crudo lo contradice de forma sostenida:
+
+  - Libre -> Ocupado: ratio > enter_ratio durante al menos enter_dwell segundos
+  - Ocupado -> Libre: ratio <= exit_ratio durante al menos exit_dwell segundos
+
+Con exit_ratio < enter_ratio la zona intermedia no cambia nada (histéresis). Todo el
+estado son arrays NumPy de longitud n_espacios y cada update() es O(n) vectorizado.
+Cada cambio confirmado se añade a un flujo de eventos numerados.
+"""
+
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+OCCUPANCY_ENTER_RATIO = float(os.environ.get('OCCUPANCY_ENTER_RATIO', os.environ.get('AREA_OCCUPIED_RATIO', 0.02)))
+OCCUPANCY_EXIT_RATIO = float(os.environ.get('OCCUPANCY_EXIT_RATIO', OCCUPANCY_ENTER_RATIO * 0.5))
+OCCUPANCY_ENTER_DWELL = float(os.environ.get('OCCUPANCY_ENTER_DWELL', 1.0))  # segundos
+OCCUPANCY_EXIT_DWELL = float(os.environ.get('OCCUPANCY_EXIT_DWELL', 3.0))    # segundos
+OCCUPANCY_EVENTS = int(os.environ.get('OCCUPANCY_EVENTS', 1024))             # eventos guardados
+
+
+class OccupancyTracker:
+    def __init__(self, n, enter_ratio=OCCUPANCY_ENTER_RATIO, exit_ratio=OCCUPANCY_EXIT_RATIO,
+                 enter_dwell=OCCUPANCY_ENTER_DWELL, exit_dwell=OCCUPANCY_EXIT_DWELL, max_events=OCCUPANCY_EVENTS,
+                 event_seq=0):
+        if exit_ratio > enter_ratio:
+            raise ValueError('exit_ratio no puede ser mayor que enter_ratio')
+        self.enter_ratio = enter_ratio
+        self.exit_ratio = exit_ratio
+        self.enter_dwell = enter_dwell
+        self.exit_dwell = exit_dwell
+        self.state = np.zeros(n, dtype=bool)         # estado confirmado
+        self._since = np.full(n, np.nan)             # desde cuándo el dato crudo contradice al estado
+        self.events = deque(maxlen=max_events)       # (seq, timestamp, indice, ocupado)
+        self.event_seq = event_seq  # permite continuar la numeración al cambiar de layout
+
+    def __len__(self):
+        return len(self.state)
+
+    def update(self, ratios, now=None, wall_time=None):
+        """Aplicar las fracciones de un frame. Devuelve los índices que cambiaron de estado"""
+        now = time.monotonic() if now is None else now
+        ratios = np.asarray(ratios, dtype=np.float64)
+
+        # ¿El dato crudo contradice al estado actual?
+        contradict = np.where(self.state, ratios <= self.exit_ratio, ratios > self.enter_ratio)
+        self._since[~contradict] = np.nan
+        self._since[contradict & np.isnan(self._since)] = now
+
+        dwell = np.where(self.state, self.exit_dwell, self.enter_dwell)
+        flip = contradict & ((now - self._since) >= dwell)
+        flipped = np.flatnonzero(flip)
+        if flipped.size:
+            self.state[flipped] = ~self.state[flipped]
+            self._since[flipped] = np.nan
+            ts = time.time() if wall_time is None else wall_time
+            for idx in flipped.tolist():
+                self.event_seq += 1
+                self.events.append((self.event_seq, ts, idx, bool(self.state[idx])))
+        return flipped
+
+    def events_since(self, seq):
+        """Eventos confirmados con número > seq"""
+        return [e for e in list(self.events) if e[0] > seq]
@@ -0,0 +1,234 @@
+"""
+Re-análisis offline de vídeo grabado (sin ventanas, sin esperar a tiempo real).
+
+Usa la misma lógica que VideoProcessor (app_camera.score_frame: resize, recorte a las
+ROI, motor de detectors.py y OccupancyTracker con el tiempo del vídeo) para generar una
+línea de tiempo de ocupación por frame. Cada vídeo se parte en segmentos de --segment
+segundos que se reparten en un pool de procesos; cada segmento empieza --warmup segundos
+antes para que el modelo de fondo (MOG2) y el tracker lleguen estabilizados, y esos
+frames de calentamiento no se guardan.
+
+Salida por vídeo (y por combinación de parámetros en un barrido):
+  <out>/<video>[__param-valor...].npy    estado por frame, np.packbits por espacio (uint8)
+  <out>/<video>[__param-valor...].json   metadatos (fps, frames, espacios, parámetros...)
+  <out>/<video>[...].ratios.npy          fracción activa por frame y espacio (float16, --ratios)
+
+Uso:
+  python reanalisis.py video.mp4
+  python reanalisis.py grabaciones/*.mp4 --workers 8 --segment 300 --out timelines/
+  python reanalisis.py video.mp4 --sweep MOG_VAR_THRESHOLD=16,25,40 --sweep AREA_OCCUPIED_RATIO=0.01,0.02,0.04
+
+Los nombres del barrido son las variables de entorno de la configuración (o directamente
+los argumentos del motor, p. ej. var_threshold). load_timeline(path) devuelve el array
+booleano (frames, espacios).
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import app_camera
+from detectors import DETECTORS, create_detector
+from layout_store import load_espacios
+from occupancy import OccupancyTracker
+
+# Variables de configuración -> argumento del motor de detección
+SWEEP_PARAMS = {
+    'MOG_VAR_THRESHOLD': 'var_threshold',
+    'MOG_HISTORY': 'history',
+    'AREA_OCCUPIED_RATIO': 'enter_ratio',
+    'OCCUPANCY_ENTER_RATIO': 'enter_ratio',
+    'OCCUPANCY_EXIT_RATIO': 'exit_ratio',
+    'ADAPTIVE_OCCUPIED_RATIO': 'enter_ratio',
+    'REFERENCE_OCCUPIED_RATIO': 'enter_ratio',
+    'REFERENCE_DIFF_THRESHOLD': 'diff_threshold',
+}
+
+
+def parse_sweep(items):
+    """['MOG_VAR_THRESHOLD=16,25', ...] -> lista de dicts de opciones del motor (producto cartesiano)"""
+    axes = []
+    for item in items or []:
+        name, _, values = item.partition('=')
+        if not values:
+            raise ValueError(f'--sweep espera NOMBRE=v1,v2,... y recibió {item!r}')
+        key = SWEEP_PARAMS.get(name.strip().upper(), name.strip())
+        axes.append([(key, float(v)) for v in values.split(',')])
+    return [dict(combo) for combo in itertools.product(*axes)] or [{}]
+
+
+def build_detector(name, options):
+    """Motor con `options`; si solo cambia enter_ratio, exit_ratio conserva la proporción por defecto"""
+    options = dict(options)
+    if 'history' in options:
+        options['history'] = int(options['history'])
+    if 'diff_threshold' in options:
+        options['diff_threshold'] = int(options['diff_threshold'])
+    if 'enter_ratio' in options and 'exit_ratio' not in options:
+        default = create_detector(name, **{k: v for k, v in options.items() if k in ('reference',)})
+        options['exit_ratio'] = options['enter_ratio'] * default.exit_ratio / default.enter_ratio
+    return create_detector(name, **options)
+
+
+def combo_label(options):
+    return '__'.join(f'{k}-{v:g}' for k, v in options.items() if k != 'reference')
+
+
+def video_info(path):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise FileNotFoundError(f'No se pudo abrir {path}')
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return fps, frames
+
+
+def analyze_segment(path, start, end, warmup, espacios, detector, combos, roi_crop, scale, keep_ratios):
+    """Analizar los frames [start, end) de `path` (tras `warmup` frames previos) con cada combinación.
+
+    Devuelve (start, [estados (n_frames, n) bool por combinación], [ratios o None], frames leídos).
+    """
+    fps, _ = video_info(path)
+    layout = app_camera.RoiLayout(espacios)
+    crop = app_camera.RoiCrop(layout, roi_crop, scale)
+    engines = [build_detector(detector, opts) for opts in combos]
+    trackers = [OccupancyTracker(len(layout), d.enter_ratio, d.exit_ratio) for d in engines]
+
+    first = max(0, start - warmup)
+    cap = cv2.VideoCapture(path)
+    if first:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    states = [[] for _ in combos]
+    ratios_out = [[] for _ in combos] if keep_ratios else None
+    n = first
+    while n < end:
+        ok, frame = cap.read()
+        if not ok or frame is None:
+            break
+        # Una sola decodificación y redimensión por frame para todas las combinaciones
+        frame_resized = cv2.resize(frame, (layout.width, layout.height))
+        t = n / fps
+        for k, (engine, tracker) in enumerate(zip(engines, trackers)):
+            _, ratios = app_camera.score_frame(frame_resized, crop, engine)
+            tracker.update(ratios, now=t, wall_time=t)
+            if n >= start:
+                states[k].append(tracker.state.copy())
+                if keep_ratios:
+                    ratios_out[k].append(ratios.astype(np.float16))
+        n += 1
+    cap.release()
+
+    empty = np.zeros((0, len(layout)), bool)
+    states = [np.array(s, bool) if s else empty for s in states]
+    if keep_ratios:
+        ratios_out = [np.array(r, np.float16) if r else empty.astype(np.float16) for r in ratios_out]
+    return start, states, ratios_out, n - first
+
+
+def _init_worker():
+    # Un hilo de OpenCV por proceso: el paralelismo lo da el pool, no los hilos internos
+    cv2.setNumThreads(1)
+
+
+def segments(frames, fps, segment_seconds):
+    step = max(1, int(round(segment_seconds * fps)))
+    return [(s, min(frames, s + step)) for s in range(0, frames, step)]
+
+
+def save_timeline(base, state, meta, ratios=None):
+    """Guardar el estado empaquetado (1 bit por espacio y frame) + metadatos JSON"""
+    np.save(base + '.npy', np.packbits(state, axis=1))
+    if ratios is not None:
+        np.save(base + '.ratios.npy', ratios)
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_timeline(path):
+    """Array booleano (frames, espacios) a partir de un .npy generado por este script"""
+    base = path[:-4] if path.endswith('.npy') else path
+    with open(base + '.json', 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    return np.unpackbits(np.load(base + '.npy'), axis=1, count=meta['spaces']).astype(bool)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('videos', nargs='+')
+    parser.add_argument('--espacios', default=app_camera.ESPACIOS_PKL)
+    parser.add_argument('--detector', default=app_camera.DETECTOR, choices=sorted(DETECTORS))
+    parser.add_argument('--reference', help="imagen del lote vacío para --detector reference")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--segment', type=float, default=120.0, help='segundos de vídeo por tarea')
+    parser.add_argument('--warmup', type=float, default=15.0, help='segundos previos para estabilizar el fondo')
+    parser.add_argument('--roi-crop', default=app_camera.ROI_CROP)
+    parser.add_argument('--scale', type=float, default=app_camera.ANALYSIS_SCALE)
+    parser.add_argument('--sweep', action='append', help='NOMBRE=v1,v2,... (repetible)')
+    parser.add_argument('--ratios', action='store_true', help='guardar también las fracciones por frame')
+    parser.add_argument('--out', default='timelines')
+    args = parser.parse_args()
+
+    espacios = load_espacios(args.espacios)
+    if not espacios:
+        parser.error(f'{args.espacios}: no hay layout de ROI (genera uno con obtener_espacios.py)')
+    combos = parse_sweep(args.sweep)
+    if args.reference:
+        combos = [dict(c, reference=args.reference) for c in combos]
+    os.makedirs(args.out, exist_ok=True)
+
+    jobs = []
+    for path in args.videos:
+        fps, frames = video_info(path)
+        for start, end in segments(frames, fps, args.segment):
+            jobs.append((path, start, end, int(round(args.warmup * fps))))
+    print(f'{len(args.videos)} vídeo(s), {len(jobs)} segmento(s), {len(combos)} combinación(es), {args.workers} proceso(s)')
+
+    t0 = time.perf_counter()
+    results = {}
+    decoded = 0
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx, initializer=_init_worker) as pool:
+        futures = [
+            (path, pool.submit(analyze_segment, path, start, end, warmup, espacios, args.detector, combos,
+                               args.roi_crop, args.scale, args.ratios))
+            for path, start, end, warmup in jobs
+        ]
+        for path, future in futures:
+            start, states, ratios, n_read = future.result()
+            decoded += n_read
+            results.setdefault(path, []).append((start, states, ratios))
+    elapsed = time.perf_counter() - t0
+
+    total = 0
+    for path, parts in results.items():
+        parts.sort(key=lambda p: p[0])
+        fps, _ = video_info(path)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        for k, opts in enumerate(combos):
+            state = np.concatenate([p[1][k] for p in parts])
+            ratios = np.concatenate([p[2][k] for p in parts]) if args.ratios else None
+            label = combo_label(opts)
+            base = os.path.join(args.out, stem + (f'__{label}' if label else ''))
+            meta = {'video': path, 'fps': fps, 'frames': int(len(state)), 'spaces': len(espacios),
+                    'detector': args.detector, 'params': opts, 'roi_crop': args.roi_crop, 'scale': args.scale,
+                    'segment_seconds': args.segment, 'warmup_seconds': args.warmup, 'packed': True}
+            save_timeline(base, state, meta, ratios)
+            transitions = int(np.count_nonzero(state[1:] != state[:-1])) if len(state) > 1 else 0
+            occupancy = float(state.mean()) if state.size else 0.0
+            print(f'  {base}.npy  frames={len(state)}  ocupación media={occupancy:.1%}  transiciones={transitions}')
+        total += len(state)
+
+    print(f'{total} frames útiles ({decoded} decodificados) en {elapsed:.1f} s: '
+          f'{total / elapsed:.1f} frames/s por combinación, {total * len(combos) / elapsed:.1f} análisis/s')
+
+
+if __name__ == '__main__':
+    main()
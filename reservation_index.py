@@ -0,0 +1,137 @@
+"""
+Índice en memoria de las reservas activas (vigentes ahora o futuras).
+
+Evita ir a SQLite en cada sondeo de /api/reservas_activas: el conjunto de espacios
+reservados solo cambia cuando se crea o cancela una reserva (write-through desde
+database.Database) o cuando empieza o termina una. Estructura:
+
+  - _reserved: dict número de espacio -> reservas vigentes en ese espacio (solo los que
+    tienen alguna: el tamaño no depende del número de espacio más alto)
+  - _heap: montículo de (instante, orden, id) con los inicios y fines pendientes; en cada
+    lectura solo se compara la cima con la hora actual y, si ya pasó, se avanza
+  - _snapshot: (versión, tupla ordenada de espacios reservados), recalculada solo cuando
+    cambia algo y publicada con una sola asignación (los lectores no toman el lock)
+
+Cada cambio incrementa `version`, que junto a `token` (distinto en cada proceso) sirve
+de ETag. Con varios procesos web cada uno tiene su índice: las reservas creadas por otro
+proceso no se ven hasta Database.reload_active_index().
+"""
+
+import heapq
+import threading
+import uuid
+from datetime import datetime
+
+_END, _START = 0, 1  # a igual instante se procesan antes los fines (reservas contiguas)
+
+
+class ActiveReservationIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._live = {}            # id -> [espacio, inicio, fin, empezada]
+        self._heap = []
+        self._reserved = {}
+        self._snapshot = (0, ())     # (versión, espacios reservados): se reemplaza entero
+        self.token = uuid.uuid4().hex[:8]
+
+    def load(self, rows, now=None):
+        """Reemplazar el contenido por `rows` = [(id, espacio, inicio, fin)] (datetimes o ISO)"""
+        now = now or datetime.now()
+        with self._lock:
+            self._live.clear()
+            self._heap = []
+            self._reserved = {}
+            for rid, space, start, end in rows:
+                self._insert(int(rid), int(space), _as_datetime(start), _as_datetime(end), now)
+            self._advance(now)
+            self._publish()
+
+    # ----------------- Escritura (write-through) -----------------
+    def add(self, rid, space, start, end, now=None):
+        now = now or datetime.now()
+        with self._lock:
+            if self._insert(int(rid), int(space), start, end, now):
+                self._advance(now)
+                self._publish()
+
+    def remove(self, rid):
+        """Quitar una reserva (cancelada); sus entradas del montículo quedan obsoletas"""
+        with self._lock:
+            r = self._live.pop(int(rid), None)
+            if r is not None and r[3]:
+                self._release(r[0])
+                self._publish()
+
+    def _insert(self, rid, space, start, end, now):
+        if end <= now or rid in self._live:
+            return False
+        self._live[rid] = [space, start, end, False]
+        heapq.heappush(self._heap, (start, _START, rid))
+        heapq.heappush(self._heap, (end, _END, rid))
+        return True
+
+    # ----------------- Avance temporal -----------------
+    def _advance(self, now):
+        """Aplicar los inicios/fines con instante <= now. Devuelve True si cambió algo"""
+        changed = False
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, kind, rid = heapq.heappop(heap)
+            r = self._live.get(rid)
+            if r is None:
+                continue  # cancelada
+            if kind == _START and not r[3]:
+                r[3] = True
+                self._reserved[r[0]] = self._reserved.get(r[0], 0) + 1
+                changed = True
+            elif kind == _END:
+                if r[3]:
+                    self._release(r[0])
+                    changed = True
+                del self._live[rid]
+        return changed
+
+    def _release(self, space):
+        n = self._reserved.pop(space) - 1
+        if n:
+            self._reserved[space] = n
+
+    def _publish(self):
+        active = tuple(sorted(self._reserved))
+        self._snapshot = (self._snapshot[0] + 1, active)
+
+    @property
+    def version(self):
+        return self._snapshot[0]
+
+    # ----------------- Lectura -----------------
+    def snapshot(self, now=None):
+        """(version, tupla de espacios reservados ahora). Sin SQL; O(1) si no hay eventos vencidos"""
+        now = now or datetime.now()
+        try:
+            due = self._heap[0][0] <= now
+        except IndexError:
+            due = False
+        if due:
+            with self._lock:
+                if self._advance(now):
+                    self._publish()
+        return self._snapshot
+
+    def etag(self, now=None):
+        version, _ = self.snapshot(now)
+        return f'{self.token}-{version}'
+
+    def next_event(self):
+        """Instante del próximo inicio o fin pendiente (None si no hay)"""
+        with self._lock:
+            while self._heap and self._heap[0][2] not in self._live:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return len(self._live)
+
+
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
@@ -1,10 +1,41 @@
-from flask import Blueprint, request, jsonify, session
-from database import db
+from datetime import datetime
+from flask import Blueprint, Response, current_app, request, jsonify, session
+from database import db, RESERVATION_MAX_HOURS
 from auth import login_required
 
 # Crear Blueprint para reservas
 reservations_bp = Blueprint('reservations', __name__)
 
+def parse_time(value):
+    """Fecha ISO 8601 -> datetime local sin zona (como se guardan las reservas); None si no viene"""
+    if value in (None, ''):
+        return None
+    dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
+
+def json_with_etag(etag, build):
+    """Responder 304 si el cliente ya tiene `etag`; si no, construir el JSON con build()"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def parse_space_number(value):
+    """Número de espacio entre 1 y el tamaño del lote (LOT_SIZE, lo pone create_app); None si no es válido"""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        return None  # 2.5, '3a', true...
+    lot_size = current_app.config.get('LOT_SIZE')
+    if value < 1 or (lot_size is not None and value > lot_size()):
+        return None
+    return value
+
 @reservations_bp.route('/api/reservar', methods=['POST'])
 @login_required
 def reservar_espacio():
@@ -15,11 +46,26 @@ def reservar_espacio():
     
     if not space_number:
         return jsonify({'success': False, 'message': 'Número de espacio requerido'}), 400
+    space_number = parse_space_number(space_number)
+    if space_number is None:
+        return jsonify({'success': False, 'message': 'Número de espacio inválido'}), 400
+
+    # Ventana opcional en el futuro: start_time en ISO 8601 (por defecto, ahora)
+    try:
+        duration = float(duration)
+        start_time = parse_time(data.get('start_time'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'start_time o duration inválidos'}), 400
+    if not 0 < duration <= RESERVATION_MAX_HOURS:
+        return jsonify({'success': False, 'message': f'La duración debe estar entre 0 y {RESERVATION_MAX_HOURS:g} horas'}), 400
+    if start_time is not None and start_time < datetime.now().replace(second=0, microsecond=0):
+        return jsonify({'success': False, 'message': 'No se puede reservar en el pasado'}), 400
     
-    if db.create_reservation(session['user_id'], space_number, duration):
+    if db.create_reservation(session['user_id'], space_number, duration, start_time):
+        when = f" desde {start_time:%d/%m %H:%M}" if start_time else ''
         return jsonify({
             'success': True, 
-            'message': f'Espacio {space_number} reservado por {duration} hora(s)'
+            'message': f'Espacio {space_number} reservado{when} por {duration:g} hora(s)'
         })
     else:
         return jsonify({
@@ -52,5 +98,5 @@ def cancelar_reserva():
 @reservations_bp.route('/api/reservas_activas')
 def reservas_activas():
     """API pública para obtener espacios reservados (usado por el procesador de video)"""
-    reserved_spaces = db.get_active_reservations()
-    return jsonify(reserved_spaces)
\ No newline at end of file
+    # ETag por versión del índice en memoria: si nada cambió, 304 sin construir la lista
+    return json_with_etag(db.active_index.etag(), db.get_active_reservations)
@@ -0,0 +1,195 @@
+"""
+Índice espacial de los espacios del lote: los k espacios libres y sin reserva más
+cercanos a uno o varios puntos de entrada.
+
+GridIndex reparte los centros de los ROI en una rejilla uniforme (celdas de unos
+GRID_POINTS_PER_CELL centros de media) guardada en forma compacta: los ids ordenados por
+celda y el inicio de cada celda, así una fila de celdas contiguas es un solo slice.
+Una consulta recorre anillos de celdas alrededor del punto, descarta con la máscara de
+disponibles los espacios ocupados o reservados y para en cuanto ningún anillo pendiente
+puede mejorar el k-ésimo candidato (un anillo r+1 está a más de r celdas del punto).
+
+NearestFreeSpaces junta el índice con el estado del lote (CameraRegistry) y las reservas
+activas (database.Database.get_active_snapshot):
+  - el índice se construye una vez por versión de layout (y de transformación) de las cámaras
+  - la máscara de disponibles se recalcula solo cuando cambia el ETag del lote o la
+    versión de las reservas
+  - las coordenadas son las del lote: cada cámara pasa de píxeles de su imagen a
+    coordenadas del lote con su "lot_transform" (cameras.json, homografía 3x3 o afín 2x3;
+    sin ella, la identidad). Un punto de entrada con cámara está en píxeles de esa cámara.
+"""
+
+import math
+import os
+import threading
+
+import numpy as np
+
+GRID_POINTS_PER_CELL = float(os.environ.get('GRID_POINTS_PER_CELL', 4.0))
+NEAREST_MAX_K = int(os.environ.get('NEAREST_MAX_K', 20))  # tope de resultados por consulta
+
+
+def as_transform(matrix):
+    """Homografía 3x3 desde una matriz 3x3 o afín 2x3 (None = identidad)"""
+    if matrix is None:
+        return None
+    m = np.asarray(matrix, dtype=np.float64)
+    if m.shape == (2, 3):
+        m = np.vstack([m, [0.0, 0.0, 1.0]])
+    if m.shape != (3, 3):
+        raise ValueError(f'lot_transform debe ser una matriz 3x3 o 2x3, no {m.shape}')
+    return m
+
+
+def apply_transform(matrix, points):
+    """Aplicar una homografía (o None = identidad) a un array Nx2 de puntos"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if matrix is None:
+        return points
+    h = points @ matrix[:, :2].T + matrix[:, 2]
+    return h[:, :2] / h[:, 2:3]
+
+
+class GridIndex:
+    """Rejilla uniforme sobre puntos 2D para consultas de k vecinos con filtro"""
+
+    def __init__(self, points, per_cell=GRID_POINTS_PER_CELL):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        n = len(self.points)
+        lo = self.points.min(axis=0) if n else np.zeros(2)
+        span = (self.points.max(axis=0) - lo) if n else np.zeros(2)
+        cells = max(1.0, n / per_cell)
+        area = span[0] * span[1]
+        # Celdas cuadradas con ~per_cell puntos si se reparten uniformemente (o en una línea)
+        cell = math.sqrt(area / cells) if area > 0 else float(span.max()) / cells
+        self.cell = cell if cell > 0 else 1.0
+        self.origin = lo
+        self.gx, self.gy = (int(v) + 1 for v in np.floor(span / self.cell))
+        cx, cy = self._cells(self.points)
+        keys = cy * self.gx + cx
+        self.order = np.argsort(keys, kind='stable')
+        self.starts = np.searchsorted(keys[self.order], np.arange(self.gx * self.gy + 1))
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cells(self, points):
+        c = np.floor((points - self.origin) / self.cell).astype(np.int64)
+        return np.clip(c[:, 0], 0, self.gx - 1), np.clip(c[:, 1], 0, self.gy - 1)
+
+    def _span(self, y, x0, x1):
+        row = y * self.gx
+        return self.order[self.starts[row + x0]:self.starts[row + x1 + 1]]
+
+    def _ring(self, cx, cy, r):
+        """Ids de las celdas a distancia de Chebyshev exactamente r de (cx, cy)"""
+        if r == 0:
+            return self._span(cy, cx, cx)
+        parts = []
+        x0, x1 = max(cx - r, 0), min(cx + r, self.gx - 1)
+        for y in (cy - r, cy + r):
+            if 0 <= y < self.gy:
+                parts.append(self._span(y, x0, x1))
+        for y in range(max(cy - r + 1, 0), min(cy + r - 1, self.gy - 1) + 1):
+            if cx - r >= 0:
+                parts.append(self._span(y, cx - r, cx - r))
+            if cx + r < self.gx:
+                parts.append(self._span(y, cx + r, cx + r))
+        return np.concatenate(parts) if parts else self.order[:0]
+
+    def query(self, point, k, available=None):
+        """(ids, distancias) de los k puntos más cercanos a `point` con available[id] True"""
+        if not len(self.points) or k <= 0:
+            return self.order[:0], np.zeros(0)
+        x, y = float(point[0]), float(point[1])
+        cx = min(max(int((x - self.origin[0]) // self.cell), 0), self.gx - 1)
+        cy = min(max(int((y - self.origin[1]) // self.cell), 0), self.gy - 1)
+        last = max(cx, self.gx - 1 - cx, cy, self.gy - 1 - cy)
+        ids, d = self.order[:0], np.zeros(0)
+        for r in range(last + 1):
+            ring = self._ring(cx, cy, r)
+            if available is not None and ring.size:
+                ring = ring[available[ring]]
+            if ring.size:
+                ids = np.concatenate([ids, ring])
+                d = np.concatenate([d, np.hypot(self.points[ring, 0] - x, self.points[ring, 1] - y)])
+            # Los anillos que faltan están a más de r celdas: si el k-ésimo ya está más cerca, parar
+            if len(d) >= k and np.partition(d, k - 1)[k - 1] <= r * self.cell:
+                break
+        best = np.argsort(d, kind='stable')[:k]
+        return ids[best], d[best]
+
+    def nearest(self, points, k, available=None):
+        """[(id, distancia, entrada)] de los k puntos más cercanos a cualquiera de `points`"""
+        best = {}
+        for entry, point in enumerate(np.asarray(points, dtype=np.float64).reshape(-1, 2)):
+            for i, d in zip(*self.query(point, k, available)):
+                i = int(i)
+                if i not in best or d < best[i][0]:
+                    best[i] = (float(d), entry)
+        ranked = sorted(best.items(), key=lambda item: (item[1][0], item[0]))[:k]
+        return [(i, d, entry) for i, (d, entry) in ranked]
+
+
+class NearestFreeSpaces:
+    """Consultas de espacios libres cercanos sobre todo el lote (varias cámaras)"""
+
+    def __init__(self, registry, get_reserved):
+        self.registry = registry
+        self.get_reserved = get_reserved  # () -> (versión, números de espacio reservados ahora)
+        self._lock = threading.Lock()
+        self._index = None    # (layouts con los que se construyó, GridIndex, espacios del lote)
+        self._mask = None     # (clave, disponibles)
+
+    def _layouts(self):
+        return [(cid, self.registry.config(cid).espacios, self.registry.config(cid).lot_transform)
+                for cid in self.registry.ids()]
+
+    def _get_index(self):
+        layouts = self._layouts()
+        cached = self._index
+        if cached is not None and len(cached[0]) == len(layouts) and all(
+                a[0] == b[0] and a[1] is b[1] and a[2] is b[2] for a, b in zip(cached[0], layouts)):
+            return cached[1], cached[2]
+        with self._lock:
+            espacios = self.registry.lot_espacios()
+            centers = np.array([(e['x'] + e['w'] / 2.0, e['y'] + e['h'] / 2.0) for e in espacios],
+                               dtype=np.float64).reshape(-1, 2)
+            cams = np.array([e['camara'] for e in espacios], dtype=object)
+            for cid, _, transform in layouts:
+                sel = cams == cid
+                if transform is not None and sel.any():
+                    centers[sel] = apply_transform(transform, centers[sel])
+            index = GridIndex(centers)
+            self._index = (layouts, index, espacios)
+            return index, espacios
+
+    def _available(self, n):
+        """Máscara de espacios libres y sin reserva (recalculada solo si cambió algo)"""
+        version, reserved = self.get_reserved()
+        key = (self.registry.lot_etag(), version)
+        cached = self._mask
+        if cached is not None and cached[0] == key and len(cached[1]) == n:
+            return cached[1]
+        available = ~np.array(self.registry.lot_estado(), dtype=bool)[:n]
+        numbers = np.fromiter((int(s) for s in reserved), dtype=np.int64) - 1
+        available[numbers[(numbers >= 0) & (numbers < len(available))]] = False
+        self._mask = (key, available)
+        return available
+
+    def query(self, points, k=5, camera=None):
+        """Los k espacios disponibles más cercanos a `points` (del lote, o de la imagen de `camera`)"""
+        k = max(1, min(int(k), NEAREST_MAX_K))
+        if camera is not None:
+            points = apply_transform(self.registry.config(camera).lot_transform, points)
+        index, espacios = self._get_index()
+        available = self._available(len(espacios))
+        if len(available) < len(espacios):
+            available = np.concatenate([available, np.zeros(len(espacios) - len(available), bool)])
+        result = []
+        for i, d, entry in index.nearest(points, k, available):
+            item = dict(espacios[i])
+            item['distancia'] = round(d, 2)
+            item['entrada'] = entry
+            result.append(item)
+        return {'espacios': result, 'disponibles': int(available.sum())}
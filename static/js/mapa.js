@@ -11,6 +11,7 @@ const POLL_INTERVAL = 1000; // ms
 const FALLBACK_ENDPOINT_ESTADOS = '/estado_espacios'; // endpoint antiguo (si existe)
 const API_ESTADOS = '/api/estado'; // devuelve [true,false,...] si está disponible
 const API_ESPACIOS = '/api/espacios'; // devuelve [[x,y,w,h], ...] en resoluciones naturales
+const API_STREAM = '/api/stream/estado'; // SSE: snapshot + deltas [indice, ocupado, reservado]
 const VIDEO_FEED = '/video_feed';
 const SNAPSHOT = '/snapshot'; // para calibración
 
@@ -202,6 +203,34 @@ async function loadEstadoFromServer() {
   // si todo falla, no hacer nada
 }
 
+/* ----------------- Estado por Server-Sent Events ----------------- */
+// Devuelve false si no se puede usar SSE; si el servidor no expone el stream se vuelve al poll.
+function startEstadoStream() {
+  if (!window.EventSource) return false;
+  const es = new EventSource(API_STREAM);
+  let gotMessage = false;
+  es.addEventListener('snapshot', ev => {
+    gotMessage = true;
+    const d = JSON.parse(ev.data);
+    estados = d.estado.map(s => s[0]);
+    drawOverlay();
+  });
+  es.addEventListener('delta', ev => {
+    gotMessage = true;
+    const d = JSON.parse(ev.data);
+    d.changes.forEach(([i, ocupado]) => { estados[i] = ocupado; });
+    drawOverlay();
+  });
+  es.onerror = () => {
+    // tras un corte el navegador reconecta solo (enviando Last-Event-ID)
+    if (!gotMessage) {
+      es.close();
+      setInterval(loadEstadoFromServer, POLL_INTERVAL);
+    }
+  };
+  return true;
+}
+
 /* ----------------- Snapshot (para calibración) ----------------- */
 async function loadSnapshotAndStart() {
   // pedir snapshot; el servidor debe exponer /snapshot
@@ -446,9 +475,9 @@ async function initMapSystem() {
       actualizarEstadoMapa();
     }
   } else {
-    // modo cámara: poll estado y redibujar overlay
-    setInterval(loadEstadoFromServer, POLL_INTERVAL);
+    // modo cámara: recibir estado por SSE (o poll si el navegador/servidor no lo soporta) y redibujar overlay
     await loadEstadoFromServer();
+    if (!startEstadoStream()) setInterval(loadEstadoFromServer, POLL_INTERVAL);
   }
   // redimensionar overlay cuando cambie la ventana
   window.addEventListener('resize', () => {
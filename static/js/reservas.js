@@ -2,6 +2,7 @@
 const POLL_INTERVAL = 1000;
 const API_ESTADOS = '/api/estado';
 const LEGACY_ESTADOS = '/estado_espacios';
+const API_STREAM = '/api/stream/estado'; // SSE: snapshot + deltas [indice, ocupado, reservado]
 
 let selectedSpace = null;
 let estadoActual = {};
@@ -95,9 +96,45 @@ async function reservarEspacio(id, minutes) {
   }
 }
 
+/* Estado por Server-Sent Events; devuelve false si no se puede usar (se sigue con poll) */
+function pintarEspacio(id) {
+  const el = document.querySelector(`[data-space='${id}']`);
+  if (el) {
+    const st = estadoActual[id];
+    el.classList.toggle('ocupado', st.ocupado);
+    el.classList.toggle('reservado', st.reservado);
+  }
+}
+
+function iniciarStreamReservas() {
+  if (!window.EventSource) return false;
+  const es = new EventSource(API_STREAM);
+  let gotMessage = false;
+  const aplicar = ([i, ocupado, reservado]) => {
+    estadoActual[i + 1] = {ocupado: !!ocupado, reservado: !!reservado};
+    pintarEspacio(i + 1);
+  };
+  es.addEventListener('snapshot', ev => {
+    gotMessage = true;
+    estadoActual = {};
+    JSON.parse(ev.data).estado.forEach((s, i) => aplicar([i, s[0], s[1]]));
+  });
+  es.addEventListener('delta', ev => {
+    gotMessage = true;
+    JSON.parse(ev.data).changes.forEach(aplicar);
+  });
+  es.onerror = () => {
+    if (!gotMessage) {
+      es.close();
+      setInterval(actualizarUIReservas, POLL_INTERVAL);
+    }
+  };
+  return true;
+}
+
 /* Inicialización */
 document.addEventListener('DOMContentLoaded', () => {
   inicializarLayoutReservasCustom();
-  setInterval(actualizarUIReservas, POLL_INTERVAL);
   actualizarUIReservas();
+  if (!iniciarStreamReservas()) setInterval(actualizarUIReservas, POLL_INTERVAL);
 });
@@ -1,6 +1,8 @@
 /* script.js - scripts genéricos de la landing */
 const API_ESTADOS = '/api/estado';
 const LEGACY_ESTADOS = '/estado_espacios';
+const API_STREAM = '/api/stream/estado'; // SSE: snapshot + deltas [indice, ocupado, reservado]
+const POLL_INTERVAL = 5000;
 
 async function fetchEstadoForStats() {
   try {
@@ -24,9 +26,7 @@ async function fetchEstadoForStats() {
   return null;
 }
 
-async function actualizarEstadisticasLanding() {
-  const estados = await fetchEstadoForStats();
-  if (!Array.isArray(estados)) return;
+function mostrarEstadisticas(estados) {
   const total = estados.length;
   const ocupados = estados.filter(Boolean).length;
   const libres = total - ocupados;
@@ -37,7 +37,42 @@ async function actualizarEstadisticasLanding() {
   if (document.getElementById('lastUpdate')) document.getElementById('lastUpdate').textContent = new Date().toLocaleTimeString();
 }
 
+async function actualizarEstadisticasLanding() {
+  const estados = await fetchEstadoForStats();
+  if (!Array.isArray(estados)) return;
+  mostrarEstadisticas(estados);
+}
+
+/* Estado por Server-Sent Events (como mapa.js y reservas.js); false si no se puede usar */
+function iniciarStreamLanding() {
+  if (!window.EventSource) return false;
+  const es = new EventSource(API_STREAM);
+  let estados = [];
+  let gotMessage = false;
+  es.addEventListener('snapshot', ev => {
+    gotMessage = true;
+    estados = JSON.parse(ev.data).estado.map(s => !!s[0]);
+    mostrarEstadisticas(estados);
+  });
+  es.addEventListener('delta', ev => {
+    gotMessage = true;
+    JSON.parse(ev.data).changes.forEach(([i, ocupado]) => { estados[i] = !!ocupado; });
+    mostrarEstadisticas(estados);
+  });
+  es.onerror = () => {
+    // tras un corte el navegador reconecta solo; si el stream nunca respondió, volver al poll
+    if (!gotMessage) {
+      es.close();
+      actualizarEstadisticasLanding();
+      setInterval(actualizarEstadisticasLanding, POLL_INTERVAL);
+    }
+  };
+  return true;
+}
+
 document.addEventListener('DOMContentLoaded', () => {
-  actualizarEstadisticasLanding();
-  setInterval(actualizarEstadisticasLanding, 5000);
+  if (!iniciarStreamLanding()) {
+    actualizarEstadisticasLanding();
+    setInterval(actualizarEstadisticasLanding, POLL_INTERVAL);
+  }
 });